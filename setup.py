@@ -16,6 +16,12 @@ setup(
     entry_points={'console_scripts':
                   ['pyHepGrid = pyHepGrid.main:main',
                    'pyHepGrid_get_site_info = '
-                   'pyHepGrid.extras.get_site_info:main'],
+                   'pyHepGrid.extras.get_site_info:main',
+                   'pyHepGrid_db_benchmark = '
+                   'pyHepGrid.extras.db_benchmark:main',
+                   'pyHepGrid_executor_benchmark = '
+                   'pyHepGrid.extras.executor_benchmark:main',
+                   'pyHepGrid_fake_grid = '
+                   'pyHepGrid.extras.fake_grid:main'],
                   },
 )
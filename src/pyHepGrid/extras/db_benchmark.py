@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the database operations on the management hot paths.
+
+Generates a synthetic pyHepGrid database (by default 5k runs and 2M subjobs
+spread over the arc, dirac and slurm tables) and times the operations used
+by every `pyHepGrid man` invocation, reporting ops/sec and the peak memory
+allocated by python during each of them.
+
+    pyHepGrid_db_benchmark --runs 5000 --subjobs 2000000
+"""
+import argparse
+import contextlib
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+STATUSES = [None, 0, 1, 2, -1, 98, 99]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Time the database operations of pyHepGrid management "
+        "on a synthetic database")
+    parser.add_argument("--runs", "-r", help="Number of runs in the database",
+                        type=int, default=5000)
+    parser.add_argument("--subjobs", "-s",
+                        help="Total number of subjobs in the database",
+                        type=int, default=2000000)
+    parser.add_argument("--active", "-a",
+                        help="Fraction of the runs which are active",
+                        type=float, default=0.8)
+    parser.add_argument("--time", "-t",
+                        help="Seconds to spend timing each operation",
+                        type=float, default=2.0)
+    parser.add_argument("--database", "-d",
+                        help="Database file to use. It is only generated if "
+                        "it doesn't exist, so it can be reused between runs. "
+                        "By default a temporary database is generated and "
+                        "removed at the end")
+    parser.add_argument("--seed", help="Seed of the random generator",
+                        type=int, default=1)
+    return parser.parse_args()
+
+
+def generate_database(dbname, no_runs, no_subjobs, active, tables):
+    """ Fills dbname with no_runs runs spread over tables, with a total of
+    no_subjobs subjobs with random statuses and status histories """
+    from pyHepGrid.src.dbapi import _open_database
+    dbase = _open_database(dbname)
+    per_run = max(no_subjobs // max(no_runs, 1), 1)
+    start = datetime.now() - timedelta(days=30)
+    seed = 1
+    with dbase.transaction():
+        for rowid in range(no_runs):
+            table = tables[rowid % len(tables)]
+            production = rowid % 5 != 0
+            no_jobs = per_run if production else 1
+            date = start + timedelta(minutes=rowid)
+            dataDict = {"date": str(date),
+                        "runcard": "{0}_NNLO_{1}.run".format(
+                            random.choice(["Z", "W", "H", "ZJ"]), rowid % 50),
+                        "runfolder": "tag{0}".format(rowid),
+                        "pathfolder": "/mt/batch/benchmark",
+                        "status": "active" if random.random() < active
+                        else "inactive",
+                        "jobtype": "Production" if production else "Warmup",
+                        "no_runs": str(no_jobs),
+                        "queue": "None"}
+            if production:
+                dataDict["iseed"] = str(seed)
+            run_rowid = dbase.insert_data(table, dataDict)
+            jobids = ["gsiftp://ce{0}.dur.scotgrid.ac.uk/{1}/{2}".format(
+                rowid % 4 + 1, rowid, i) for i in range(no_jobs)]
+            first_seed = seed if production else 0
+            dbase.insert_subjobs(table, run_rowid, jobids,
+                                 first_seed=first_seed)
+            dbase.update_subjobs(
+                table, run_rowid, {first_seed+i: random.choice(STATUSES[1:])
+                                   for i in range(no_jobs)})
+            if production:
+                dbase.record_seeds(table, run_rowid, seed, no_jobs)
+                seed += no_jobs
+    return dbase
+
+
+def time_operation(operation, min_time):
+    """ Calls operation for at least min_time seconds. Returns the number of
+    calls, the calls per second and the peak of memory allocated by python
+    during the calls (memory allocated inside sqlite is not traced) """
+    tracemalloc.start()
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        operation()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > min_time:
+            break
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return calls, calls/elapsed, peak
+
+
+def benchmark_backend(backend, dbname, min_time):
+    """ Times the hot path operations on the table of backend, returns a list
+    of (operation, calls, calls per second, peak memory) """
+    import pyHepGrid.src.dbapi as dbapi
+    active = backend.get_active_dbids()
+    production = [i["rowid"] for i in backend.dbase.list_data(
+        backend.table, ["rowid", "jobtype"]) if i["jobtype"] == "Production"]
+    if not active or not production:
+        return []
+    search_fields = ["runcard", "runfolder", "jobtype"]
+
+    def set_new_status():
+        dbid = random.choice(production)
+        seeds = [i["seed"] for i in backend.dbase.list_subjobs(
+            backend.table, dbid, ["seed"])]
+        backend._set_new_status(dbid, {seed: random.choice(STATUSES[1:])
+                                       for seed in random.sample(
+                                           seeds, min(len(seeds), 50))})
+
+    operations = [
+        ("list_runs", backend.list_runs),
+        ("list_runs (search)", lambda: backend.list_runs("NNLO_1")),
+        ("get_active_dbids", backend.get_active_dbids),
+        ("get_id", lambda: backend.get_id(random.choice(active))),
+        ("_get_old_status",
+         lambda: backend._get_old_status(random.choice(production))),
+        ("_set_new_status", set_new_status),
+        ("get_next_seed", lambda: dbapi.get_next_seed(dbname)),
+        ("find_and_list (contains)", lambda: backend.dbase.find_and_list(
+            backend.table, ["rowid"], search_fields,
+            "tag{0}".format(random.choice(active)))),
+        ("find_and_list (prefix)", lambda: backend.dbase.find_and_list(
+            backend.table, ["rowid"], search_fields, "ZJ_*")),
+    ]
+    results = []
+    for name, operation in operations:
+        results.append((name,) + time_operation(operation, min_time))
+    return results
+
+
+def main():
+    args = get_args()
+    random.seed(args.seed)
+
+    import pyHepGrid.src.header as header
+    import pyHepGrid.src.backendManagement as bm
+
+    tmpdir = None
+    dbname = args.database
+    if dbname is None:
+        tmpdir = tempfile.mkdtemp()
+        dbname = os.path.join(tmpdir, "benchmark.dat")
+    dbname = os.path.abspath(dbname)
+    # Backends open header.dbname
+    header.dbname = dbname
+    tables = [header.arcprodtable, header.diractable, header.slurmprodtable]
+
+    try:
+        if not os.path.exists(dbname):
+            print("Generating {0} runs and {1} subjobs in {2}".format(
+                args.runs, args.subjobs, dbname))
+            start = time.perf_counter()
+            generate_database(dbname, args.runs, args.subjobs, args.active,
+                              tables)
+            print("Generated in {0:.1f}s, {1:.1f} MiB".format(
+                time.perf_counter() - start,
+                os.path.getsize(dbname)/1024**2))
+
+        backends = [bm.Arc(production=True), bm.Dirac(),
+                    bm.Slurm(production=True)]
+        line = "{0:10} {1:26} {2:>8} {3:>12} {4:>12} {5:>12}"
+        print(line.format("table", "operation", "calls", "ops/sec",
+                          "ms/op", "peak KiB"))
+        print("-"*85)
+        for backend in backends:
+            # The operations print the runs, keep the report readable
+            header.logger.disabled = True
+            try:
+                with open(os.devnull, "w") as devnull, \
+                        contextlib.redirect_stdout(devnull):
+                    results = benchmark_backend(backend, dbname, args.time)
+            finally:
+                header.logger.disabled = False
+            for name, calls, rate, peak in results:
+                print(line.format(backend.table, name, calls,
+                                  "{0:.1f}".format(rate),
+                                  "{0:.3f}".format(1000/rate),
+                                  "{0:.1f}".format(peak/1024)))
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("Peak resident memory of the process: {0:.1f} MiB".format(
+            maxrss/1024))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the ways of running grid commands concurrently.
+
+Compares a multiprocessing pool created for every call (how Backend._multirun
+used to work) with the shared thread pools of pyHepGrid.src.executor. For
+each it reports the cost of a call with a single task (startup), the
+overhead per task of a call with many trivial tasks, and the time taken to
+run a batch of short subprocesses, as the grid commands are.
+
+    pyHepGrid_executor_benchmark --tasks 500 --threads 16
+"""
+import argparse
+import multiprocessing as mp
+import subprocess
+import time
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Compare process pools and the shared thread pools used "
+        "to run grid commands concurrently")
+    parser.add_argument("--tasks", "-t", help="Number of tasks per call",
+                        type=int, default=500)
+    parser.add_argument("--threads", "-n",
+                        help="Concurrent tasks (processes or threads)",
+                        type=int, default=16)
+    parser.add_argument("--repeat", "-r",
+                        help="Number of calls to average over",
+                        type=int, default=5)
+    parser.add_argument("--payload", "-p",
+                        help="KiB of data held by the object whose method is "
+                        "called, which processes have to pickle",
+                        type=int, default=64)
+    parser.add_argument("--command", "-c",
+                        help="Command run by the subprocess tasks",
+                        default="true")
+    return parser.parse_args()
+
+
+class Task(object):
+    """ Stands in for a backend: the tasks are bound methods of an object
+    holding some data """
+
+    def __init__(self, payload, command):
+        self.payload = "x"*payload*1024
+        self.command = command.split()
+
+    def trivial(self, argument):
+        return argument
+
+    def subprocess(self, argument):
+        return subprocess.call(self.command)
+
+
+def process_pool(function, arguments, threads):
+    pool = mp.Pool(max(min(threads, len(arguments)), 1))
+    result = pool.map(function, arguments, chunksize=1)
+    pool.close()
+    pool.join()
+    return result
+
+
+def thread_pool(function, arguments, threads):
+    import pyHepGrid.src.executor as executor
+    return executor.run_all(function, arguments, "benchmark",
+                            limit=max(min(threads, len(arguments)), 1))
+
+
+def time_calls(runner, function, no_tasks, threads, repeat):
+    """ Mean seconds per call of runner with no_tasks tasks """
+    arguments = list(range(no_tasks))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        runner(function, arguments, threads)
+    return (time.perf_counter() - start)/repeat
+
+
+def main():
+    args = get_args()
+    import pyHepGrid.src.header as header
+    header.command_threads["benchmark"] = args.threads
+    task = Task(args.payload, args.command)
+
+    runners = [("process pool per call", process_pool),
+               ("shared thread pool", thread_pool)]
+    line = "{0:24} {1:>14} {2:>16} {3:>18}"
+    print(line.format("", "startup (ms)", "per task (ms)",
+                      "{0} x {1} (s)".format(args.tasks, args.command)))
+    print("-"*75)
+    for name, runner in runners:
+        # Warm up, e.g. the shared pool is created the first time it is used
+        runner(task.trivial, [0], args.threads)
+        startup = time_calls(runner, task.trivial, 1, args.threads,
+                             args.repeat)
+        many = time_calls(runner, task.trivial, args.tasks, args.threads,
+                          args.repeat)
+        commands = time_calls(runner, task.subprocess, args.tasks,
+                              args.threads, 1)
+        print(line.format(name, "{0:.2f}".format(startup*1000),
+                          "{0:.4f}".format((many - startup)*1000/args.tasks),
+                          "{0:.2f}".format(commands)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,722 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the grid and batch command line tools used by pyHepGrid.
+
+Sets up a directory with fake arcsub, arcstat, arcget, arckill, arcclean,
+arccat, arcrenew, gfal-ls, gfal-copy, gfal-rm, gfal-mkdir, gfal-sum,
+dirac-wms-*, sbatch, squeue, sacct, scancel and lcg-infosites executables.
+They keep their jobs in a sqlite job store and the grid storage in a
+directory tree, both inside the state directory, so that submission,
+management and finalisation can be exercised and timed without any grid
+service:
+
+    pyHepGrid_fake_grid init /tmp/grid --queue-time 60 --run-time 600
+    export PATH=/tmp/grid/bin:$PATH
+
+The jobs go through the queue and run on their own: every job is given a
+queue time and a run time when submitted (exponentially distributed around
+--queue-time and --run-time, queue times growing with the number of jobs
+already on the computing element) and its state is worked out from them
+whenever it is asked for. Every command waits --latency seconds before
+answering and submissions, jobs and transfers fail at the configured rates.
+The configuration is in <state>/config.json and can be edited between runs.
+
+    pyHepGrid_fake_grid status /tmp/grid
+    pyHepGrid_fake_grid fill /tmp/grid <grid dir url> "output{0}.tar.gz" -n 100
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+DEFAULT_CONFIG = {
+    # Mean seconds each command takes to answer, and its relative spread
+    "latency": 0.05,
+    "latency_spread": 0.5,
+    # Fraction of the jobs refused by arcsub/dirac-wms-job-submit/sbatch
+    "submit_failure_rate": 0.0,
+    # Fraction of the jobs which end up failed
+    "job_failure_rate": 0.05,
+    # Fraction of the jobs which the middleware loses track of
+    "missing_rate": 0.0,
+    # Fraction of the storage operations (gfal-*) which fail
+    "storage_failure_rate": 0.0,
+    # Mean seconds jobs spend queued and running
+    "queue_time": 60.0,
+    "run_time": 300.0,
+    # Cores of each computing element, as reported by lcg-infosites
+    "ces": {"ce1.dur.scotgrid.ac.uk": 400,
+            "ce2.dur.scotgrid.ac.uk": 400,
+            "ce3.dur.scotgrid.ac.uk": 200,
+            "ce4.dur.scotgrid.ac.uk": 200},
+    # Seed of the random generators, random if null. Each command adds the
+    # number of jobs in the store, so sequential runs are reproducible
+    "seed": None,
+}
+
+# Name of the state of a job in each of the simulated tools
+ARC_STATES = {"queued": "Queuing", "running": "Running",
+              "finished": "Finished", "failed": "Failed", "killed": "Killed"}
+DIRAC_STATES = {"queued": "Waiting", "running": "Running", "finished": "Done",
+                "failed": "Failed", "killed": "Killed"}
+SLURM_STATES = {"queued": "PENDING", "running": "RUNNING",
+                "finished": "COMPLETED", "failed": "FAILED",
+                "killed": "CANCELLED by 0"}
+# Options of the simulated tools which take a value
+VALUE_OPTIONS = {"-c", "-j", "-S", "-t", "-o", "-p", "-u", "-J",
+                 "--partition", "--job-name", "--timeout"}
+
+COMMANDS = {}
+
+
+def command(*names):
+    """ Registers the decorated function as the fake of the tools names """
+    def register(function):
+        for name in names:
+            COMMANDS[name] = function
+        return function
+    return register
+
+
+def split_args(argv):
+    """ Splits the arguments of a tool into a dictionary of options and a
+    list of positional arguments """
+    options = {}
+    positional = []
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg.startswith("--") and "=" in arg:
+            key, value = arg.split("=", 1)
+            options[key] = value
+        elif arg in VALUE_OPTIONS and argv:
+            options[arg] = argv.pop(0)
+        elif arg.startswith("-") and len(arg) > 1:
+            options[arg] = True
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+class Store(object):
+    """ Jobs and storage of the fake grid kept in the state directory """
+
+    def __init__(self, state):
+        self.state = os.path.abspath(state)
+        with open(os.path.join(self.state, "config.json")) as f:
+            self.config = dict(DEFAULT_CONFIG, **json.load(f))
+        self.storage = os.path.join(self.state, "storage")
+        self.db = sqlite3.connect(os.path.join(self.state, "jobs.db"),
+                                  timeout=120, isolation_level=None)
+        self.db.execute("create table if not exists jobs (jobid text primary "
+                        "key, backend text, ce text, name text, array text, "
+                        "submitted real, queue real, run real, failed integer, "
+                        "lost integer, killed real);")
+        seed = self.config["seed"]
+        if seed is not None:
+            seed += self.db.execute("select count(*) from jobs;").fetchone()[0]
+        self.random = random.Random(seed)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Changes to the job store made by concurrent commands are applied
+        one at a time """
+        self.db.execute("begin immediate;")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("rollback;")
+            raise
+        self.db.execute("commit;")
+
+    def wait(self):
+        latency = self.config["latency"]
+        spread = latency*self.config["latency_spread"]
+        time.sleep(max(self.random.gauss(latency, spread), 0))
+
+    def fails(self, rate):
+        return self.random.random() < self.config[rate]
+
+    def next_number(self, backend, first):
+        """ Next numeric job id of backend (dirac, slurm) """
+        row = self.db.execute(
+            "select max(cast(coalesce(array, jobid) as integer)) from jobs "
+            "where backend = ?;", (backend,)).fetchone()
+        return max(row[0] or 0, first - 1) + 1
+
+    def submit(self, backend, jobids, ce="", name="", array=None):
+        """ Adds jobids to the queue of ce, with their fate decided now """
+        now = time.time()
+        cores = self.config["ces"].get(ce.split(":")[0], 0)
+        load = 0
+        if cores:
+            active = self.db.execute(
+                "select count(*) from jobs where ce = ? and killed is null "
+                "and submitted + queue + run > ?;", (ce, now)).fetchone()[0]
+            load = active/cores
+        rows = []
+        for jobid in jobids:
+            queue = self.random.expovariate(1/self.config["queue_time"]) \
+                if self.config["queue_time"] > 0 else 0.0
+            run = self.random.expovariate(1/self.config["run_time"]) \
+                if self.config["run_time"] > 0 else 0.0
+            rows.append((jobid, backend, ce, name, array, now,
+                         queue*(1+load), run, self.fails("job_failure_rate"),
+                         self.fails("missing_rate"), None))
+        self.db.executemany(
+            "insert or replace into jobs values (?,?,?,?,?,?,?,?,?,?,?);",
+            rows)
+
+    def jobs(self, backend, where="", params=()):
+        """ Jobs of backend as dictionaries, with their current state """
+        keys = ["jobid", "ce", "name", "array", "submitted", "queue", "run",
+                "failed", "lost", "killed"]
+        query = "select {0} from jobs where backend = ? {1} "\
+                "order by rowid;".format(",".join(keys), where)
+        now = time.time()
+        jobs = []
+        for row in self.db.execute(query, (backend,) + tuple(params)):
+            job = dict(zip(keys, row))
+            job["state"] = self.job_state(job, now)
+            jobs.append(job)
+        return jobs
+
+    def job_state(self, job, now):
+        if job["killed"] is not None:
+            return "killed"
+        if now < job["submitted"] + job["queue"]:
+            return "queued"
+        if now < job["submitted"] + job["queue"] + job["run"]:
+            return "running"
+        return "failed" if job["failed"] else "finished"
+
+    def kill(self, backend, jobids):
+        with self.transaction():
+            self.db.executemany(
+                "update jobs set killed = ? where backend = ? and jobid = ?;",
+                [(time.time(), backend, i) for i in jobids])
+
+    def forget(self, backend, jobids):
+        with self.transaction():
+            self.db.executemany(
+                "delete from jobs where backend = ? and jobid = ?;",
+                [(backend, i) for i in jobids])
+
+    def path(self, url):
+        """ Local path standing in for the storage url (file:// urls are
+        local paths already) """
+        if url.startswith("file:"):
+            return "/" + url[len("file:"):].lstrip("/")
+        if "://" not in url:
+            return url
+        scheme, location = url.split("://", 1)
+        if scheme == "file":
+            return location
+        return os.path.join(self.storage, location.lstrip("/"))
+
+
+def _arc_key(jobid):
+    return jobid.strip().rstrip("/").rsplit("/", 1)[-1]
+
+
+def _arc_jobs(store, jobids):
+    """ {arc key: job} for the given jobids """
+    keys = set(_arc_key(i) for i in jobids)
+    return {_arc_key(i["jobid"]): i for i in store.jobs("arc")
+            if _arc_key(i["jobid"]) in keys}
+
+
+@command("arcsub")
+def arcsub(store, argv):
+    options, files = split_args(argv)
+    ce = options.get("-c", "ce1.dur.scotgrid.ac.uk")
+    host = ce.split("://")[-1].split("/")[0].split(":")[0]
+    retcode = 0
+    for filename in files:
+        with open(filename) as f, store.transaction():
+            xrsl = f.read()
+        # "+(&...)(&...)" describes several jobs
+        no_jobs = xrsl.count("(&") if xrsl.lstrip().startswith("+") else 1
+        names = re.findall(r'\(jobname\s*=\s*"?([^")]*)', xrsl, re.I)
+        for idx in range(max(no_jobs, 1)):
+            if store.fails("submit_failure_rate"):
+                print("ERROR: Failed to submit job description to {0}".format(
+                    host))
+                retcode = 1
+                continue
+            jobid = "gsiftp://{0}:2811/jobs/{1}".format(host, uuid.uuid4().hex)
+            name = names[idx] if idx < len(names) else ""
+            store.submit("arc", [jobid], ce=host, name=name)
+            print("Job submitted with jobid: {0}".format(jobid))
+    return retcode
+
+
+@command("arcstat")
+def arcstat(store, argv):
+    options, jobids = split_args(argv)
+    jobs = _arc_jobs(store, jobids)
+    for jobid in jobids:
+        job = jobs.get(_arc_key(jobid))
+        if job is None or job["lost"]:
+            sys.stderr.write("WARNING: Job not found in job list: {0}\n".format(
+                jobid))
+            continue
+        print("Job: {0}".format(job["jobid"]))
+        print(" Name: {0}".format(job["name"]))
+        print(" State: {0}".format(ARC_STATES[job["state"]]))
+        if job["state"] in ("finished", "failed"):
+            print(" Exit Code: {0}".format(int(job["failed"])))
+        print("")
+    return 0
+
+
+@command("arcget")
+def arcget(store, argv):
+    options, jobids = split_args(argv)
+    jobs = _arc_jobs(store, jobids)
+    retrieved = []
+    for jobid in jobids:
+        job = jobs.get(_arc_key(jobid))
+        if job is None or job["state"] not in ("finished", "failed"):
+            continue
+        folder = _arc_key(jobid)
+        os.makedirs(folder, exist_ok=True)
+        for name in ("stdout", "stderr"):
+            with open(os.path.join(folder, name), "w") as f:
+                f.write("{0} of fake job {1}\n".format(name, job["jobid"]))
+        print("Results stored at: {0}".format(folder))
+        retrieved.append(job["jobid"])
+    store.forget("arc", retrieved)
+    print("Jobs processed: {0}, successfully retrieved: {1}, successfully "
+          "cleaned: {1}".format(len(jobids), len(retrieved)))
+    return 0 if len(retrieved) == len(jobids) else 1
+
+
+@command("arckill", "arcclean", "arcrenew")
+def arc_job_action(store, argv):
+    options, jobids = split_args(argv)
+    jobs = _arc_jobs(store, jobids)
+    found = [i["jobid"] for i in jobs.values()]
+    action = os.path.basename(sys.argv[0])
+    if action == "arckill":
+        store.kill("arc", found)
+    elif action == "arcclean":
+        store.forget("arc", found)
+    print("Jobs processed: {0}, successfully {1}: {2}".format(
+        len(jobids), {"arckill": "killed", "arcclean": "cleaned",
+                      "arcrenew": "renewed"}.get(action, "processed"),
+        len(found)))
+    return 0 if len(found) == len(jobids) else 1
+
+
+@command("arccat", "dirac-wms-job-peek")
+def cat_job(store, argv):
+    options, jobids = split_args(argv)
+    stream = "stderr" if "-e" in options else "stdout"
+    for jobid in jobids:
+        print("Fake {0} of job {1}".format(stream, jobid))
+        print("Running with seed {0}".format(store.random.randint(1, 10000)))
+    return 0
+
+
+def _jdl_value(jdl, key, default=None):
+    for line in jdl.splitlines():
+        if line.strip().startswith(key) and "=" in line:
+            return line.split("=", 1)[1].strip().rstrip(";").strip('" ')
+    return default
+
+
+@command("dirac-wms-job-submit")
+def dirac_submit(store, argv):
+    options, files = split_args(argv)
+    retcode = 0
+    for filename in files:
+        with open(filename) as f:
+            jdl = f.read()
+        no_jobs = int(_jdl_value(jdl, "Parameters", 1))
+        name = _jdl_value(jdl, "JobName", "")
+        if store.fails("submit_failure_rate"):
+            print("ERROR: Failed to submit {0}".format(filename))
+            retcode = 1
+            continue
+        with store.transaction():
+            first = store.next_number("dirac", 1)
+            jobids = [str(first + i) for i in range(no_jobs)]
+            store.submit("dirac", jobids, ce="LCG.Durham.uk", name=name)
+        if "Parameters" in jdl:
+            print("JobID = [{0}]".format(", ".join(jobids)))
+        else:
+            print("JobID = {0}".format(jobids[0]))
+    return retcode
+
+
+@command("dirac-wms-select-jobs")
+def dirac_select(store, argv):
+    options, _ = split_args(argv)
+    since = 0
+    if "--Date" in options:
+        since = datetime.strptime(options["--Date"], "%Y-%m-%d").timestamp()
+    status = options.get("--Status")
+    jobids = [i["jobid"] for i in store.jobs(
+        "dirac", "and submitted >= ? and not lost", (since,))
+        if status is None or DIRAC_STATES[i["state"]] == status]
+    if not jobids:
+        print("No jobs selected with conditions: Status = {0}".format(status))
+        return 0
+    print("==> Selected {0} jobs with conditions: Status = {1}".format(
+        len(jobids), status))
+    print(",".join(jobids))
+    return 0
+
+
+@command("dirac-wms-job-status")
+def dirac_status(store, argv):
+    options, jobids = split_args(argv)
+    jobs = {i["jobid"]: i for i in store.jobs("dirac")}
+    for jobid in jobids:
+        job = jobs.get(jobid)
+        if job is None or job["lost"]:
+            print("JobID={0} Status=Unknown;".format(jobid))
+            continue
+        print("JobID={0} Status={1}; MinorStatus=Fake; Site={2};".format(
+            jobid, DIRAC_STATES[job["state"]], job["ce"]))
+    return 0
+
+
+@command("dirac-wms-job-kill")
+def dirac_kill(store, argv):
+    options, jobids = split_args(argv)
+    store.kill("dirac", jobids)
+    print("Killed jobs {0}".format(", ".join(jobids)))
+    return 0
+
+
+def _sbatch_array(spec):
+    """ Task ids of a --array specification (1-10, 1,3,5, 1-10%2...) """
+    tasks = []
+    for part in spec.split("%")[0].split(","):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            tasks += list(range(int(first), int(last)+1))
+        elif part:
+            tasks.append(int(part))
+    return tasks
+
+
+@command("sbatch")
+def sbatch(store, argv):
+    options, files = split_args(argv)
+    directives = {}
+    with open(files[0]) as f:
+        for line in f:
+            if line.startswith("#SBATCH"):
+                directives.update(split_args(line.split()[1:])[0])
+    directives.update(options)
+    if store.fails("submit_failure_rate"):
+        sys.stderr.write("sbatch: error: Batch job submission failed\n")
+        return 1
+    name = directives.get("--job-name", directives.get("-J", ""))
+    partition = directives.get("--partition", directives.get("-p", "batch"))
+    with store.transaction():
+        number = str(store.next_number("slurm", 1000))
+        if "--array" in directives:
+            jobids = ["{0}_{1}".format(number, i)
+                      for i in _sbatch_array(directives["--array"])]
+            store.submit("slurm", jobids, ce=partition, name=name,
+                         array=number)
+        else:
+            store.submit("slurm", [number], ce=partition, name=name)
+    print("Submitted batch job {0}".format(number))
+    return 0
+
+
+def _slurm_jobs(store, options):
+    """ Slurm jobs selected with -j (job or array ids) """
+    jobs = store.jobs("slurm", "and not lost")
+    if "-j" in options:
+        ids = set(options["-j"].split(","))
+        jobs = [i for i in jobs if i["jobid"] in ids or i["array"] in ids]
+    return jobs
+
+
+def _slurm_table(jobs, fields, separator, header):
+    if header:
+        print(separator.join(fields))
+    for job in jobs:
+        values = {"%i": job["jobid"], "JobID": job["jobid"],
+                  "%T": SLURM_STATES[job["state"]],
+                  "State": SLURM_STATES[job["state"]],
+                  "%j": job["name"], "JobName": job["name"],
+                  "%P": job["ce"], "Partition": job["ce"]}
+        print(separator.join(str(values.get(i, "")) for i in fields))
+
+
+@command("squeue")
+def squeue(store, argv):
+    options, _ = split_args(argv)
+    jobs = [i for i in _slurm_jobs(store, options)
+            if i["state"] in ("queued", "running")]
+    fmt = options.get("-o", "%i|%T")
+    separator = "|" if "|" in fmt else " "
+    _slurm_table(jobs, fmt.split(separator), separator, "-h" not in options)
+    return 0
+
+
+@command("sacct")
+def sacct(store, argv):
+    options, _ = split_args(argv)
+    fields = options.get("-o", "JobID,JobName,State").split(",")
+    separator = "|" if "-P" in options else " "
+    _slurm_table(_slurm_jobs(store, options), fields, separator,
+                 "-n" not in options)
+    return 0
+
+
+@command("scancel")
+def scancel(store, argv):
+    options, jobids = split_args(argv)
+    ids = set(jobids)
+    store.kill("slurm", [i["jobid"] for i in store.jobs("slurm")
+                         if i["jobid"] in ids or i["array"] in ids])
+    return 0
+
+
+@command("gfal-ls")
+def gfal_ls(store, argv):
+    options, urls = split_args(argv)
+    retcode = 0
+    for url in urls:
+        path = store.path(url)
+        if store.fails("storage_failure_rate") or not os.path.exists(path):
+            sys.stderr.write("gfal-ls error: 2 (No such file or directory) - "
+                             "{0}\n".format(url))
+            retcode = 2
+            continue
+        names = sorted(os.listdir(path)) if os.path.isdir(path) \
+            else [os.path.basename(path)]
+        for name in names:
+            if "-l" not in options:
+                print(name)
+                continue
+            full = os.path.join(path, name) if os.path.isdir(path) else path
+            info = os.stat(full)
+            print("{0} 1 0 0 {1:>12} {2} {3}".format(
+                "drwxr-xr-x" if os.path.isdir(full) else "-rw-r--r--",
+                info.st_size,
+                time.strftime("%b %d %H:%M", time.localtime(info.st_mtime)),
+                name))
+    return retcode
+
+
+@command("gfal-copy")
+def gfal_copy(store, argv):
+    options, urls = split_args(argv)
+    source, destination = store.path(urls[0]), store.path(urls[1])
+    if os.path.isdir(destination) or urls[1].endswith("/"):
+        destination = os.path.join(destination, os.path.basename(source))
+    if store.fails("storage_failure_rate"):
+        sys.stderr.write("gfal-copy error: 110 (Connection timed out)\n")
+        return 110
+    if not os.path.isfile(source):
+        sys.stderr.write("gfal-copy error: 2 (No such file or directory) - "
+                         "{0}\n".format(urls[0]))
+        return 2
+    if os.path.exists(destination) and "-f" not in options:
+        sys.stderr.write("gfal-copy error: 17 (File exists) - {0}\n".format(
+            urls[1]))
+        return 17
+    parent = os.path.dirname(destination)
+    if parent and not os.path.isdir(parent):
+        if "-p" not in options and "://" in urls[1] and \
+                not urls[1].startswith("file:"):
+            sys.stderr.write("gfal-copy error: 2 (No such file or directory) "
+                             "- {0}\n".format(urls[1]))
+            return 2
+        os.makedirs(parent, exist_ok=True)
+    shutil.copyfile(source, destination)
+    if "-v" in options:
+        print("Copying {0} [DONE]".format(urls[0]))
+    return 0
+
+
+@command("gfal-rm")
+def gfal_rm(store, argv):
+    options, urls = split_args(argv)
+    recursive = "-r" in options or "--recursive" in options
+    retcode = 0
+    for url in urls:
+        path = store.path(url)
+        if store.fails("storage_failure_rate") or not os.path.exists(path):
+            print("{0}\tMISSING".format(url))
+            retcode = 2
+        elif os.path.isdir(path):
+            if not recursive:
+                print("{0}\tIS A DIRECTORY".format(url))
+                retcode = 21
+                continue
+            shutil.rmtree(path)
+            print("{0}\tRMDIR".format(url))
+        else:
+            os.remove(path)
+            print("{0}\tDELETED".format(url))
+    return retcode
+
+
+@command("gfal-mkdir")
+def gfal_mkdir(store, argv):
+    options, urls = split_args(argv)
+    for url in urls:
+        os.makedirs(store.path(url), exist_ok="-p" in options)
+    return 0
+
+
+@command("gfal-sum")
+def gfal_sum(store, argv):
+    options, urls = split_args(argv)
+    with open(store.path(urls[0]), "rb") as f:
+        checksum = zlib.adler32(f.read())
+    print("{0} {1:08x}".format(urls[0], checksum))
+    return 0
+
+
+@command("lcg-infosites")
+def lcg_infosites(store, argv):
+    now = time.time()
+    print("#CPU\tFree\tTotal Jobs\tRunning\tWaiting\tComputingElement")
+    print("-"*64)
+    jobs = store.jobs("arc", "and killed is null")
+    for ce, cores in sorted(store.config["ces"].items()):
+        states = [store.job_state(i, now) for i in jobs if i["ce"] == ce]
+        running = states.count("running")
+        waiting = states.count("queued")
+        print("{0:6}\t{1:6}\t{2:6}\t{3:6}\t{4:6}\t{5}:2811/"
+              "nordugrid-torque-default".format(
+                  cores, max(cores - running, 0), running + waiting, running,
+                  waiting, ce))
+    return 0
+
+
+def run_command(state, name, argv):
+    """ Runs the fake of tool name with arguments argv """
+    store = Store(state)
+    store.wait()
+    return COMMANDS[name](store, argv)
+
+
+def init(args):
+    """ Creates the state directory with the configuration and a bin
+    directory with one executable per simulated tool """
+    state = os.path.abspath(args.state)
+    bindir = os.path.join(state, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    os.makedirs(os.path.join(state, "storage"), exist_ok=True)
+    config = dict(DEFAULT_CONFIG)
+    for key in ["latency", "submit_failure_rate", "job_failure_rate",
+                "missing_rate", "storage_failure_rate", "queue_time",
+                "run_time", "seed"]:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    with open(os.path.join(state, "config.json"), "w") as f:
+        json.dump(config, f, indent=4)
+    for name in COMMANDS:
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\nexec \"{0}\" -m pyHepGrid.extras.fake_grid "
+                    "--state \"{1}\" \"$(basename \"$0\")\" \"$@\"\n".format(
+                        sys.executable, state))
+        os.chmod(path, 0o755)
+    print("Fake grid set up in {0}, use it with".format(state))
+    print("    export PATH={0}:$PATH".format(bindir))
+
+
+def status(args):
+    """ Prints the number of jobs of each backend in each state """
+    store = Store(args.state)
+    for backend in ["arc", "dirac", "slurm"]:
+        jobs = store.jobs(backend)
+        counts = {}
+        for job in jobs:
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        print("{0:6} {1:6} jobs  {2}".format(backend, len(jobs), "  ".join(
+            "{0}: {1}".format(k, v) for k, v in sorted(counts.items()))))
+
+
+def fill(args):
+    """ Puts files of args.size KiB in the storage directory args.url, named
+    after args.pattern formatted with 1..args.number """
+    store = Store(args.state)
+    directory = store.path(args.url)
+    os.makedirs(directory, exist_ok=True)
+    data = os.urandom(args.size*1024)
+    for i in range(1, args.number+1):
+        with open(os.path.join(directory, args.pattern.format(i)), "wb") as f:
+            f.write(data)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Offline stand-in for the grid tools used by pyHepGrid")
+    subparsers = parser.add_subparsers(dest="action")
+    parser_init = subparsers.add_parser(
+        "init", help="Set up a fake grid in a state directory")
+    parser_init.add_argument("state", help="State directory")
+    parser_init.add_argument("--latency", type=float,
+                             help="Mean seconds each command takes")
+    parser_init.add_argument("--submit-failure-rate", type=float,
+                             dest="submit_failure_rate",
+                             help="Fraction of the submissions refused")
+    parser_init.add_argument("--job-failure-rate", type=float,
+                             dest="job_failure_rate",
+                             help="Fraction of the jobs which fail")
+    parser_init.add_argument("--missing-rate", type=float,
+                             dest="missing_rate",
+                             help="Fraction of the jobs lost by the middleware")
+    parser_init.add_argument("--storage-failure-rate", type=float,
+                             dest="storage_failure_rate",
+                             help="Fraction of the storage operations failing")
+    parser_init.add_argument("--queue-time", type=float, dest="queue_time",
+                             help="Mean seconds jobs are queued")
+    parser_init.add_argument("--run-time", type=float, dest="run_time",
+                             help="Mean seconds jobs run")
+    parser_init.add_argument("--seed", type=int,
+                             help="Seed of the random generator")
+    parser_status = subparsers.add_parser(
+        "status", help="Number of fake jobs in each state")
+    parser_status.add_argument("state", help="State directory")
+    parser_fill = subparsers.add_parser(
+        "fill", help="Put files in the fake grid storage")
+    parser_fill.add_argument("state", help="State directory")
+    parser_fill.add_argument("url", help="Grid storage directory")
+    parser_fill.add_argument("pattern",
+                             help="File names, {0} is replaced by 1..number")
+    parser_fill.add_argument("--number", "-n", type=int, default=1,
+                             help="Number of files")
+    parser_fill.add_argument("--size", "-s", type=int, default=1,
+                             help="KiB per file")
+    return parser.parse_args()
+
+
+def main():
+    # The generated executables call "fake_grid --state <dir> <tool> ..."
+    if len(sys.argv) > 3 and sys.argv[1] == "--state" and \
+            sys.argv[3] in COMMANDS:
+        sys.argv[0] = sys.argv[3]
+        sys.exit(run_command(sys.argv[2], sys.argv[3], sys.argv[4:]))
+    args = get_args()
+    actions = {"init": init, "status": status, "fill": fill}
+    if args.action not in actions:
+        sys.exit("Choose one of {0} (see -h)".format(", ".join(actions)))
+    actions[args.action](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -130,6 +130,28 @@ def get_ces(all_ces):
     return site_info
 
 
+def get_free_cores(ces):
+    """ Returns {ce: free cores} for the computing elements ces listed by
+    lcg-infosites, empty if lcg-infosites can't be run """
+    try:
+        result = sp.run(["lcg-infosites", "ce", "--vo", "pheno"],
+                        stdout=sp.PIPE, stderr=sp.PIPE,
+                        universal_newlines=True)
+    except OSError:
+        return {}
+    free_cores = {}
+    for line in result.stdout.splitlines():
+        if not good_site_present(line, ces):
+            continue
+        try:
+            site = CE_Data(line)
+        except (ValueError, IndexError):
+            continue
+        # A CE has a line per queue
+        free_cores[site.CE] = max(site.Free, free_cores.get(site.CE, 0))
+    return free_cores
+
+
 def get_most_free_cores():
     """API for main.py to link in"""
     site_info = get_ces(False)
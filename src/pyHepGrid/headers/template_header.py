@@ -92,10 +92,42 @@ arcbase = "/path/to/ARC/base/.arc/jobs.dat"  # arc database
 # job loss or fails due to file system locks on the arc jobs database or the arc
 # backend not assigning ids quick enough
 arc_submit_threads = 1
+# Number of production seeds submitted together by each arcsub call
+arc_submit_batch = 100
+# Computing elements production jobs are spread over, favouring those with
+# more free cores, quicker submission and fewer recent failures. If None, jobs
+# go to ce_base (or to both Durham CEs, see split_dur_ce)
+ce_pool = None
+# Hours of finished jobs considered for the failure rate of each CE
+ce_failure_window = 48
+# Number of jobs queried by each arcstat call when checking the status of runs
+arc_stat_batch = 250
+# Minutes between status checks of queued subjobs and of running subjobs. As
+# running subjobs approach the typical run time of their run they are checked
+# more often, at most every poll_min_interval minutes
+poll_wait_interval = 30
+poll_run_interval = 15
+poll_min_interval = 2
+# Most commands of each family (arc: arcstat, arcsub: arc submission, gfal:
+# grid storage transfers, dirac: dirac-wms commands, warmup: runcards whose
+# warmup is being submitted) running at the same time, for the whole
+# invocation. Families not listed run at most 8 at a time
+command_threads = {"arc": 16, "arcsub": 4, "gfal": 16, "dirac": 8,
+                   "warmup": 8}
+# Longest time in seconds the monitor (pyHepGrid monitor) waits between rounds
+# of polls. While its last heartbeat is under monitor_timeout seconds old, -s
+# shows the statuses it stored instead of polling (unless --force_poll)
+monitor_interval = 300
+monitor_timeout = 900
 
 # DIRAC parameters
 dirac_name = "user_name_for_dirac"
 DIRAC_BANNED_SITES = []
+# Seeds per parametric JDL, number of JDLs submitted at the same time and
+# number of times a JDL which fails to submit is tried again
+dirac_submit_batch = 750
+dirac_submit_threads = 4
+dirac_submit_retries = 2
 dirac_platform = "EL7"
 
 # finalise.py-only parameters
@@ -117,6 +149,12 @@ production_queue = "nameOfProductionQueue"
 production_threads = 24
 slurm_exclusive = True
 slurm_exclude = []
+# Submit the productions of all the runcards as a single array (or as few as
+# possible with at most slurm_pack_max_tasks tasks each) instead of one array
+# per runcard. Only with the default slurm_template_production and runmodes
+# which don't change the arguments of each runcard
+slurm_pack_runcards = False
+slurm_pack_max_tasks = 1000
 
 # LOCAL
 desktop_list = []
@@ -6,7 +6,7 @@ from pyHepGrid.src.header import arctable, diractable, arcprodtable, \
     slurmprodtable, dbname, dbfields, logger, slurmtable
 from pyHepGrid.src.dbapi import database
 from pyHepGrid.src.modes import do_proxy, do_run, do_initialise, do_test, \
-    do_management
+    do_management, do_monitor
 
 
 def main():
@@ -16,7 +16,8 @@ def main():
              "run": do_run,
              "ini": do_initialise,
              "tes": do_test,
-             "man": do_management}
+             "man": do_management,
+             "mon": do_monitor}
 
     rcard = args.runcard
     rmode = args.mode.lower()
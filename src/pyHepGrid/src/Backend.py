@@ -1,4 +1,4 @@
-from collections import Counter
+from collections import Counter, defaultdict
 import datetime
 import os
 import importlib
@@ -7,7 +7,7 @@ from pyHepGrid.src.header import logger
 import pyHepGrid.src.utilities as util
 import pyHepGrid.src.header as header
 import pyHepGrid.src.runmodes
-import multiprocessing as mp
+import pyHepGrid.src.executor as executor
 import sys
 
 counter = None
@@ -20,11 +20,6 @@ else:
     logger.info(f"Overriding run mode to {_mode}")
 
 
-def init_counter(args):
-    global counter
-    counter = args
-
-
 class Backend(_mode):
     """
     Abstract class for common functions needed for all Backends,
@@ -36,6 +31,10 @@ class Backend(_mode):
     cRUN = 2
     cMISS = 98
     cUNK = 99
+    # None: submitted but never polled
+    status_names = {cDONE: "Done", cWAIT: "Waiting", cFAIL: "Failed",
+                    cRUN: "Running", cMISS: "Missing", cUNK: "Unknown",
+                    None: "Submitted"}
 
     def output_name_array(self, runcard, rname, seeds):
         return [self.output_name(runcard, rname, seed) for seed in seeds]
@@ -43,6 +42,32 @@ class Backend(_mode):
     def set_oneliner_output(self):
         self.stats_one_line = True
 
+    def set_force_poll(self):
+        """ Poll every unfinished subjob, ignoring when they are due and
+        whether a monitor keeps them up to date """
+        self.force_poll = True
+
+    def get_live_monitor(self):
+        """ The running monitor (pyHepGrid monitor, see dbapi.get_monitor),
+        None if there is none. The monitor is considered to be running if its
+        last heartbeat is under header.monitor_timeout seconds old """
+        if self._monitor is None:
+            monitor = self.dbase.get_monitor()
+            oldest = datetime.datetime.now() - datetime.timedelta(
+                seconds=header.monitor_timeout)
+            if monitor is None or monitor["heartbeat"] <= str(oldest):
+                monitor = {}
+            self._monitor = monitor
+        return self._monitor or None
+
+    def use_monitor_snapshot(self):
+        """ Whether the statuses stored by a running monitor can be used
+        instead of polling, i.e. if a monitor is polling this table """
+        if self.force_poll:
+            return False
+        monitor = self.get_live_monitor()
+        return monitor is not None and self.table in monitor["tables"]
+
     def stats_print_setup(self, runcard_info, dbid=""):
         if dbid == "":
             string = ""
@@ -78,6 +103,8 @@ class Backend(_mode):
         self.assume_yes = False
         self.act_only_on_done = act_only_on_done
         self.stats_one_line = False
+        self.force_poll = False
+        self._monitor = None
 
     # Helper functions and wrappers
     def dont_ask_dont_tell(self):
@@ -113,29 +140,23 @@ class Backend(_mode):
             return ""
 
     def _multirun(self, function, arguments, n_threads=15,
-                  arglen=None, use_counter=False, timeout=False):
-        """ Wrapper for multiprocessing
-            For ARC only single thread is allow as the arc database needs
-            to be locked
+                  arglen=None, use_counter=False, timeout=False,
+                  family=executor.DEFAULT_FAMILY):
+        """ Wrapper for running function on all arguments concurrently in the
+            shared pool of threads of the family of commands it runs (see
+            executor), at most n_threads at a time
+            For ARC submission only single thread is allow as the arc
+            database needs to be locked
+            Threads use their own connection to the local database
         """
+        global counter
         # If required # calls is lower than the # threads given, use the minimum
         if arglen is None:
             arglen = n_threads
         threads = max(min(n_threads, arglen), 1)
 
-        if use_counter:
-            counter = mp.Value('i', 0)
-            pool = mp.Pool(threads, initializer=init_counter,
-                           initargs=(counter,))
-        else:
-            pool = mp.Pool(threads)
-        self.dbase.close()
-
-        result = pool.map(function, arguments, chunksize=1)
-        self.dbase.reopen()
-        pool.close()
-        pool.join()
-        return result
+        counter = executor.Counter() if use_counter else None
+        return executor.run_all(function, arguments, family, limit=threads)
 
     def _check_id_type(self, db_id):
         """ Checks whether a job is production/warmup/socketed
@@ -146,9 +167,7 @@ class Backend(_mode):
         jobtype = self.dbase.list_data(
             self.table, ["jobtype"], db_id)[0]["jobtype"]
         if not jobtype:  # legacy suport (database returns None)
-            idout = self.dbase.list_data(
-                self.table, ["jobid"], db_id)[0]["jobid"]
-            if len(idout.split(" ")) > 1:
+            if len(self.dbase.list_subjobs(self.table, db_id)) > 1:
                 return production
             else:
                 return warmup
@@ -159,9 +178,7 @@ class Backend(_mode):
         elif "Socket" in jobtype:
             return socketed_warmup
         else:
-            idout = self.dbase.list_data(
-                self.table, ["jobid"], db_id)[0]["jobid"]
-            if len(idout.split(" ")) > 1:
+            if len(self.dbase.list_subjobs(self.table, db_id)) > 1:
                 return production
             else:
                 return warmup
@@ -216,32 +233,29 @@ class Backend(_mode):
 
     # External functions for database management
 
-    def get_id(self, db_id):
+    def get_id(self, db_id, statuses=None):
         """ Returns a list of DIRAC/ARC jobids
         for a given database entry
+        If statuses is given, only jobids whose stored status is in statuses
+        are returned
         """
-        jobid = self.dbase.list_data(self.table, ["jobid"], db_id)
-        try:
-            idout = jobid[0]['jobid']
-        except IndexError:
-            logger.info("Selected job is %s out of bounds" % jobid)
+        if not self.dbase.list_data(self.table, ["rowid"], db_id):
+            logger.info("Selected job is %s out of bounds" % db_id)
             idt = input("> Select id to act upon: ")
-            idout = self.get_id(idt)
-        jobid_list = idout.split(" ")
+            return self.get_id(idt, statuses)
         if self.act_only_on_done:
-            new_list = []
-            status_list = self._get_old_status(db_id)
-            if status_list:
-                for jobid, stat in zip(jobid_list, status_list):
-                    if stat == self.cDONE:
-                        new_list.append(jobid)
-                return new_list
+            if statuses is None:
+                statuses = [self.cDONE]
             else:
-                logger.critical(
-                    "In order to act only on 'done' jobs you need to have that "
-                    "info in the db!")
-        else:
-            return jobid_list
+                statuses = [i for i in statuses if i == self.cDONE]
+        subjobs = self.dbase.list_subjobs(self.table, db_id, ["jobid"],
+                                          statuses=statuses)
+        if self.act_only_on_done and not subjobs and \
+                self._get_old_status(db_id) is None:
+            logger.critical(
+                "In order to act only on 'done' jobs you need to have that "
+                "info in the db!")
+        return [i["jobid"] for i in subjobs]
 
     def get_date(self, db_id):
         """ Returns date from a given database entry
@@ -265,6 +279,24 @@ class Backend(_mode):
         """
         self.dbase.disable_entry(self.table, db_id, revert=True)
 
+    def archive_disabled(self):
+        """ Move all disabled database entries to the archive
+        """
+        archived = self.dbase.archive_runs(self.table)
+        header.logger.info("Archived {0} disabled entries".format(
+            len(archived)))
+
+    def set_db_entries_status(self, new_status):
+        """ Enable or disable several database entries at once, where
+        new_status is a dictionary {db_id: True (enable)/False (disable)}
+        """
+        with self.dbase.transaction():
+            for enable in (True, False):
+                db_ids = [i for i in new_status if new_status[i] == enable]
+                if db_ids:
+                    self.dbase.disable_entries(self.table, db_ids,
+                                               revert=enable)
+
     # src.Backend "independent" management options
     # (some of them need backend-dependent definitions but work the same
     # for both ARC and DIRAC)
@@ -273,24 +305,48 @@ class Backend(_mode):
         """ Given a list of jobs, returns the number of jobs which
         are in each possible state (done/waiting/running/etc)
         """
-        jobids = self.get_id(dbid)
-        current_status = self._get_old_status(dbid)
-        arglen = len(jobids)
-
-        if isinstance(current_status, list):
-            if len(current_status) == arglen:
-                jobids_lst = zip(jobids, current_status)
-            else:  # Current status corrupted somehow... Start again
-                jobids_lst = jobids
-        else:
-            jobids_lst = jobids
+        poll_date = datetime.datetime.now()
+        subjobs = self.dbase.list_subjobs(
+            self.table, dbid,
+            ["seed", "jobid", "status", "updated", "next_poll", "ce"])
 
         tags = ["runcard", "runfolder", "date"]
         runcard_info = self.dbase.list_data(self.table, tags, dbid)[0]
 
-        n_threads = header.finalise_no_cores
-        status = self._multirun(self._do_stats_job, jobids_lst,
-                                n_threads, arglen=arglen)
+        # Subjobs in a final state are not polled again, and those not due
+        # yet keep their stored status
+        final = (self.cDONE, self.cFAIL, self.cMISS)
+        due = [i for i in subjobs if i["status"] not in final and
+               (self.force_poll or i["next_poll"] is None or
+                i["next_poll"] <= str(poll_date))]
+        # Each arcstat call only queries jobs of a single CE
+        to_poll = {}
+        for subjob in due:
+            to_poll.setdefault(subjob["ce"], []).append(subjob["jobid"])
+        batch_size = header.arc_stat_batch
+        batches = [jobids[i:i+batch_size] for jobids in to_poll.values()
+                   for i in range(0, len(jobids), batch_size)]
+        polled = {}
+        if batches:
+            n_threads = header.finalise_no_cores
+            for batch_status in self._multirun(self._do_stats_batch, batches,
+                                               n_threads, arglen=len(batches),
+                                               family="arc"):
+                polled.update(batch_status)
+
+        status = {i["seed"]: i["status"] for i in subjobs}
+        new_status = {}
+        for subjob in due:
+            new = polled.get(self._arc_job_key(subjob["jobid"]), self.cUNK)
+            if new != subjob["status"]:
+                new_status[subjob["seed"]] = new
+            status[subjob["seed"]] = new
+        next_polls = self._schedule_polls(dbid, due, new_status, poll_date)
+        with self.dbase.transaction():
+            self._set_new_status(dbid, new_status, poll_date)
+            self.dbase.set_next_polls(self.table, dbid, next_polls)
+        status = list(status.values())
+
         done = status.count(self.cDONE)
         wait = status.count(self.cWAIT)
         run = status.count(self.cRUN)
@@ -299,32 +355,215 @@ class Backend(_mode):
         unk = status.count(self.cUNK)
         if do_print:
             self.stats_print_setup(runcard_info, dbid=dbid)
-            total = len(jobids)
+            total = len(subjobs)
             self.print_stats(done, wait, run, fail, miss, unk, total)
-        self._set_new_status(dbid, status)
+        self._record_poll(dbid, poll_date)
         return done, wait, run, fail, unk
 
-    def _get_old_status(self, db_id):
-        field_name = "sub_status"
-        status_dic = self.dbase.list_data(self.table, [field_name], db_id)
-        try:
-            status_str = status_dic[0][field_name]
-            if status_str.lower() == "none":
-                return None
+    def prepare_stats(self, db_ids):
+        """ Called with all the database ids before polling them one by one
+        so that backends can share work between them """
+        pass
+
+    def stats_snapshot(self, dbid, do_print=True):
+        """ Same as stats_job, but with the statuses stored in the database
+        (kept up to date by the monitor) instead of polling the subjobs
+        """
+        subjobs = self.dbase.list_subjobs(self.table, dbid, ["status"])
+        tags = ["runcard", "runfolder", "date", "last_polled"]
+        runcard_info = self.dbase.list_data(self.table, tags, dbid)[0]
+        status = [i["status"] for i in subjobs]
+        done = status.count(self.cDONE)
+        wait = status.count(self.cWAIT)
+        run = status.count(self.cRUN)
+        fail = status.count(self.cFAIL)
+        miss = status.count(self.cMISS)
+        unk = status.count(self.cUNK)
+        if do_print:
+            self.stats_print_setup(runcard_info, dbid=dbid)
+            self.print_stats(done, wait, run, fail, miss, unk, len(subjobs),
+                             date=runcard_info["last_polled"])
+        return done, wait, run, fail, unk
+
+    def monitor_poll(self, heartbeat=None):
+        """ Polls the active runs with subjobs due to be polled (see
+        _next_poll_time) and returns the earliest date at which one is due
+        next ("" for as soon as possible, None if nothing is left to poll).
+        Errors polling a run are logged and the rest are still polled.
+        heartbeat, if given, is called after every run polled
+        """
+        final = (self.cDONE, self.cFAIL, self.cMISS)
+        now = str(datetime.datetime.now())
+        active = self.get_active_dbids()
+        due = [i for i, date in self.dbase.pending_polls(
+            self.table, active, final).items() if date <= now]
+        if due:
+            self.prepare_stats(due)
+        for db_id in due:
+            try:
+                self.stats_job(db_id, do_print=False)
+            except Exception as e:
+                logger.error("Failed to poll {0} run {1}: {2}".format(
+                    self.table, db_id, e))
+            if heartbeat is not None:
+                heartbeat()
+        pending = self.dbase.pending_polls(self.table, active, final)
+        return min(pending.values(), default=None)
+
+    def _schedule_polls(self, db_id, subjobs, new_status, poll_date):
+        """ Returns {seed: date} with the next time each of the just polled
+        subjobs of db_id is due to be polled again, given the new statuses
+        of those which changed """
+        next_polls = {}
+        expected_run = None
+        if any(new_status.get(i["seed"], i["status"]) == self.cRUN
+               for i in subjobs):
+            expected_run = self.dbase.mean_completed_duration(
+                self.table, db_id, self.cRUN)
+        for subjob in subjobs:
+            if subjob["seed"] in new_status:
+                status = new_status[subjob["seed"]]
+                entered = poll_date
             else:
-                outlst = [int(i) for i in status_str.split()]
-                return outlst
-        except BaseException:
+                status = subjob["status"]
+                try:
+                    entered = datetime.datetime.fromisoformat(
+                        subjob["updated"])
+                except (TypeError, ValueError):
+                    entered = poll_date
+            next_polls[subjob["seed"]] = self._next_poll_time(
+                status, entered, poll_date, expected_run)
+        return next_polls
+
+    def _next_poll_time(self, status, entered, now, expected_run=None):
+        """ When a subjob which has been in status since entered should be
+        polled next, None meaning at every check. Queued subjobs are checked
+        every header.poll_wait_interval minutes and running ones every
+        header.poll_run_interval, or more often (down to
+        header.poll_min_interval) as they approach the mean run time of the
+        subjobs of the run which already finished (expected_run, seconds)
+        """
+        minute = datetime.timedelta(minutes=1)
+        if status == self.cWAIT:
+            return now + header.poll_wait_interval*minute
+        if status == self.cRUN:
+            interval = header.poll_run_interval*minute
+            if expected_run is not None:
+                end = entered + datetime.timedelta(seconds=expected_run)
+                interval = max(min((end - now)/2, interval),
+                               header.poll_min_interval*minute)
+            return now + interval
+        # Submitted or unknown subjobs are checked every time
+        return None
+
+    def _record_poll(self, db_id, poll_date):
+        """ Stores the date at which the subjobs of db_id were last polled """
+        self.dbase.update_entry(self.table, db_id, "last_polled",
+                                str(poll_date))
+
+    def _get_since_date(self, db_id, since):
+        """ Turns the argument of --since into a date: "last" is the last time
+        db_id was polled, 30m/2h/1d are times ago and anything else is taken
+        as a date in the database format (YYYY-MM-DD HH:MM:SS)
+        """
+        if since == "last":
+            info = self.dbase.list_data(
+                self.table, ["last_polled", "date"], db_id)[0]
+            return info["last_polled"] or info["date"]
+        units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+        if since[-1:] in units and since[:-1].isdigit():
+            delta = datetime.timedelta(seconds=int(since[:-1])*units[since[-1]])
+            return str(datetime.datetime.now() - delta)
+        return since
+
+    def stats_since(self, dbid, since="last"):
+        """ Re-polls the subjobs of dbid and prints only the changes of state
+        since a given time (see _get_since_date)
+        """
+        since_date = self._get_since_date(dbid, since)
+        if not self.use_monitor_snapshot():
+            self.stats_job(dbid, do_print=False)
+        transitions = self.dbase.list_transitions(self.table, dbid,
+                                                  since=since_date)
+        changes = Counter((i["old_status"], i["new_status"])
+                          for i in transitions)
+        tags = ["runcard", "runfolder", "date"]
+        runcard_info = self.dbase.list_data(self.table, tags, dbid)[0]
+        self.stats_print_setup(runcard_info, dbid=dbid)
+        logger.plain("Changes since {0}: {1}".format(
+            str(since_date).split('.')[0], len(transitions)))
+        for (old, new), count in sorted(changes.items(), key=str):
+            logger.plain("    >> {0:>9} -> {1:9}: {2}".format(
+                self.status_names.get(old, old),
+                self.status_names.get(new, new), count))
+
+    def _get_ce_name(self, jobid):
+        """ Computing element host of an ARC jobid (unknown otherwise) """
+        if "://" not in str(jobid):
+            return "unknown"
+        return jobid.split("://")[1].split("/")[0].split(":")[0]
+
+    def _format_state_times(self, durations):
+        """ Formats {status: (total seconds, no. subjobs)} as the mean time
+        per subjob in every non-final state """
+        final_states = (self.cDONE, self.cFAIL, self.cMISS)
+        string = ""
+        for status in sorted(durations, key=str):
+            if status in final_states:
+                continue
+            total, no_subjobs = durations[status]
+            mean = datetime.timedelta(seconds=int(total/max(no_subjobs, 1)))
+            string += "{0}: {1} ({2})  ".format(
+                self.status_names.get(status, status), mean, no_subjobs)
+        return string
+
+    def print_state_times(self, dbid):
+        """ Prints the mean time the subjobs of dbid spent in each state, for
+        the whole run and for each computing element
+        """
+        tags = ["runcard", "runfolder", "date"]
+        runcard_info = self.dbase.list_data(self.table, tags, dbid)[0]
+        self.stats_print_setup(runcard_info, dbid=dbid)
+        logger.plain(self._format_state_times(
+            self.dbase.state_durations(self.table, dbid)))
+        # {ce: {status: [total seconds, no. subjobs]}}
+        per_ce = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+        for ce, jobid, status, seconds in \
+                self.dbase.state_durations_by_subjob(self.table, dbid):
+            # Subjobs submitted before the CE was stored only have their jobid
+            ce_times = per_ce[ce or self._get_ce_name(jobid)][status]
+            ce_times[0] += seconds
+            ce_times[1] += 1
+        for ce in sorted(per_ce):
+            logger.plain("    >> {0}: {1}".format(
+                ce, self._format_state_times(per_ce[ce])))
+
+    def _get_old_status(self, db_id):
+        """ Returns the list of stored subjob statuses of a database entry
+        ordered by seed, or None if no status has been stored yet
+        """
+        subjobs = self.dbase.list_subjobs(self.table, db_id, ["status"])
+        outlst = [i["status"] for i in subjobs]
+        if all(i is None for i in outlst):
             return None
+        return outlst
 
-    def _set_new_status(self, db_id, status):
-        field_name = "sub_status"
-        status_str = ' '.join(map(str, status))
-        self.dbase.update_entry(self.table, db_id, field_name, status_str)
+    def _set_new_status(self, db_id, status, poll_date=None):
+        """ Stores the new status of the subjobs of a database entry, where
+        status is a dictionary {seed: status} found by the poll started at
+        poll_date
+        """
+        self.dbase.update_subjobs(self.table, db_id, status, poll_date)
 
-    def print_stats(self, done, wait, run, fail, miss, unk, total):
+    def print_stats(self, done, wait, run, fail, miss, unk, total,
+                    date=None):
+        """ Prints the number of subjobs in each state, as of date (a date in
+        the database format, now by default) """
         total2 = done + wait + run + fail + unk + miss
-        time = datetime.datetime.now().strftime("%H:%M:%S %d-%m-%Y")
+        if date is None:
+            time = datetime.datetime.now().strftime("%H:%M:%S %d-%m-%Y")
+        else:
+            time = str(date).split(".")[0]
 
         if self.stats_one_line:
             string = "Done: [{0}/{1}];\n".format(done, total)
@@ -356,21 +595,43 @@ class Backend(_mode):
             logger.plain("    >> Unknown: {0}".format(unk))
             logger.plain("    >> Sum      {0}".format(total2))
 
-    def _do_stats_job(self, jobid_raw):
-        """ version of stats job multithread ready
+    def _arc_job_key(self, jobid):
+        """ Last component of an ARC jobid, unique for each job and the same
+        whether or not the port of the CE is included """
+        return jobid.strip().rstrip("/").rsplit("/", 1)[-1]
+
+    def _do_stats_batch(self, jobids):
+        """ Queries the status of a batch of jobids with a single arcstat
+        call. Returns a dictionary {job key: status}, see _arc_job_key
         """
-        if isinstance(jobid_raw, tuple):
-            if (jobid_raw[1] == self.cDONE or
-                    jobid_raw[1] == self.cFAIL or
-                    jobid_raw[1] == self.cMISS):
-                return jobid_raw[1]
-            else:
-                jobid = jobid_raw[0]
-        else:
-            jobid = jobid_raw
-        cmd = [self.cmd_stat, jobid.strip(), "-j", header.arcbase]
+        cmd = [self.cmd_stat, "-j", header.arcbase] + \
+            [i.strip() for i in jobids]
         strOut = util.getOutputCall(
             cmd, suppress_errors=True, include_return_code=False)
+        return self._parse_arcstat(strOut)
+
+    def _parse_arcstat(self, strOut):
+        """ Splits the output of arcstat for several jobs into one block per
+        job ("Job: <jobid>" followed by its information) and returns the
+        status of each of them as {job key: status}
+        """
+        blocks = {}
+        job = None
+        for line in strOut.splitlines():
+            if line.startswith("Job:"):
+                job = self._arc_job_key(line.split(":", 1)[1])
+                blocks[job] = []
+            elif job is not None:
+                blocks[job].append(line)
+        status = {}
+        for job, lines in blocks.items():
+            # Only look at the state if given, job names can be anything
+            state = [i for i in lines if i.strip().startswith("State:")]
+            status[job] = self._arc_state_to_status("\n".join(state or lines))
+        return status
+
+    def _arc_state_to_status(self, strOut):
+        """ Maps the arcstat output of a job to its status code """
         if "Done" in strOut or "Finished" in strOut:
             return self.cDONE
         elif "Waiting" in strOut or "Queuing" in strOut:
@@ -390,12 +651,12 @@ class Backend(_mode):
         """
         # Retrieve data from database
         from pyHepGrid.src.header import arcbase, grid_warmup_dir
-        fields = ["runcard", "runfolder", "jobid", "pathfolder"]
+        fields = ["runcard", "runfolder", "pathfolder"]
         data = self.dbase.list_data(self.table, fields, db_id)[0]
         runfolder = data["runfolder"]
         finfolder = data["pathfolder"] + "/" + runfolder
         runcard = data["runcard"]
-        jobids = data["jobid"].split()
+        jobids = self.get_id(db_id)
         util.spCall(["mkdir", "-p", finfolder])
         logger.info("Retrieving ARC output into " + finfolder)
         try:
@@ -434,15 +695,15 @@ class Backend(_mode):
             "runcard from grid output")
         logger.info(
             "Make sure all runs are finished using the -s or -S options!")
-        fields = ["runfolder", "runcard", "jobid", "pathfolder", "iseed"]
+        fields = ["runfolder", "runcard", "pathfolder", "iseed"]
         data = self.dbase.list_data(self.table, fields, db_id)[0]
         self.rcard = data["runcard"]
         self.rfolder = data["runfolder"]
         pathfolderTp = data["pathfolder"]
         initial_seed = data["iseed"]
         pathfolder = util.sanitiseGeneratedPath(pathfolderTp, self.rfolder)
-        jobids = data["jobid"].split(" ")
-        finalSeed = int(initial_seed) + len(jobids)
+        subjobs = self.dbase.list_subjobs(self.table, db_id, ["seed"])
+        finalSeed = int(initial_seed) + len(subjobs)
         if initial_seed == "None":
             initial_seed = self.bSeed
         else:
@@ -482,25 +743,22 @@ class Backend(_mode):
         # If we are only act on a subrange of jobids (ie, the ones which are
         # done...) choose only those seeds
         if self.act_only_on_done:
-            old_status = self._get_old_status(db_id)
-            if old_status:
-                new_seed = []
-                for seed, stat in zip(seeds, old_status):
-                    if stat == self.cDONE:
-                        new_seed.append(seed)
-            seeds = new_seed
+            done_seeds = set(i["seed"] for i in self.dbase.list_subjobs(
+                self.table, db_id, ["seed"], statuses=[self.cDONE]))
+            seeds = [seed for seed in seeds if seed in done_seeds]
 
         from pyHepGrid.src.header import finalise_no_cores as n_threads
         # Check which of the seeds actually produced some data
         all_remote = self.output_name_array("", self.rcard, seeds)
-        all_output = self.gridw.get_dir_contents(header.grid_output_dir).split()
-        remote_tarfiles = list(set(all_remote) & set(all_output))
+        all_output = self.gridw.get_dir_index(header.grid_output_dir)
+        remote_tarfiles = list(set(all_remote) & all_output)
         logger.info("Found data for {0} of the {1} seeds.".format(
             len(remote_tarfiles), len(seeds)))
 
         # Download said data
         tarfiles = self._multirun(
-            self._do_get_data, remote_tarfiles, n_threads, use_counter=True)
+            self._do_get_data, remote_tarfiles, n_threads, use_counter=True,
+            family="gfal")
         tarfiles = list(filter(None, tarfiles))
         logger.info("Downloaded {0} files".format(len(tarfiles)))
 
@@ -524,11 +782,9 @@ class Backend(_mode):
         self.gridw.bring(filename, header.grid_output_dir,
                          local_file)
         if os.path.isfile(local_file):
-            global counter
             if counter:
-                counter.value += 1
                 logger.info("Downloaded {0} files ".format(
-                    counter.value))
+                    counter.increment()))
             return local_name
         else:
             return None
@@ -582,9 +838,11 @@ class Backend(_mode):
         those runs matching the search_string in runcard or runfolder will
         apear
         """
-        fields = ["rowid", "jobid", "runcard",
+        fields = ["rowid", "runcard",
                   "runfolder", "date", "jobtype", "iseed"]
         dictC = self._db_list(fields, search_string)
+        subjobs = self.dbase.summarise_subjobs(
+            self.table, [i["rowid"] for i in dictC])
         logger.plain("Active runs: " + str(len(dictC)))
 
         # Could easily be optimised
@@ -613,18 +871,65 @@ class Backend(_mode):
             run = str(i['runfolder']).center(runname_width)
             dat = str(i['date']).split('.')[0].center(date_width)
             misc = str(" "+i['jobtype'])
-            jobids = str(i['jobid'])
+            no_jobs, jobid_example = subjobs.get(i['rowid'], (0, ""))
             initial_seed = str(i['iseed'])
-            no_jobs = len(jobids.split(" "))
             if no_jobs > 1:
                 if initial_seed and initial_seed != "None":
                     misc += " ({0}, is: {1})".format(no_jobs, initial_seed)
                 else:
                     misc += " ({0})".format(no_jobs)
-            misc += self._get_computing_element(jobids)
+            misc += self._get_computing_element(str(jobid_example))
             misc_text = misc.center(misc_width)
             logger.plain("|".join([rid, ruc, run, dat, misc_text]))
 
+    def _insert_run(self, dataDict, jobids, statuses=None, ces=None):
+        """ Inserts a new run in the database together with one subjob per
+        jobid (submitted to the computing elements ces, if known), returns
+        the database id of the new run
+        """
+        with self.dbase.transaction(immediate=True):
+            dbid = self.dbase.insert_data(self.table, dataDict)
+            self.dbase.insert_subjobs(self.table, dbid, jobids,
+                                      first_seed=dataDict.get("iseed"),
+                                      statuses=statuses, ces=ces)
+            if dataDict.get("iseed") is not None:
+                no_seeds = int(dataDict.get("no_runs", len(jobids)))
+                self.dbase.record_seeds(self.table, dbid, dataDict["iseed"],
+                                        max(no_seeds, len(jobids)))
+        return dbid
+
+    def _find_submission(self, runcard, runfolder):
+        """ Returns the journaled submission of runcard and runfolder to
+        this backend which is still in progress or was interrupted (see
+        dbapi.start_submission), None if there is none """
+        for submission in self.dbase.list_submissions(self.table):
+            run = submission["run"]
+            if run["runcard"] == runcard and run["runfolder"] == runfolder:
+                return submission
+        return None
+
+    def _finish_submission(self, submission, dataDict):
+        """ Inserts the run dataDict with the jobs recorded in the journal
+        of submission, seeds which weren't submitted are marked as missing,
+        and closes the journal. Returns the database id of the new run, None
+        if no job was submitted (the seeds reserved for it are then released)
+        """
+        jobs = self.dbase.journaled_jobs(submission)
+        first_seed = int(dataDict["iseed"])
+        seeds = range(first_seed, first_seed + int(dataDict["no_runs"]))
+        jobids = [jobs.get(seed, ("None", None))[0] for seed in seeds]
+        ces = [jobs.get(seed, ("None", None))[1] for seed in seeds]
+        statuses = [self.cUNK if i != "None" else self.cMISS for i in jobids]
+        if all(i == "None" for i in jobids):
+            with self.dbase.transaction(immediate=True):
+                self.dbase.release_seeds(first_seed)
+                self.dbase.finish_submission(submission)
+            return None
+        with self.dbase.transaction(immediate=True):
+            dbid = self._insert_run(dataDict, jobids, statuses, ces=ces)
+            self.dbase.finish_submission(submission)
+        return dbid
+
     def get_active_dbids(self):
         field_name = "rowid"
         dictC = self._db_list([field_name])
@@ -33,7 +33,7 @@ if caller_script in ("main.py", "pyHepGrid"):
     import pyHepGrid.src.logger
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("mode", help="Mode [initialize/run/manage/test] ")
+    parser.add_argument("mode", help="Mode [initialize/run/manage/test/monitor] ")
     parser.add_argument("runcard", nargs="?", help="Runcard to act upon")
 
     # pyHepGrid.src.Backend selection
@@ -114,6 +114,10 @@ if caller_script in ("main.py", "pyHepGrid"):
         help="Use test queue (only runs for 20 minutes). "
         "NB this is _different_ to the test mode, which runs your 'runfile' "
         "locally for testing before submission.", action="store_true")
+    parser_run.add_argument(
+        "--resume",
+        help="Submit only the seeds missing from an interrupted production "
+        "submission", action="store_true")
 
     # Management options
     # Information about jobs
@@ -128,6 +132,22 @@ if caller_script in ("main.py", "pyHepGrid"):
         "--simple_string",
         help="To be used with -s/-S, prints one liners for done/total",
         action="store_true")
+    parser_info.add_argument(
+        "--since",
+        help="Re-poll and only print the subjob state changes since the last "
+        "check, or since a time ago (e.g. 30m, 2h, 1d) or a date "
+        "(YYYY-MM-DD HH:MM)",
+        nargs="?", const="last", default=None)
+    parser_info.add_argument(
+        "--force_poll",
+        help="To be used with -s/-S or --since, poll every unfinished subjob "
+        "instead of only those which are due to be checked again",
+        action="store_true")
+    parser_info.add_argument(
+        "--state_times",
+        help="Print the mean time subjobs spent in each state, for the whole "
+        "run and per computing element",
+        action="store_true")
     parser_info.add_argument(
         "-C", "--checkwarmup",
         help="Check completed warmup to see if a warmup file is present",
@@ -200,20 +220,32 @@ if caller_script in ("main.py", "pyHepGrid"):
         help="id of the job(s) to act on. -jall Will act on all jobs, "
         "and multiple jobs can be selected with a comma separated list "
         "and ranges sspecified by hyphens. e.g. -j1,4-6 selects jobs 1,4,5,6")
+    parser_db.add_argument(
+        "--workers",
+        help="Number of database entries to act on at the same time when "
+        "several are selected. The output is still printed in order",
+        type=int, default=1)
     parser_db.add_argument(
         "-e", "--enableme", help="enable database entry", action="store_true")
     parser_db.add_argument("-d", "--disableme",
                            help="disable database entry", action="store_true")
     parser_db.add_argument(
         "-f", "--find",
-        help="Only show database entries, which a certain string")
+        help="Only show database entries, which a certain string. "
+        "The wildcards * and ? match the whole runcard/runname instead "
+        "(e.g. -f \"Z*\" for runcards starting by Z)")
     parser_db.add_argument(
         "--done",
         help="For multiruns, only act on jobs which have the done status "
         "stored in the database", action="store_true")
     parser_db.add_argument(
-        "--list_disabled", help="List also disabled entries",
-        action="store_true")
+        "--list_disabled", help="List also disabled entries, including the "
+        "archived ones", action="store_true")
+    parser_db.add_argument(
+        "--archive",
+        help="Move all disabled entries (with their subjobs) to the archive. "
+        "Archived entries are only reachable with --list_disabled and are "
+        "brought back when enabled", action="store_true")
 
     # Some Arc-only utilities
     parser_arc = parser.add_argument_group("arc-only options")
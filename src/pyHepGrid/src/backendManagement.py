@@ -6,8 +6,14 @@
 import pyHepGrid.src.utilities as util
 import pyHepGrid.src.header as header
 from pyHepGrid.src.Backend import Backend
+from datetime import datetime
 import shutil
 import os
+import threading
+
+# Runs managed concurrently share the DIRAC snapshot, only one of them queries
+# DIRAC. Module level, so that backends can still be pickled
+_snapshot_lock = threading.Lock()
 
 
 class Arc(Backend):
@@ -37,11 +43,11 @@ class Arc(Backend):
         """ retrieves stdout of all running jobs and store the current state
         into its correspondent folder
         """
-        fields = ["rowid", "jobid", "pathfolder", "runfolder"]
+        fields = ["rowid", "pathfolder", "runfolder"]
         dictC = self._db_list(fields)
         for job in dictC:
             # Retrieve data from database
-            jobid = str(job['jobid'])
+            jobid = " ".join(self.get_id(job['rowid']))
             rfold = str(job['runfolder'])
             pfold = str(job['pathfolder']) + "/" + rfold
             flnam = pfold + "/stdout"
@@ -124,13 +130,13 @@ class Arc(Backend):
         """ Sometimes we want to retrieve the warmup before the job finishes """
         output_folder = ["file:///tmp/"]
         cmd_base = ["gfal-copy", "-v"]
-        fields = ["pathfolder", "runfolder", "jobid"]
+        fields = ["pathfolder", "runfolder"]
         data = self.dbase.list_data(self.table, fields, db_id)[0]
         runfolder = data["runfolder"]
         finfolder = data["pathfolder"] + "/" + runfolder + "/"
         if header.finalisation_script is not None:
             finfolder = header.default_runfolder
-        jobids = data["jobid"].split()
+        jobids = self.get_id(db_id)
         output_folder = ["file://" + finfolder]
         for jobid in jobids:
             cmd = cmd_base + [jobid + "/*.y*"] + output_folder
@@ -157,6 +163,13 @@ class Arc(Backend):
 
 
 class Dirac(Backend):
+    # DIRAC job states queried for stats and their status codes
+    dirac_states = {"Waiting": Backend.cWAIT,
+                    "Done": Backend.cDONE,
+                    "Running": Backend.cRUN,
+                    "Failed": Backend.cFAIL,
+                    "Unknown": Backend.cUNK}
+
     cmd_print = "dirac-wms-job-peek"
     cmd_kill = "dirac-wms-job-kill"
     cmd_stat = "dirac-wms-job-status"
@@ -164,6 +177,10 @@ class Dirac(Backend):
     def __init__(self, **kwargs):
         super(Dirac, self).__init__(**kwargs)
         self.table = header.diractable
+        # {jobid: status} of all the jobs of the owner modified after
+        # self._snapshot_date, shared by all runs of this invocation
+        self._snapshot = None
+        self._snapshot_date = None
 
     def __str__(self):
         return "Dirac"
@@ -176,7 +193,8 @@ class Dirac(Backend):
 
     def status_job(self, jobids, verbose=False):
         """ query dirac on a job-by-job basis about the status of the job """
-        self._multirun(self.do_status_job, jobids, header.finalise_no_cores)
+        self._multirun(self.do_status_job, jobids, header.finalise_no_cores,
+                       family="dirac")
 
     def do_status_job(self, jobid):
         """ multiproc wrapper for status_job """
@@ -195,44 +213,76 @@ class Dirac(Backend):
         header.logger.debug(output)
         return output
 
-    def stats_job(self, dbid):
+    def prepare_stats(self, db_ids):
+        """ Starts a new state snapshot, covering the dates of all the runs in
+        db_ids so that a single snapshot serves all of them """
+        db_ids = set(str(i) for i in db_ids)
+        dates = [i["date"].split()[0] for i in self.dbase.list_data(
+            self.table, ["rowid", "date"])
+            if str(i["rowid"]) in db_ids and i["date"]]
+        with _snapshot_lock:
+            self._snapshot = None
+            self._snapshot_date = min(dates, default=None)
+
+    def get_state_snapshot(self, date):
+        """ Returns {jobid: status} for all the jobs of the owner modified
+        since date. DIRAC is only queried (once per state) if the snapshot
+        already taken doesn't go back to date, and then for the earliest
+        date known to be needed (see prepare_stats). Jobs modified since a
+        date are also modified since any earlier date, so a snapshot serves
+        every run submitted after its date
+        """
+        with _snapshot_lock:
+            if self._snapshot is not None and self._snapshot_date <= date:
+                return self._snapshot
+            if self._snapshot_date is None or self._snapshot_date > date:
+                self._snapshot_date = date
+            snapshot = {}
+            for state, status in self.dirac_states.items():
+                for jobid in self.get_status(state, self._snapshot_date):
+                    snapshot[jobid] = status
+            self._snapshot = snapshot
+            return snapshot
+
+    def stats_job(self, dbid, do_print=True):
         """ When using Dirac, instead of asking for each job individually
         we can ask for batchs of jobs in a given state and compare.
         """
-        jobids = self.get_id(dbid)
+        poll_date = datetime.now()
+        subjobs = self.dbase.list_subjobs(
+            self.table, dbid, ["seed", "jobid", "status", "updated"])
         tags = ["runcard", "runfolder", "date"]
         runcard_info = self.dbase.list_data(self.table, tags, dbid)[0]
 
-        try:
-            self.__first_call_stats
-        except AttributeError:
-            self.__first_call_stats = False
         date = runcard_info["date"].split()[0]
-        jobids_set = set(jobids)
-        # Get all jobs in each state
-        waiting_jobs = self.get_status('Waiting', date)
-        done_jobs = self.get_status('Done', date)
-        running_jobs = self.get_status('Running', date)
-        fail_jobs = self.get_status('Failed', date)
-        unk_jobs = self.get_status('Unknown', date)
-        failed_jobs_set = jobids_set & fail_jobs
-        done_jobs_set = jobids_set & done_jobs
+        snapshot = self.get_state_snapshot(date)
+        # Finished jobs may no longer be listed, keep their stored status.
+        # Seeds which could not be submitted (jobid "None") stay missing
+        final = (self.cDONE, self.cFAIL, self.cMISS)
+        # Jobs in any other state are waiting
+        status = [snapshot.get(i["jobid"], i["status"] if i["status"] in final
+                               else self.cWAIT) for i in subjobs]
         # Count how many jobs we have in each state
-        fail = len(failed_jobs_set)
-        done = len(done_jobs_set)
-        wait = len(jobids_set & waiting_jobs)
-        run = len(jobids_set & running_jobs)
-        unk = len(jobids_set & unk_jobs)
-        # Save done and failed jobs to the database
-        status = len(jobids)*[0]
-        for jobid in failed_jobs_set:
-            status[jobids.index(jobid)] = self.cFAIL
-        for jobid in done_jobs_set:
-            status[jobids.index(jobid)] = self.cDONE
-        self.stats_print_setup(runcard_info, dbid=dbid)
-        total = len(jobids)
-        self.print_stats(done, wait, run, fail, 0, unk, total)
-        self._set_new_status(dbid, status)
+        fail = status.count(self.cFAIL)
+        done = status.count(self.cDONE)
+        wait = status.count(self.cWAIT)
+        run = status.count(self.cRUN)
+        miss = status.count(self.cMISS)
+        unk = status.count(self.cUNK)
+        # Save the new states to the database
+        new_status = {}
+        for subjob, new in zip(subjobs, status):
+            if subjob["status"] != new:
+                new_status[subjob["seed"]] = new
+        if do_print:
+            self.stats_print_setup(runcard_info, dbid=dbid)
+            total = len(subjobs)
+            self.print_stats(done, wait, run, fail, miss, unk, total)
+        next_polls = self._schedule_polls(dbid, subjobs, new_status, poll_date)
+        with self.dbase.transaction():
+            self._set_new_status(dbid, new_status, poll_date)
+            self.dbase.set_next_polls(self.table, dbid, next_polls)
+        self._record_poll(dbid, poll_date)
 
     def kill_job(self, jobids, jobinfo):
         """ kill all jobs associated with this run """
@@ -250,6 +300,23 @@ class Dirac(Backend):
 
 
 class Slurm(Backend):
+    # sacct/squeue job states, anything else is unknown
+    slurm_states = {"COMPLETED": Backend.cDONE,
+                    "PENDING": Backend.cWAIT,
+                    "REQUEUED": Backend.cWAIT,
+                    "SUSPENDED": Backend.cWAIT,
+                    "RUNNING": Backend.cRUN,
+                    "COMPLETING": Backend.cRUN,
+                    "CONFIGURING": Backend.cRUN,
+                    "FAILED": Backend.cFAIL,
+                    "CANCELLED": Backend.cFAIL,
+                    "TIMEOUT": Backend.cFAIL,
+                    "NODE_FAIL": Backend.cFAIL,
+                    "OUT_OF_MEMORY": Backend.cFAIL,
+                    "PREEMPTED": Backend.cFAIL,
+                    "BOOT_FAIL": Backend.cFAIL,
+                    "DEADLINE": Backend.cFAIL}
+
     def __init__(self, production=False, **kwargs):
         # Might not work on python2?
         super(Slurm, self).__init__(**kwargs)
@@ -266,7 +333,7 @@ class Slurm(Backend):
         return retstr
 
     def _get_data_warmup(self, db_id):
-        fields = ["runcard", "runfolder", "jobid", "pathfolder"]
+        fields = ["runcard", "runfolder", "pathfolder"]
         data = self.dbase.list_data(self.table, fields, db_id)[0]
         warmup_output_dir = self.get_local_dir_name(
             data["runcard"], data["runfolder"])
@@ -284,7 +351,7 @@ class Slurm(Backend):
         header.logger.info("Warmup stored in {0}".format(warmup_dir))
 
     def _get_data_production(self, db_id):
-        fields = ["runcard", "runfolder", "jobid", "pathfolder"]
+        fields = ["runcard", "runfolder", "pathfolder"]
         data = self.dbase.list_data(self.table, fields, db_id)[0]
         production_output_dir = self.get_local_dir_name(
             data["runcard"], data["runfolder"])
@@ -338,42 +405,165 @@ class Slurm(Backend):
             cmd = ["cat", os.path.join(run_dir, log)]
             util.spCall(cmd)
 
-    def get_status(self, jobid, status):
-        stat = len(
-            [i for i in util.getOutputCall(
-                ["squeue", F"-j{jobid}", "-r", "-t", status],
-                suppress_errors=True, include_return_code=False
-            ).split("\n")[1:]
-                if "error" not in i])  # strip header from results
-        if stat > 0:
-            stat = stat-1
-        return stat
-
-    def stats_job(self, dbid):
+    def _array_ids(self, jobids):
+        """ Slurm ids of the arrays (or single jobs) of the given subjob ids.
+        Array tasks are stored as <array id>_<task id> """
+        return list(dict.fromkeys(str(i).split("_")[0] for i in jobids))
+
+    def _split_slurm_id(self, jobid):
+        """ Splits a sacct/squeue job id into (array id, [task ids]),
+        expanding the ranges of pending tasks, e.g. 12_[1-3,7%2] gives
+        ("12", [1, 2, 3, 7]). Jobs which are not arrays have no task id
+        """
+        if "_" not in jobid:
+            return jobid, [None]
+        array, tasks = jobid.split("_", 1)
+        task_ids = []
+        for task in tasks.strip("[]").split("%")[0].split(","):
+            if "-" in task:
+                first, last = task.split("-")
+                task_ids += range(int(first), int(last)+1)
+            elif task.isdigit():
+                task_ids.append(int(task))
+        return array, task_ids
+
+    def _query_slurm_states(self, array_ids):
+        """ Queries the state of every task of the given arrays with a single
+        sacct call. Returns a dictionary {(array id, task id): status} and
+        whether finished jobs are included, which they are not when
+        accounting is not available and squeue has to be used instead
+        """
+        cmd = ["sacct", "-X", "-n", "-P", "-o", "JobID,State",
+               "-j", ",".join(array_ids)]
+        accounting = True
+        try:
+            output, return_code = util.getOutputCall(cmd, suppress_errors=True)
+        except Exception:
+            return_code = -1
+        if return_code != 0:
+            accounting = False
+            cmd = ["squeue", "-h", "-r", "-o", "%i|%T",
+                   "-j", ",".join(array_ids)]
+            output = util.getOutputCall(cmd, suppress_errors=True,
+                                        include_return_code=False)
+        states = {}
+        for line in output.splitlines():
+            if "|" not in line:
+                continue
+            jobid, state = line.split("|")[:2]
+            # e.g. "CANCELLED by 1234"
+            state = state.split()[0] if state.strip() else ""
+            array, task_ids = self._split_slurm_id(jobid.strip())
+            for task_id in task_ids:
+                states[(array, task_id)] = self.slurm_states.get(
+                    state, self.cUNK)
+        return states, accounting
+
+    def _task_statuses(self, subjobs):
+        """ Polls the scheduler once for all the given subjobs (dictionaries
+        with seed, jobid and status) and returns the status of every task,
+        for counting, and {seed: status} for the subjobs which changed """
+        final = (self.cDONE, self.cFAIL)
+        to_poll = [i["jobid"] for i in subjobs if i["status"] not in final]
+        states, accounting = {}, True
+        if to_poll:
+            states, accounting = self._query_slurm_states(
+                self._array_ids(to_poll))
+        status = []
+        new_status = {}
+        for subjob in subjobs:
+            array, _, task_id = str(subjob["jobid"]).partition("_")
+            if subjob["status"] in final:
+                tasks = [subjob["status"]]
+            elif task_id:
+                tasks = [states.get((array, int(task_id)))]
+            elif (array, None) in states:
+                tasks = [states[(array, None)]]
+            else:
+                # Entries from older versions store only the array id
+                tasks = [v for k, v in states.items() if k[0] == array] or \
+                    [None]
+            # squeue only knows about the tasks still in the queue
+            tasks = [i if i is not None else
+                     (self.cUNK if accounting else self.cDONE)
+                     for i in tasks]
+            status += tasks
+            if len(tasks) == 1:
+                new = tasks[0]
+            elif self.cRUN in tasks or self.cWAIT in tasks:
+                new = self.cRUN if self.cRUN in tasks else self.cWAIT
+            else:
+                new = self.cFAIL if self.cFAIL in tasks else self.cDONE
+            if new != subjob["status"]:
+                new_status[subjob["seed"]] = new
+        return status, new_status
+
+    def _expand_legacy_array(self, dbid, subjobs):
+        """ Productions from older versions stored their whole array as a
+        single subjob with the bare array id. Such a subjob is replaced by
+        one per task (no_runs of them), as stored by new productions, so that
+        each task keeps its own status. Returns the subjobs of dbid """
+        if len(subjobs) != 1 or "_" in str(subjobs[0]["jobid"]):
+            return subjobs
+        info = self.dbase.list_data(
+            self.table, ["jobtype", "iseed", "no_runs"], dbid)[0]
+        try:
+            no_runs = int(info["no_runs"])
+        except (TypeError, ValueError):
+            return subjobs
+        if info["jobtype"] != "Production" or no_runs < 2:
+            return subjobs
+        array = subjobs[0]["jobid"]
+        header.logger.debug("Expanding array {0} of run {1} into {2} "
+                            "subjobs".format(array, dbid, no_runs))
+        self.dbase.replace_subjobs(
+            self.table, dbid,
+            ["{0}_{1}".format(array, task) for task in range(1, no_runs+1)],
+            first_seed=info["iseed"])
+        return self.dbase.list_subjobs(
+            self.table, dbid, ["seed", "jobid", "status", "updated"])
+
+    def stats_job(self, dbid, do_print=True):
+        poll_date = datetime.now()
         tags = ["runcard", "runfolder", "date"]
-        jobids = self.get_id(dbid)  # only have one array id for SLURM
+        subjobs = self.dbase.list_subjobs(
+            self.table, dbid, ["seed", "jobid", "status", "updated"])
+        subjobs = self._expand_legacy_array(dbid, subjobs)
         runcard_info = self.dbase.list_data(self.table, tags, dbid)[0]
-        running, waiting, fail, tot = 0, 0, 0, 0
-        for jobid in jobids:
-            running += self.get_status(jobid, "R")
-            waiting += self.get_status(jobid, "PD")
-            fail += self.get_status(jobid, "F")+self.get_status(jobid, "CA")
-            tot += self.get_status(jobid, "all")
-        done = tot-fail-waiting-running
-        self.stats_print_setup(runcard_info, dbid=dbid)
-        self.print_stats(done, waiting, running, fail, 0, 0, tot)
+        status, new_status = self._task_statuses(subjobs)
+        next_polls = self._schedule_polls(dbid, subjobs, new_status, poll_date)
+        with self.dbase.transaction():
+            self._set_new_status(dbid, new_status, poll_date)
+            self.dbase.set_next_polls(self.table, dbid, next_polls)
+        done = status.count(self.cDONE)
+        waiting = status.count(self.cWAIT)
+        running = status.count(self.cRUN)
+        fail = status.count(self.cFAIL)
+        unk = status.count(self.cUNK)
+        if do_print:
+            self.stats_print_setup(runcard_info, dbid=dbid)
+            self.print_stats(done, waiting, running, fail, 0, unk,
+                             len(status))
+        self._record_poll(dbid, poll_date)
+        return done, waiting, running, fail, unk
 
     def cat_job(self, jobids, jobinfo, print_stderr=None, store=False):
         """ print standard output of a given job"""
         dir_name = self.get_stdout_dir_name(self.get_local_dir_name(
             jobinfo["runcard"], jobinfo["runfolder"]))
-        # jobids = length 1 for SLURM jobs - just take the only element here
-        jobid = jobids[0]
         output = []
         if jobinfo["jobtype"] == "Production" or "Socket" in jobinfo["jobtype"]:
-            for subjobno in range(1, int(jobinfo["no_runs"])+1):
-                stdoutfile = os.path.join(
-                    dir_name, "slurm-{0}_{1}.out".format(jobid, subjobno))
+            stdoutfiles = []
+            for jobid in jobids:
+                if "_" in str(jobid):
+                    stdoutfiles.append("slurm-{0}.out".format(jobid))
+                else:
+                    # Entries from older versions store only the array id
+                    stdoutfiles += [
+                        "slurm-{0}_{1}.out".format(jobid, subjobno)
+                        for subjobno in range(1, int(jobinfo["no_runs"])+1)]
+            for stdoutfile in stdoutfiles:
+                stdoutfile = os.path.join(dir_name, stdoutfile)
                 if print_stderr:
                     stdoutfile = stdoutfile.replace(".out", ".err")
                 cmd = ["cat", stdoutfile]
@@ -383,6 +573,8 @@ class Slurm(Backend):
                     output.append(util.getOutputCall(cmd, suppress_errors=True,
                                                      include_return_code=False))
         else:
+            # Warmups are a single job
+            jobid = jobids[0]
             stdoutfile = os.path.join(dir_name, F"slurm-{jobid}.out")
             if print_stderr:
                 stdoutfile = stdoutfile.replace(".out", ".err")
@@ -402,8 +594,9 @@ class Slurm(Backend):
                 "No jobids stored associated with this database entry, "
                 "therefore nothing to kill.")
 
-        for jobid in jobids:
-            util.spCall(["scancel", str(jobid)])
+        # Array tasks are cancelled one by one (in a single call) so that
+        # status filters are respected
+        util.spCall(["scancel"] + [str(jobid) for jobid in jobids])
         # Kill the socket server if needed
         # if "Socket" in jobinfo["jobtype"]:
         #     hostname = header.server_host
@@ -416,14 +609,11 @@ class Slurm(Backend):
 
     def status_job(self, jobids, verbose=False):
         """ print the current status of a given job """
-        running, waiting, fail, tot = 0, 0, 0, 0
-        for jobid in jobids:
-            running += self.get_status(jobid, "R")
-            waiting += self.get_status(jobid, "PD")
-            fail += self.get_status(jobid, "F")+self.get_status(jobid, "CA")
-            tot += self.get_status(jobid, "all")
-        done = tot-fail-waiting-running
-        self.print_stats(done, waiting, running, fail, 0, 0, tot)
+        status, _ = self._task_statuses(
+            [{"seed": None, "jobid": i, "status": None} for i in jobids])
+        self.print_stats(status.count(self.cDONE), status.count(self.cWAIT),
+                         status.count(self.cRUN), status.count(self.cFAIL), 0,
+                         status.count(self.cUNK), len(status))
 
 
 if __name__ == '__main__':
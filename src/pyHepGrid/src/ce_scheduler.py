@@ -0,0 +1,120 @@
+"""
+Choice of the computing element (CE) each batch of a production is sent to.
+
+The CEs of the pool (header.ce_pool) are picked at random with weights
+favouring CEs with free cores (as reported by lcg-infosites), which answer
+arcsub quickly and where our recent jobs did not fail. The weights are
+updated as the production is submitted: every job sent to a CE takes one of
+its free cores, and the latency and failures of every arcsub call count
+towards those of its CE.
+"""
+import datetime
+import random
+import threading
+import pyHepGrid.extras.get_site_info as get_site_info
+import pyHepGrid.src.header as header
+
+# Seconds of arcsub latency per job which halve the weight of a CE
+LATENCY_SCALE = 1.0
+# Weight given to past latencies in the running mean of each CE
+LATENCY_MEMORY = 0.7
+
+
+def get_pool(test=False):
+    """ CEs to spread the submission over, from header.ce_pool or else
+    ce_base (and its Durham sibling if split_dur_ce) """
+    if test:
+        return [header.ce_test]
+    if header.ce_pool:
+        return list(dict.fromkeys(header.ce_pool))
+    if header.split_dur_ce and ".dur.scotgrid.ac.uk" in header.ce_base:
+        return ["ce1.dur.scotgrid.ac.uk", "ce2.dur.scotgrid.ac.uk"]
+    return [header.ce_base]
+
+
+class CEScheduler(object):
+    """ Weighted choice of CE, see the module docstring
+
+    Attributes:
+        ces: list of the CEs to choose from
+        free_cores: {ce: free cores}, CEs missing count as having none free
+            (all CEs count the same if it is empty)
+        outcomes: {ce: [failed jobs, finished jobs]} from the database and
+            the submissions so far
+    """
+
+    def __init__(self, ces, free_cores=None, outcomes=None):
+        self.ces = list(ces)
+        self.free_cores = dict(free_cores or {})
+        outcomes = outcomes or {}
+        self.outcomes = {ce: list(outcomes.get(ce, (0, 0)))
+                         for ce in self.ces}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def failure_rate(self, ce):
+        failed, total = self.outcomes[ce]
+        # Smoothed so that a single failure doesn't rule a CE out
+        return failed/(total + 1)
+
+    def weight(self, ce):
+        if self.free_cores:
+            cores = max(self.free_cores.get(ce, 0), 0) + 1
+        else:
+            cores = 1
+        latency = self._latency.get(ce, 0.0)
+        return cores*(1 - self.failure_rate(ce))/(1 + latency/LATENCY_SCALE)
+
+    def choose(self):
+        """ Picks the CE to send the next batch to """
+        if len(self.ces) == 1:
+            return self.ces[0]
+        with self._lock:
+            weights = [self.weight(ce) for ce in self.ces]
+        return random.choices(self.ces, weights)[0]
+
+    def record_submission(self, ce, seconds, no_jobs, no_submitted):
+        """ Accounts for an arcsub call to ce which took seconds to submit
+        no_submitted of no_jobs jobs """
+        with self._lock:
+            per_job = seconds/max(no_jobs, 1)
+            if ce in self._latency:
+                per_job = LATENCY_MEMORY*self._latency[ce] + \
+                    (1 - LATENCY_MEMORY)*per_job
+            self._latency[ce] = per_job
+            if ce in self.free_cores:
+                self.free_cores[ce] = max(
+                    self.free_cores[ce] - no_submitted, 0)
+            self.outcomes[ce][0] += no_jobs - no_submitted
+            self.outcomes[ce][1] += no_jobs
+
+    def summary(self):
+        """ One line per CE with what its weight is made of """
+        lines = []
+        for ce in self.ces:
+            lines.append(
+                "{0:35} free cores: {1:>6} failure rate: {2:5.1%} "
+                "latency: {3:5.2f}s/job".format(
+                    ce, self.free_cores.get(ce, "?"), self.failure_rate(ce),
+                    self._latency.get(ce, 0.0)))
+        return lines
+
+
+def from_database(backend, test=False):
+    """ Scheduler over the CE pool with the free cores reported by
+    lcg-infosites and the failure rates of the jobs of the backend which
+    finished in the last header.ce_failure_window hours """
+    ces = get_pool(test)
+    if len(ces) == 1:
+        return CEScheduler(ces)
+    free_cores = get_site_info.get_free_cores(ces)
+    since = datetime.datetime.now() - datetime.timedelta(
+        hours=header.ce_failure_window)
+    counts = backend.dbase.ce_outcomes(
+        backend.table, since, [backend.cDONE, backend.cFAIL, backend.cMISS])
+    outcomes = {}
+    for ce, statuses in counts.items():
+        failed = statuses.get(backend.cFAIL, 0) + \
+            statuses.get(backend.cMISS, 0)
+        outcomes[ce] = (failed, sum(statuses.values()))
+    return CEScheduler(ces, free_cores, outcomes)
@@ -0,0 +1,39 @@
+"""
+Fixtures of the unit tests (pytest src/): a temporary database and, instead
+of the grid and batch tools, the offline simulator of
+pyHepGrid.extras.fake_grid.
+"""
+import argparse
+import os
+import pytest
+import pyHepGrid.extras.fake_grid as fake_grid
+import pyHepGrid.src.dbapi as dbapi
+import pyHepGrid.src.header as header
+
+# The local test mode of pyHepGrid (pyHepGrid test), not unit tests
+collect_ignore = ["test_nnlojob.py"]
+
+
+@pytest.fixture
+def dbname(tmp_path, monkeypatch):
+    """ Path of a new database with the tables of the header, which the
+    backends created in the test use """
+    path = str(tmp_path / "db" / "jobs.dat")
+    monkeypatch.setattr(header, "dbname", path)
+    dbapi._open_database(path)
+    return path
+
+
+@pytest.fixture
+def fake_grid_state(tmp_path, monkeypatch):
+    """ State directory of a fake grid whose tools come first in PATH. Jobs
+    stay queued for the length of the test, and nothing fails """
+    state = str(tmp_path / "grid")
+    fake_grid.init(argparse.Namespace(
+        state=state, latency=0.0, submit_failure_rate=0.0,
+        job_failure_rate=0.0, missing_rate=0.0, storage_failure_rate=0.0,
+        queue_time=3600.0, run_time=3600.0, seed=1))
+    monkeypatch.setenv("PATH", os.path.join(state, "bin") + os.pathsep +
+                       os.environ.get("PATH", ""))
+    monkeypatch.setattr(header, "arcbase", os.path.join(state, "jobs.dat"))
+    return state
@@ -1,30 +1,147 @@
+import json
+import os
 import sqlite3 as dbapi
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# Number of compiled statements kept by each connection. All queries are
+# parameterised so that repeated calls reuse the same compiled statement
+STATEMENT_CACHE_SIZE = 256
+# Seconds a connection waits for another process to release the database
+# before giving up with "database is locked"
+BUSY_TIMEOUT = 120
+# Ledger of the blocks of seeds already in use by (or reserved for) runs
+SEED_TABLE = "seed_ranges"
+# Fields of the run tables indexed for text search by find_and_list
+SEARCH_FIELDS = ["runcard", "runfolder", "jobtype"]
+# Record of the schema migrations applied to the database
+SCHEMA_TABLE = "schema_version"
+# Heartbeat of the running monitor (pyHepGrid monitor), if any
+MONITOR_TABLE = "monitor"
+# Write-ahead journal of the submissions in progress and of their jobs
+SUBMISSION_TABLE = "submissions"
+SUBMISSION_JOB_TABLE = "submission_jobs"
+# Ordered schema migrations, the database is at version n once the first n
+# have been applied. New columns or indexes are added by appending a
+# migration here, never by changing one which has already been released
+MIGRATIONS = ["_migrate_run_tables",
+              "_migrate_transition_tables",
+              "_migrate_subjob_tables",
+              "_migrate_seed_table",
+              "_migrate_search_tables",
+              "_migrate_archive_tables",
+              "_migrate_subjob_poll_times",
+              "_migrate_monitor_table",
+              "_migrate_subjob_ces",
+              "_migrate_submission_journal",
+              "_migrate_monitor_tables"]
 
 
 class database(object):
     def __init__(self, db, tables=None, fields=None, logger=None):
-        import os
         self._setup_logger(logger)
         self.dbname = db
         if not os.path.exists(os.path.dirname(self.dbname)):
             os.makedirs(os.path.dirname(self.dbname))
-        self.db = dbapi.connect(self.dbname, check_same_thread=True)
+        self._local = threading.local()
+        # Writes from all the threads of a process go through one at a time
+        self._write_lock = threading.RLock()
         self.list_disabled = False
+        self._known_tables = {}
         if tables:
-            # check whether table exists and create it othewise
-            for table in tables:
-                if self._is_this_table_here(table):
-                    # if table does exist, check the list of tables is correct
-                    # and correct it otherwise
-                    self._protect_fields(table, fields)
-                else:
-                    self._create_table(table, fields)
+            self._migrate(tables, fields)
+
+    def _connect(self):
+        """ Opens a new connection to the database in WAL mode, so that
+        several processes can read while one of them writes """
+        connection = dbapi.connect(self.dbname, check_same_thread=True,
+                                   timeout=BUSY_TIMEOUT,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+        connection.execute("pragma journal_mode=WAL;")
+        # With WAL, NORMAL is still safe against corruption and avoids an
+        # fsync per commit
+        connection.execute("pragma synchronous=NORMAL;")
+        return connection
+
+    @property
+    def db(self):
+        """ Connection to the database for the current thread. A new
+        connection is opened the first time it is used in any thread or
+        process, so the database object can be shared with forked workers
+        and threads
+        """
+        local = self._local
+        if getattr(local, "db", None) is None or local.pid != os.getpid():
+            local.db = self._connect()
+            local.pid = os.getpid()
+            local.in_transaction = False
+        return local.db
+
+    @property
+    def _in_transaction(self):
+        return getattr(self._local, "in_transaction", False)
+
+    @_in_transaction.setter
+    def _in_transaction(self, value):
+        self._local.in_transaction = value
+
+    def __getstate__(self):
+        # Connections and locks can't be pickled, workers open their own
+        state = self.__dict__.copy()
+        del state["_local"]
+        del state["_write_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
 
     def close(self):
-        self.db = None
+        local = self._local
+        if getattr(local, "db", None) is not None and \
+                local.pid == os.getpid():
+            local.db.close()
+        local.db = None
 
     def reopen(self):
-        self.db = dbapi.connect(self.dbname)
+        self.close()
+        return self.db
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """ Groups all queries executed inside the context into a single
+        transaction, committed once at the end or rolled back on error.
+        Nested transactions are merged into the outermost one.
+        If immediate, the database is locked for writing from the start so
+        that values read inside the transaction can't change under our feet
+        """
+        if self._in_transaction:
+            yield self
+            return
+        with self._write_lock:
+            if self.db.in_transaction:
+                self.db.commit()
+            self._in_transaction = True
+            if immediate:
+                self.db.execute("begin immediate")
+            else:
+                self.db.execute("begin")
+            try:
+                yield self
+            except BaseException:
+                self.db.rollback()
+                raise
+            else:
+                self.db.commit()
+            finally:
+                self._in_transaction = False
+
+    def _commit(self):
+        """ Commits unless we are inside an explicit transaction """
+        if not self._in_transaction:
+            self.db.commit()
 
     def _setup_logger(self, logger):
         if logger is not None:
@@ -37,32 +154,201 @@ class database(object):
             database.logger.debug = print
             database.logger.critical = print
 
+    def _schema_version(self):
+        """ Number of migrations already applied to the database """
+        try:
+            version = self.db.execute(
+                "select max(version) from {0};".format(SCHEMA_TABLE))
+        except dbapi.OperationalError:
+            # No schema table yet, nothing applied
+            return 0
+        return version.fetchone()[0] or 0
+
+    def _migrate(self, tables, fields):
+        """ Brings the database up to the latest schema version by applying
+        the pending MIGRATIONS in order, each in its own transaction.
+        Once the database is up to date this only checks that the run tables
+        and fields of the header are there (see _check_run_tables)
+        """
+        tables = list(dict.fromkeys(tables))
+        if self._schema_version() >= len(MIGRATIONS):
+            self._check_run_tables(tables, fields)
+            return
+        while True:
+            # Lock before re-reading so concurrent invocations don't apply
+            # the same migration twice
+            with self.transaction(immediate=True):
+                if not self._is_this_table_here(SCHEMA_TABLE):
+                    self._execute_and_commit(
+                        "create table {0} (version integer primary key, "
+                        "date text);".format(SCHEMA_TABLE))
+                version = self._schema_version()
+                if version >= len(MIGRATIONS):
+                    break
+                migration = MIGRATIONS[version]
+                database.logger.info(
+                    "Migrating database to schema version {0}".format(
+                        version + 1))
+                getattr(self, migration)(tables, fields)
+                self._execute_and_commit(
+                    "insert into {0} (version, date) values (?, ?);".format(
+                        SCHEMA_TABLE),
+                    (version + 1, str(datetime.now())))
+
+    def _check_run_tables(self, tables, fields):
+        """ Creates the run tables (with the tables and columns that go
+        with them) and the fields which were added to the header or runcard
+        after the database was migrated, e.g. a new arcprodtable or
+        dbfields. When nothing changed this is a read per table """
+        fields = fields or []
+        c = self._execute_and_retrieve(
+            "select name from sqlite_master where type='table';")
+        existing = set(i[0] for i in c)
+        c.close()
+        new_tables = [i for i in tables if i not in existing]
+        old_tables = [i for i in tables if i in existing and
+                      set(fields) - set(self._get_fields_in_table(i))]
+        if not new_tables and not old_tables:
+            return
+        with self.transaction(immediate=True):
+            for table in old_tables:
+                self._protect_fields(table, fields)
+            if new_tables:
+                # Every migration only acts on what is missing, so running
+                # them all brings new tables up to the current schema
+                for migration in MIGRATIONS:
+                    getattr(self, migration)(new_tables, fields)
+
+    def _migrate_run_tables(self, tables, fields):
+        # check whether table exists and create it othewise
+        for table in tables:
+            if self._is_this_table_here(table):
+                # if table does exist, check the list of tables is
+                # correct and correct it otherwise
+                self._protect_fields(table, fields)
+            else:
+                self._create_table(table, fields)
+
+    def _migrate_transition_tables(self, tables, fields):
+        # History of subjob status changes, append only
+        for table in tables:
+            if not self._is_this_table_here(self._transition_table(table)):
+                self._create_transition_table(table)
+
+    def _migrate_subjob_tables(self, tables, fields):
+        # Subjobs live in their own table, one row per seed
+        for table in tables:
+            if not self._is_this_table_here(self._subjob_table(table)):
+                self._create_subjob_table(table)
+                self._migrate_to_subjobs(table)
+
+    def _migrate_seed_table(self, tables, fields):
+        if not self._is_this_table_here(SEED_TABLE):
+            self._create_seed_table()
+            for table in tables:
+                self._backfill_seed_ranges(table)
+
+    def _migrate_search_tables(self, tables, fields):
+        for table in tables:
+            if not self._is_this_table_here(self._search_table(table)):
+                self._create_search_table(table)
+
+    def _migrate_archive_tables(self, tables, fields):
+        for table in tables:
+            if not self._is_this_table_here(self._archive_table(table)):
+                self._create_archive_tables(table)
+            self._execute_and_commit(
+                F"create index if not exists {table}_status "
+                F"on {table} (status);")
+
+    def _migrate_subjob_poll_times(self, tables, fields):
+        # Time at which each subjob is due to be polled again
+        for table in tables:
+            for archived in (False, True):
+                subtable = self._subjob_table(table, archived)
+                if not self._is_field_in_table(subtable, "next_poll"):
+                    self._insert_field_in_table(subtable, "next_poll", "text")
+
+    def _migrate_monitor_table(self, tables, fields):
+        if not self._is_this_table_here(MONITOR_TABLE):
+            database.logger.info(
+                "Creating new table: {0}".format(MONITOR_TABLE))
+            self._execute_and_commit(
+                F"create table {MONITOR_TABLE} (host text, pid integer, "
+                "started text, heartbeat text);")
+
+    def _migrate_subjob_ces(self, tables, fields):
+        # Computing element each subjob was submitted to
+        for table in tables:
+            for archived in (False, True):
+                subtable = self._subjob_table(table, archived)
+                if not self._is_field_in_table(subtable, "ce"):
+                    self._insert_field_in_table(subtable, "ce", "text")
+
+    def _migrate_submission_journal(self, tables, fields):
+        if not self._is_this_table_here(SUBMISSION_TABLE):
+            database.logger.info(
+                "Creating new table: {0}".format(SUBMISSION_TABLE))
+            self._execute_and_commit(
+                F"create table {SUBMISSION_TABLE} (run_table text, run text, "
+                "started text);")
+            self._execute_and_commit(
+                F"create table {SUBMISSION_JOB_TABLE} (submission integer, "
+                "seed integer, jobid text, ce text, date text);")
+            self._execute_and_commit(
+                F"create unique index {SUBMISSION_JOB_TABLE}_seed "
+                F"on {SUBMISSION_JOB_TABLE} (submission, seed);")
+
+    def _migrate_monitor_tables(self, tables, fields):
+        # Tables polled by the monitor, as a JSON list
+        if not self._is_field_in_table(MONITOR_TABLE, "tables"):
+            self._insert_field_in_table(MONITOR_TABLE, "tables", "text")
+
     def _protect_fields(self, table, fields):
         """ Make sure all the necessary fields exist in the table
             assumes text-type fields, but that's all we are using..."""
         old_fields = self._get_fields_in_table(table)
-        new_fields = list(set(old_fields) ^ set(fields))
+        new_fields = [i for i in dict.fromkeys(fields) if i not in old_fields]
         for field in new_fields:
             self._insert_field_in_table(table, field, "text")
 
-    def _execute_and_commit(self, query):
-        """ Executes a query and commits to the database """
+    def _execute_and_commit(self, query, params=()):
+        """ Executes a query and commits to the database
+        Returns the rowid of the last inserted row (if any)
+        """
+        database.logger.debug("<SQL> {0}".format(query))
+        with self._write_lock:
+            c = self.db.cursor()
+            try:
+                c.execute(query, params)
+            except Exception as e:
+                database.logger.critical("Executed query: {0}".format(query))
+                raise e  # For default case w/ no logger
+            rowid = c.lastrowid
+            c.close()
+            self._commit()
+        return rowid
+
+    def _executemany_and_commit(self, query, param_list):
+        """ Executes a query once per set of parameters in param_list
+        and commits to the database once at the end """
         database.logger.debug("<SQL> {0}".format(query))
-        c = self.db.cursor()
-        try:
-            c.execute(query)
-        except Exception as e:
-            database.logger.critical("Executed query: {0}".format(query))
-            raise e  # For default case w/ no logger
-        c.close()
-        self.db.commit()
+        with self._write_lock:
+            c = self.db.cursor()
+            try:
+                c.executemany(query, param_list)
+            except Exception as e:
+                database.logger.critical("Executed query: {0}".format(query))
+                raise e  # For default case w/ no logger
+            c.close()
+            self._commit()
 
-    def _execute_and_retrieve(self, query):
+    def _execute_and_retrieve(self, query, params=()):
         """ Executes a query and returns the cursor """
         database.logger.debug("<SQL> {0}".format(query))
         c = self.db.cursor()
         try:
-            c.execute(query)
+            c.execute(query, params)
         except Exception as e:
             database.logger.critical("Executed query: {0}".format(query))
             raise e  # For default case w/ no logger
@@ -84,11 +370,306 @@ class database(object):
         self._execute_and_commit(head + tail)
         return 0
 
+    def _subjob_table(self, table, archived=False):
+        """ Name of the table holding the subjobs of the runs in table
+        (or of its archived runs) """
+        if archived:
+            return "{0}_subjobs_archive".format(table)
+        return "{0}_subjobs".format(table)
+
+    def _create_subjob_table(self, table, archived=False):
+        """ Creates the subjob table for table, with one row per subjob
+        (seed) of each run (run_rowid) and indexes for the usual lookups
+        """
+        subtable = self._subjob_table(table, archived)
+        database.logger.info("Creating new table: {0}".format(subtable))
+        with self.transaction():
+            self._execute_and_commit(
+                F"create table {subtable} (run_rowid integer, seed integer, "
+                "jobid text, status integer, updated text);")
+            self._execute_and_commit(
+                F"create unique index {subtable}_run_seed "
+                F"on {subtable} (run_rowid, seed);")
+            self._execute_and_commit(
+                F"create index {subtable}_run_status "
+                F"on {subtable} (run_rowid, status);")
+            self._execute_and_commit(
+                F"create index {subtable}_jobid on {subtable} (jobid);")
+
+    def _transition_table(self, table, archived=False):
+        """ Name of the table holding the subjob status history of table
+        (or of its archived runs) """
+        if archived:
+            return "{0}_transitions_archive".format(table)
+        return "{0}_transitions".format(table)
+
+    def _create_transition_table(self, table, archived=False):
+        """ Creates the append-only history of subjob status changes of the
+        runs in table, one row per change of status of a subjob
+        """
+        transtable = self._transition_table(table, archived)
+        database.logger.info("Creating new table: {0}".format(transtable))
+        with self.transaction():
+            self._execute_and_commit(
+                F"create table {transtable} (run_rowid integer, "
+                "seed integer, old_status integer, new_status integer, "
+                "date text);")
+            self._execute_and_commit(
+                F"create index {transtable}_run_date "
+                F"on {transtable} (run_rowid, date);")
+
+    def _migrate_to_subjobs(self, table):
+        """ Fill the subjob table from the space-separated jobid and
+        sub_status strings of the legacy database format """
+        fields = self._get_fields_in_table(table)
+        if "jobid" not in fields:
+            return
+        if "sub_status" in fields:
+            status_field = "sub_status"
+        else:
+            status_field = "NULL"
+        if "iseed" in fields:
+            seed_field = "iseed"
+        else:
+            seed_field = "NULL"
+        query = F"select rowid, jobid, {seed_field}, {status_field} "\
+                F"from {table};"
+        c = self._execute_and_retrieve(query)
+        rows = c.fetchall()
+        c.close()
+        migrated = 0
+        with self.transaction():
+            for rowid, jobid_str, iseed, status_str in rows:
+                jobids = (jobid_str or "").split()
+                if not jobids:
+                    continue
+                try:
+                    statuses = [int(i) for i in status_str.split()]
+                except (AttributeError, ValueError):
+                    statuses = None
+                if statuses is not None and len(statuses) != len(jobids):
+                    statuses = None
+                self.insert_subjobs(table, rowid, jobids, first_seed=iseed,
+                                    statuses=statuses)
+                migrated += 1
+        if migrated > 0:
+            database.logger.info(
+                "Migrated subjobs of {0} runs into {1}".format(
+                    migrated, self._subjob_table(table)))
+
+    def _search_table(self, table):
+        """ Name of the full text index of the runs in table """
+        return "{0}_search".format(table)
+
+    def _create_search_table(self, table):
+        """ Creates a trigram full text index of SEARCH_FIELDS for the runs
+        in table, kept in sync with it by triggers. If the sqlite library
+        has no FTS5 support searches fall back to scanning the table
+        """
+        search = self._search_table(table)
+        fields = ", ".join(SEARCH_FIELDS)
+        new_fields = ", ".join("new.{0}".format(i) for i in SEARCH_FIELDS)
+        old_fields = ", ".join("old.{0}".format(i) for i in SEARCH_FIELDS)
+        insert_new = F"insert into {search} (rowid, {fields}) "\
+                     F"values (new.rowid, {new_fields});"
+        delete_old = F"insert into {search} ({search}, rowid, {fields}) "\
+                     F"values ('delete', old.rowid, {old_fields});"
+        try:
+            # Not through _execute_and_commit, failing here is not critical
+            self.db.execute(
+                F"create virtual table {search} using fts5({fields}, "
+                F"content='{table}', content_rowid='rowid', "
+                "tokenize='trigram');")
+        except dbapi.OperationalError as e:
+            database.logger.debug(
+                "Full text search not available: {0}".format(e))
+            return
+        database.logger.info("Creating new table: {0}".format(search))
+        with self.transaction():
+            self._execute_and_commit(
+                F"create trigger {search}_insert after insert on {table} "
+                F"begin {insert_new} end;")
+            self._execute_and_commit(
+                F"create trigger {search}_delete after delete on {table} "
+                F"begin {delete_old} end;")
+            self._execute_and_commit(
+                F"create trigger {search}_update after update of {fields} "
+                F"on {table} begin {delete_old} {insert_new} end;")
+            # Index all the runs already in the table
+            self._execute_and_commit(
+                F"insert into {search} ({search}) values ('rebuild');")
+
+    def _has_table(self, table):
+        """ Whether table exists, cached per database object for the
+        optional tables (full text index, archive) """
+        if table not in self._known_tables:
+            self._known_tables[table] = self._is_this_table_here(table)
+        return self._known_tables[table]
+
+    def _archive_table(self, table):
+        """ Name of the table holding the archived runs of table """
+        return "{0}_archive".format(table)
+
+    def _create_archive_tables(self, table):
+        """ Creates the archive of table, where disabled runs are moved
+        together with their subjobs and history so that they don't slow
+        down the queries on the live runs. Archived runs keep their rowid
+        """
+        archive = self._archive_table(table)
+        fields = self._get_fields_in_table(table)
+        database.logger.info("Creating new table: {0}".format(archive))
+        with self.transaction():
+            self._execute_and_commit(
+                F"create table {archive} (run_rowid integer primary key, "
+                + ", ".join("{0} text".format(i) for i in fields) + ");")
+            self._create_subjob_table(table, archived=True)
+            self._create_transition_table(table, archived=True)
+
+    def _is_archived(self, table, run_rowid):
+        """ Whether run run_rowid of table is in the archive. The archive is
+        only looked at when listing disabled entries """
+        if not self.list_disabled or \
+                not self._has_table(self._archive_table(table)):
+            return False
+        c = self._execute_and_retrieve(
+            "select 1 from {0} where rowid = ?;".format(
+                self._archive_table(table)), (int(run_rowid),))
+        archived = c.fetchone() is not None
+        c.close()
+        return archived
+
+    def _next_rowid(self, table):
+        """ First rowid not used by any run of table, live or archived """
+        c = self._execute_and_retrieve(
+            "select max(coalesce((select max(rowid) from {0}), 0), "
+            "coalesce((select max(rowid) from {1}), 0)) + 1;".format(
+                table, self._archive_table(table)))
+        rowid = c.fetchone()[0]
+        c.close()
+        return rowid
+
+    def _move_runs(self, table, rowids, to_archive=True):
+        """ Moves the runs rowids of table, with their subjobs and status
+        history, into the archive (or back from it if not to_archive).
+        Returns the rowids of the runs actually moved
+        """
+        live = [table, self._subjob_table(table),
+                self._transition_table(table)]
+        archived = [self._archive_table(table),
+                    self._subjob_table(table, archived=True),
+                    self._transition_table(table, archived=True)]
+        source, target = (live, archived) if to_archive else (archived, live)
+        moved = []
+        with self.transaction(immediate=True):
+            fields = self._get_fields_in_table(table)
+            for field in fields:
+                if not self._is_field_in_table(archived[0], field):
+                    self._insert_field_in_table(archived[0], field, "text")
+            fieldstr = ", ".join(fields)
+            rowids = [int(i) for i in rowids]
+            # Stay well below sqlite's limit on the number of parameters
+            for i in range(0, len(rowids), 500):
+                batch = rowids[i:i+500]
+                marks = ",".join("?"*len(batch))
+                c = self._execute_and_retrieve(
+                    F"select rowid from {source[0]} where rowid in ({marks});",
+                    batch)
+                batch = [j[0] for j in c]
+                c.close()
+                if not batch:
+                    continue
+                marks = ",".join("?"*len(batch))
+                self._execute_and_commit(
+                    F"insert into {target[0]} (rowid, {fieldstr}) "
+                    F"select rowid, {fieldstr} from {source[0]} "
+                    F"where rowid in ({marks});", batch)
+                # History keeps its order, state durations rely on it
+                for src, dst in zip(source[1:], target[1:]):
+                    self._execute_and_commit(
+                        F"insert into {dst} select * from {src} "
+                        F"where run_rowid in ({marks}) order by rowid;",
+                        batch)
+                    self._execute_and_commit(
+                        F"delete from {src} where run_rowid in ({marks});",
+                        batch)
+                self._execute_and_commit(
+                    F"delete from {source[0]} where rowid in ({marks});",
+                    batch)
+                moved += batch
+        return moved
+
+    def archive_runs(self, table):
+        """ Moves all disabled runs of table to the archive, returns their
+        rowids """
+        c = self._execute_and_retrieve(
+            "select rowid from {0} where status is not ?;".format(table),
+            ("active",))
+        rowids = [i[0] for i in c]
+        c.close()
+        return self._move_runs(table, rowids)
+
+    def restore_runs(self, table, rowids):
+        """ Moves the runs rowids of table back from the archive, returns the
+        rowids of those which were archived """
+        if not self._has_table(self._archive_table(table)):
+            return []
+        return self._move_runs(table, rowids, to_archive=False)
+
+    def _create_seed_table(self):
+        """ Creates the seed ledger, one row per block of seeds
+        [first_seed, end_seed) and the run (if any) using it
+        """
+        database.logger.info("Creating new table: {0}".format(SEED_TABLE))
+        with self.transaction():
+            self._execute_and_commit(
+                F"create table {SEED_TABLE} (first_seed integer, "
+                "end_seed integer, run_table text, run_rowid integer, "
+                "date text);")
+            self._execute_and_commit(
+                F"create index {SEED_TABLE}_end on {SEED_TABLE} (end_seed);")
+            self._execute_and_commit(
+                F"create index {SEED_TABLE}_run "
+                F"on {SEED_TABLE} (run_table, run_rowid);")
+
+    def _backfill_seed_ranges(self, table):
+        """ Fill the seed ledger with the seeds used by the runs in table.
+        A run uses no_runs seeds or one per subjob, whichever is larger
+        """
+        fields = self._get_fields_in_table(table)
+        if "iseed" not in fields:
+            return
+        if "no_runs" in fields:
+            no_runs_field = "t.no_runs"
+        else:
+            no_runs_field = "NULL"
+        query = F"select t.rowid, t.iseed, {no_runs_field}, count(s.seed) "\
+                F"from {table} t left join {self._subjob_table(table)} s "\
+                "on s.run_rowid = t.rowid where t.iseed is not null "\
+                "group by t.rowid;"
+        c = self._execute_and_retrieve(query)
+        rows = c.fetchall()
+        c.close()
+        now = str(datetime.now())
+        ranges = []
+        for rowid, iseed, no_runs, no_subjobs in rows:
+            try:
+                first_seed = int(iseed)
+            except ValueError:
+                continue
+            try:
+                no_seeds = max(int(no_runs), no_subjobs)
+            except (TypeError, ValueError):
+                no_seeds = no_subjobs
+            ranges.append((first_seed, first_seed+no_seeds, table, rowid, now))
+        self._executemany_and_commit(
+            F"insert into {SEED_TABLE} (first_seed, end_seed, run_table, "
+            "run_rowid, date) values (?, ?, ?, ?, ?);", ranges)
+
     def _is_this_table_here(self, table):
         """ Checks whether table table exists"""
         query = "SELECT name FROM sqlite_master "\
-                F"WHERE type='table' AND name='{table}';"
-        c = self._execute_and_retrieve(query)
+                "WHERE type='table' AND name=?;"
+        c = self._execute_and_retrieve(query, (table,))
         for _ in c:
             c.close()
             return True
@@ -136,28 +717,75 @@ class database(object):
         self.list_disabled = True
 
     def insert_data(self, table, dataDict):
-        """ Insert dataDict in table table """
+        """ Insert dataDict in table table, returns the rowid of the new entry
+        """
         keys = [key for key in dataDict]
         data = [dataDict[k] for k in keys]
-        head = "insert into {0} ({1})".format(table, ", ".join(keys))
-        tail = "values ('{}');".format("', '".join(data))
-        query = head + " " + tail
-        self._execute_and_commit(query)
+        with self.transaction(immediate=True):
+            if self._has_table(self._archive_table(table)):
+                # Don't reuse the id of an archived run
+                keys.append("rowid")
+                data.append(self._next_rowid(table))
+            query = "insert into {0} ({1}) values ({2});".format(
+                table, ", ".join(keys), ", ".join("?"*len(keys)))
+            return self._execute_and_commit(query, data)
+
+    def insert_many(self, table, dataDicts):
+        """ Insert every dictionary of the list dataDicts in table table
+        with a single statement and a single commit. All dictionaries must
+        share the same keys
+        """
+        if not dataDicts:
+            return
+        keys = [key for key in dataDicts[0]]
+        data = [[dataDict[k] for k in keys] for dataDict in dataDicts]
+        with self.transaction(immediate=True):
+            if self._has_table(self._archive_table(table)):
+                # Don't reuse the ids of archived runs
+                keys.append("rowid")
+                first_rowid = self._next_rowid(table)
+                for rowid, row in enumerate(data, start=first_rowid):
+                    row.append(rowid)
+            query = "insert into {0} ({1}) values ({2});".format(
+                table, ", ".join(keys), ", ".join("?"*len(keys)))
+            self._executemany_and_commit(query, data)
 
     def list_data(self, table, keys, job_id=None):
         """
         List fields keys for active entries in database unless job_id is
         provided in which case only list job_id run
         """
-        keystr = ",".join(keys)
+        params = []
         if job_id:
-            optional = "where rowid = {}".format(job_id)
+            optional = "where rowid = ?"
+            params.append(job_id)
         elif not self.list_disabled:
-            optional = "where status = \"active\""
+            optional = "where status = ?"
+            params.append("active")
         else:
             optional = ""
-        query = "select {0} from {1} {2};".format(keystr, table, optional)
-        c = self._execute_and_retrieve(query)
+        return self._select_runs(table, keys, optional, params)
+
+    def _select_runs(self, table, keys, live_filter, live_params,
+                     archive_filter=None, archive_params=None):
+        """ List fields keys of the runs of table selected by the where
+        clause live_filter. When listing disabled entries the archive is
+        searched too, with archive_filter (default: live_filter) """
+        keystr = ",".join(keys)
+        query = "select {0} from {1} {2}".format(keystr, table, live_filter)
+        params = list(live_params)
+        if self.list_disabled and \
+                self._has_table(self._archive_table(table)):
+            if archive_filter is None:
+                archive_filter, archive_params = live_filter, live_params
+            # Order by rowid (the extra last column) across both tables
+            query = "select {0}, rowid from {1} {2} union all "\
+                    "select {0}, rowid from {3} {4} order by {5}".format(
+                        keystr, table, live_filter,
+                        self._archive_table(table), archive_filter,
+                        len(keys)+1)
+            params += list(archive_params)
+        c = self._execute_and_retrieve(query + ";", params)
         dataList = []
         for i in c:
             tmpDic = {}
@@ -169,69 +797,485 @@ class database(object):
 
     def find_and_list(self, table, keys, find_in, find_this):
         """ List fields keys for active entries in database
-        such that the find_this is found in the list of fields find_in"""
-        keystr = ",".join(keys)
+        such that the find_this is found in the list of fields find_in.
+        find_this may contain the wildcards * and ?, in which case it has to
+        match the whole field (e.g. Z* finds the fields starting by Z)"""
+        params = []
         if self.list_disabled:
             search_string = "where ("
         else:
-            search_string = "where (status = \"active\") AND ("
+            search_string = "where (status = ?) AND ("
+            params.append("active")
+        if "*" in find_this or "?" in find_this:
+            pattern = find_this.replace("*", "%").replace("?", "_")
+        else:
+            pattern = "%{0}%".format(find_this)
         search_queries = []
-        for field in find_in:
-            search_queries.append("{0} like '%{1}%'".format(field, find_this))
-        search_string += " OR ".join(search_queries) + ")"
-        query = "select {0} from {1} {2};".format(keystr, table, search_string)
-        c = self._execute_and_retrieve(query)
-        dataList = []
-        for i in c:
-            tmpDic = {}
-            for (key, j) in zip(keys, i):
-                tmpDic[key] = j
-            dataList.append(tmpDic)
-        c.close()
-        return dataList
+        if self._has_table(self._search_table(table)) and \
+                all(field in SEARCH_FIELDS for field in find_in):
+            # Answer from the trigram index rather than scanning the table
+            search = self._search_table(table)
+            for field in find_in:
+                search_queries.append(
+                    "select rowid from {0} where {1} like ?".format(
+                        search, field))
+                params.append(pattern)
+            search_string += "rowid in ({0}))".format(
+                " union ".join(search_queries))
+        else:
+            for field in find_in:
+                search_queries.append("{0} like ?".format(field))
+                params.append(pattern)
+            search_string += " OR ".join(search_queries) + ")"
+        # The archive has no full text index, only scanned if requested
+        archive_string = "where " + " OR ".join(
+            "{0} like ?".format(field) for field in find_in)
+        return self._select_runs(table, keys, search_string, params,
+                                 archive_string, [pattern]*len(find_in))
 
     def update_entry(self, table, rowid, field, new_value):
         """ Update a given field for a given table for a given dbid! """
-        query_raw = "update {0} set {1} = \"{2}\" where rowid = {3} ;"
-        query = query_raw.format(table, field, new_value, rowid)
-        self._execute_and_commit(query)
+        self.update_many(table, field, {rowid: new_value})
+
+    def update_many(self, table, field, new_values):
+        """ Update field for several entries of table at once, where
+        new_values is a dictionary {rowid: new_value} """
+        query = "update {0} set {1} = ? where rowid = ?;".format(table, field)
+        params = [(str(value), rowid) for rowid, value in new_values.items()]
+        with self.transaction():
+            self._executemany_and_commit(query, params)
+            if self.list_disabled and \
+                    self._has_table(self._archive_table(table)):
+                self._executemany_and_commit(
+                    "update {0} set {1} = ? where rowid = ?;".format(
+                        self._archive_table(table), field), params)
 
     def disable_entry(self, table, rowid, revert=None):
         """ Disables (or enables) rowid entry"""
+        self.disable_entries(table, [rowid], revert=revert)
+
+    def disable_entries(self, table, rowids, revert=None):
+        """ Disables (or enables) all rowids entries with a single commit """
         newStat = "inactive"
-        if revert:
-            newStat = "active"
-        query = "update " + table + " set status = \"" + newStat + "\""
-        rid = " where rowid = " + rowid + " ;"
-        total_query = query + rid
-        self._execute_and_commit(total_query)
+        with self.transaction():
+            if revert:
+                newStat = "active"
+                # Enabled runs come back from the archive
+                self.restore_runs(table, rowids)
+            self.update_many(table, "status",
+                             {rowid: newStat for rowid in rowids})
 
+    def insert_subjobs(self, table, run_rowid, jobids, first_seed=None,
+                       statuses=None, ces=None):
+        """ Insert one subjob per jobid for the run run_rowid of table.
+        Subjobs are numbered by seed starting at first_seed (or 0 for runs
+        without an initial seed). ces optionally gives the computing element
+        each jobid was submitted to
+        """
+        try:
+            first_seed = int(first_seed)
+        except (TypeError, ValueError):
+            first_seed = 0
+        if statuses is None:
+            statuses = [None]*len(jobids)
+        now = str(datetime.now())
+        subjobs = [(int(run_rowid), first_seed+i, jobid, status, now)
+                   for i, (jobid, status) in enumerate(zip(jobids, statuses))]
+        query = "insert into {0} (run_rowid, seed, jobid, status, updated) "\
+                "values (?, ?, ?, ?, ?);".format(self._subjob_table(table))
+        if ces is not None:
+            # Not a column before _migrate_subjob_ces
+            subjobs = [i + (ce,) for i, ce in zip(subjobs, ces)]
+            query = query.replace(", updated)", ", updated, ce)").replace(
+                "?);", "?, ?);")
+        # The first transition marks the time the subjob was submitted
+        history = "insert into {0} (run_rowid, seed, old_status, new_status, "\
+                  "date) values (?, ?, NULL, ?, ?);".format(
+                      self._transition_table(table))
+        with self.transaction():
+            self._executemany_and_commit(query, subjobs)
+            self._executemany_and_commit(
+                history, [(i[0], i[1], i[3], i[4]) for i in subjobs])
 
-def get_next_seed(dbname=None):
+    def list_subjobs(self, table, run_rowid, keys=None, statuses=None):
+        """ List fields keys (default: seed, jobid, status) of the subjobs of
+        run run_rowid ordered by seed. If statuses is given, only the subjobs
+        with a stored status in statuses are returned
+        """
+        if keys is None:
+            keys = ["seed", "jobid", "status"]
+        query = "select {0} from {1} where run_rowid = ?".format(
+            ",".join(keys), self._subjob_table(
+                table, self._is_archived(table, run_rowid)))
+        params = [int(run_rowid)]
+        if statuses is not None:
+            query += " and status in ({0})".format(
+                ",".join("?"*len(statuses)))
+            params += list(statuses)
+        query += " order by seed;"
+        c = self._execute_and_retrieve(query, params)
+        dataList = [dict(zip(keys, i)) for i in c]
+        c.close()
+        return dataList
+
+    def replace_subjobs(self, table, run_rowid, jobids, first_seed=None):
+        """ Replaces the subjobs of the live run run_rowid of table by one
+        new subjob per jobid (see insert_subjobs). The transition history of
+        the old subjobs is kept """
+        with self.transaction():
+            self._execute_and_commit(
+                "delete from {0} where run_rowid = ?;".format(
+                    self._subjob_table(table)), (int(run_rowid),))
+            self.insert_subjobs(table, run_rowid, jobids,
+                                first_seed=first_seed)
+
+    def update_subjobs(self, table, run_rowid, new_status, date=None):
+        """ Update the status of the subjobs of run run_rowid given in
+        new_status, a dictionary {seed: status}. Other subjobs are untouched.
+        Every actual change of status is appended to the transition history,
+        dated date (the date of the poll which found it, now by default)
+        """
+        if not new_status:
+            return
+        now = str(date if date is not None else datetime.now())
+        archived = self._is_archived(table, run_rowid)
+        subtable = self._subjob_table(table, archived)
+        params = [(status, now, int(run_rowid), seed)
+                  for seed, status in new_status.items()]
+        history = "insert into {0} (run_rowid, seed, old_status, new_status, "\
+                  "date) select run_rowid, seed, status, ?, ? from {1} "\
+                  "where run_rowid = ? and seed = ? and status is not ?;"\
+                  .format(self._transition_table(table, archived), subtable)
+        query = "update {0} set status = ?, updated = ? "\
+                "where run_rowid = ? and seed = ?;".format(subtable)
+        with self.transaction():
+            self._executemany_and_commit(
+                history, [i + (i[0],) for i in params])
+            self._executemany_and_commit(query, params)
+
+    def set_next_polls(self, table, run_rowid, next_polls):
+        """ Store when the subjobs of run run_rowid are due to be polled,
+        where next_polls is a dictionary {seed: date (or None for as soon as
+        possible)} """
+        if not next_polls:
+            return
+        query = "update {0} set next_poll = ? "\
+                "where run_rowid = ? and seed = ?;".format(
+                    self._subjob_table(
+                        table, self._is_archived(table, run_rowid)))
+        self._executemany_and_commit(
+            query, [(None if date is None else str(date), int(run_rowid), seed)
+                    for seed, date in next_polls.items()])
+
+    def pending_polls(self, table, run_rowids, final_statuses):
+        """ Returns {run_rowid: date} with the earliest date at which a subjob
+        of each of run_rowids not in final_statuses is due to be polled, ""
+        if one is due as soon as possible. Runs with every subjob in a final
+        status are left out
+        """
+        pending = {}
+        run_rowids = [int(i) for i in run_rowids]
+        final_statuses = list(final_statuses)
+        for i in range(0, len(run_rowids), 500):
+            batch = run_rowids[i:i+500]
+            query = "select run_rowid, min(coalesce(next_poll, '')) "\
+                    "from {0} where run_rowid in ({1}) and (status is null "\
+                    "or status not in ({2})) group by run_rowid;".format(
+                        self._subjob_table(table), ",".join("?"*len(batch)),
+                        ",".join("?"*len(final_statuses)))
+            c = self._execute_and_retrieve(query, batch + final_statuses)
+            pending.update(c.fetchall())
+            c.close()
+        return pending
+
+    def monitor_heartbeat(self, host, pid, started, tables):
+        """ Records that the monitor polling tables started at started runs
+        as pid on host and is alive now """
+        with self.transaction(immediate=True):
+            self._execute_and_commit(F"delete from {MONITOR_TABLE};")
+            self._execute_and_commit(
+                F"insert into {MONITOR_TABLE} (host, pid, started, heartbeat, "
+                "tables) values (?, ?, ?, ?, ?);",
+                (host, pid, str(started), str(datetime.now()),
+                 json.dumps(list(tables))))
+
+    def get_monitor(self):
+        """ Returns the last heartbeat of the monitor as a dictionary with keys
+        host, pid, started, heartbeat and tables (the list of tables it polls),
+        None if no monitor is running """
+        keys = ["host", "pid", "started", "heartbeat", "tables"]
+        c = self._execute_and_retrieve(
+            "select {0} from {1};".format(",".join(keys), MONITOR_TABLE))
+        row = c.fetchone()
+        c.close()
+        if row is None:
+            return None
+        monitor = dict(zip(keys, row))
+        monitor["tables"] = json.loads(monitor["tables"] or "[]")
+        return monitor
+
+    def remove_monitor(self, host, pid):
+        """ Forgets the monitor running as pid on host """
+        self._execute_and_commit(
+            F"delete from {MONITOR_TABLE} where host = ? and pid = ?;",
+            (host, pid))
+
+    def list_transitions(self, table, run_rowid, since=None):
+        """ List the subjob status changes of run run_rowid (optionally only
+        those after the date since) in chronological order as dictionaries
+        with keys seed, jobid, old_status, new_status and date
+        """
+        keys = ["seed", "jobid", "old_status", "new_status", "date"]
+        archived = self._is_archived(table, run_rowid)
+        query = "select t.seed, s.jobid, t.old_status, t.new_status, t.date "\
+                "from {0} t join {1} s on s.run_rowid = t.run_rowid "\
+                "and s.seed = t.seed where t.run_rowid = ?".format(
+                    self._transition_table(table, archived),
+                    self._subjob_table(table, archived))
+        params = [int(run_rowid)]
+        if since is not None:
+            query += " and t.date > ?"
+            params.append(str(since))
+        query += " order by t.date, t.rowid;"
+        c = self._execute_and_retrieve(query, params)
+        dataList = [dict(zip(keys, i)) for i in c]
+        c.close()
+        return dataList
+
+    def _state_durations_query(self, table, archived=False):
+        """ Query returning, for every transition of run ?, the seed, the
+        state entered and the seconds spent in it (until the next transition
+        of the subjob, or until the date ? for its current state) """
+        return "select seed, new_status, (julianday(coalesce(lead(date) "\
+               "over (partition by seed order by rowid), ?)) - "\
+               "julianday(date))*86400.0 as duration from {0} "\
+               "where run_rowid = ?"\
+               .format(self._transition_table(table, archived))
+
+    def state_durations(self, table, run_rowid):
+        """ Returns a dictionary {status: (total seconds, no. subjobs)} with
+        the time the subjobs of run run_rowid spent in each state """
+        query = "select new_status, sum(duration), count(distinct seed) "\
+                "from ({0}) as d "\
+                "group by new_status;".format(
+                    self._state_durations_query(
+                        table, self._is_archived(table, run_rowid)))
+        c = self._execute_and_retrieve(
+            query, (str(datetime.now()), int(run_rowid)))
+        durations = {status: (total, no_subjobs)
+                     for status, total, no_subjobs in c}
+        c.close()
+        return durations
+
+    def mean_completed_duration(self, table, run_rowid, status):
+        """ Mean seconds spent in status by the subjobs of run run_rowid which
+        have already left it, None if none has """
+        query = "select avg(duration) from ({0}) as d "\
+                "where new_status = ? and duration is not null;".format(
+                    self._state_durations_query(
+                        table, self._is_archived(table, run_rowid)))
+        # Leaving the end date null only counts finished stints
+        c = self._execute_and_retrieve(query, (None, int(run_rowid), status))
+        duration = c.fetchone()[0]
+        c.close()
+        return duration
+
+    def state_durations_by_subjob(self, table, run_rowid):
+        """ Returns a list of (ce, jobid, status, seconds) with the time
+        each subjob of run run_rowid spent in each state it went through """
+        archived = self._is_archived(table, run_rowid)
+        query = "select s.ce, s.jobid, d.new_status, sum(d.duration) "\
+                "from ({0}) as d join {1} s "\
+                "on s.run_rowid = ? and s.seed = d.seed "\
+                "group by s.seed, d.new_status;".format(
+                    self._state_durations_query(table, archived),
+                    self._subjob_table(table, archived))
+        c = self._execute_and_retrieve(
+            query, (str(datetime.now()), int(run_rowid), int(run_rowid)))
+        durations = c.fetchall()
+        c.close()
+        return durations
+
+    def ce_outcomes(self, table, since, statuses):
+        """ Returns {ce: {status: number of subjobs}} counting the subjobs
+        of the live runs of table with a status in statuses reached after the
+        date since, by the computing element they were submitted to """
+        statuses = list(statuses)
+        query = "select ce, status, count(*) from {0} where ce is not null "\
+                "and updated > ? and status in ({1}) "\
+                "group by ce, status;".format(
+                    self._subjob_table(table), ",".join("?"*len(statuses)))
+        c = self._execute_and_retrieve(query, [str(since)] + statuses)
+        outcomes = {}
+        for ce, status, count in c:
+            outcomes.setdefault(ce, {})[status] = count
+        c.close()
+        return outcomes
+
+    def summarise_subjobs(self, table, run_rowids):
+        """ Returns a dictionary {run_rowid: (number of subjobs, first jobid)}
+        for the given runs
+        """
+        summary = {}
+        subtables = [self._subjob_table(table)]
+        if self.list_disabled and \
+                self._has_table(self._archive_table(table)):
+            subtables.append(self._subjob_table(table, archived=True))
+        run_rowids = [int(i) for i in run_rowids]
+        # Stay well below sqlite's limit on the number of parameters
+        for i in range(0, len(run_rowids), 500):
+            batch = run_rowids[i:i+500]
+            for subtable in subtables:
+                query = "select run_rowid, count(*), min(jobid) from {0} "\
+                        "where run_rowid in ({1}) group by run_rowid;".format(
+                            subtable, ",".join("?"*len(batch)))
+                c = self._execute_and_retrieve(query, batch)
+                for run_rowid, no_subjobs, jobid in c:
+                    summary[run_rowid] = (no_subjobs, jobid)
+                c.close()
+        return summary
+
+    def next_seed(self):
+        """ Returns the first seed after every block in the seed ledger """
+        c = self._execute_and_retrieve(
+            F"select max(end_seed) from {SEED_TABLE};")
+        max_seed = c.fetchone()[0]
+        c.close()
+        if max_seed is None:
+            return 1
+        return max_seed
+
+    def reserve_seeds(self, no_seeds):
+        """ Atomically reserves a block of no_seeds consecutive seeds that no
+        other run uses and returns the first one. The block can be claimed
+        later by a run starting at that seed with record_seeds
+        """
+        with self.transaction(immediate=True):
+            first_seed = self.next_seed()
+            self._execute_and_commit(
+                F"insert into {SEED_TABLE} (first_seed, end_seed, date) "
+                "values (?, ?, ?);",
+                (first_seed, first_seed+int(no_seeds), str(datetime.now())))
+        return first_seed
+
+    def record_seeds(self, table, run_rowid, first_seed, no_seeds):
+        """ Records in the seed ledger the block of seeds used by run
+        run_rowid of table, claiming a previous reservation if it exists
+        """
+        first_seed = int(first_seed)
+        end_seed = first_seed + int(no_seeds)
+        with self.transaction():
+            c = self._execute_and_retrieve(
+                F"select rowid, end_seed from {SEED_TABLE} "
+                "where first_seed = ? and run_rowid is null;", (first_seed,))
+            reservation = c.fetchone()
+            c.close()
+            if reservation is not None:
+                self._execute_and_commit(
+                    F"update {SEED_TABLE} set end_seed = ?, run_table = ?, "
+                    "run_rowid = ? where rowid = ?;",
+                    (max(end_seed, reservation[1]), table, int(run_rowid),
+                     reservation[0]))
+            else:
+                self._execute_and_commit(
+                    F"insert into {SEED_TABLE} (first_seed, end_seed, "
+                    "run_table, run_rowid, date) values (?, ?, ?, ?, ?);",
+                    (first_seed, end_seed, table, int(run_rowid),
+                     str(datetime.now())))
+
+    def release_seeds(self, first_seed):
+        """ Gives back the reservation starting at first_seed if no run has
+        claimed it, e.g. when none of the jobs of a submission went through
+        """
+        self._execute_and_commit(
+            F"delete from {SEED_TABLE} where first_seed = ? "
+            "and run_rowid is null;", (int(first_seed),))
+
+    def start_submission(self, table, dataDict):
+        """ Opens the journal of the submission of the run dataDict (the
+        fields of its future row in table) and reserves its seeds. Returns
+        the id of the submission """
+        with self.transaction(immediate=True):
+            submission = self._execute_and_commit(
+                F"insert into {SUBMISSION_TABLE} (run_table, run, started) "
+                "values (?, ?, ?);",
+                (table, json.dumps(dataDict), str(datetime.now())))
+            if dataDict.get("iseed") is not None:
+                first_seed = int(dataDict["iseed"])
+                c = self._execute_and_retrieve(
+                    F"select 1 from {SEED_TABLE} where first_seed = ?;",
+                    (first_seed,))
+                reserved = c.fetchone() is not None
+                c.close()
+                if not reserved:
+                    self._execute_and_commit(
+                        F"insert into {SEED_TABLE} (first_seed, end_seed, "
+                        "date) values (?, ?, ?);",
+                        (first_seed, first_seed+int(dataDict["no_runs"]),
+                         str(datetime.now())))
+        return submission
+
+    def list_submissions(self, table):
+        """ Returns the submissions to table in progress (or interrupted) as
+        dictionaries with keys rowid, run (the fields of the run) and started
+        """
+        c = self._execute_and_retrieve(
+            F"select rowid, run, started from {SUBMISSION_TABLE} "
+            "where run_table = ? order by rowid;", (table,))
+        submissions = [{"rowid": rowid, "run": json.loads(run),
+                        "started": started} for rowid, run, started in c]
+        c.close()
+        return submissions
+
+    def journal_jobs(self, submission, jobs):
+        """ Records in the journal of submission the jobs submitted, a list
+        of (seed, jobid, ce). A seed submitted again replaces its old job """
+        now = str(datetime.now())
+        self._executemany_and_commit(
+            F"insert or replace into {SUBMISSION_JOB_TABLE} (submission, "
+            "seed, jobid, ce, date) values (?, ?, ?, ?, ?);",
+            [(int(submission), int(seed), jobid, ce, now)
+             for seed, jobid, ce in jobs])
+
+    def journaled_jobs(self, submission):
+        """ Returns {seed: (jobid, ce)} with the jobs recorded in the
+        journal of submission """
+        c = self._execute_and_retrieve(
+            F"select seed, jobid, ce from {SUBMISSION_JOB_TABLE} "
+            "where submission = ?;", (int(submission),))
+        jobs = {seed: (jobid, ce) for seed, jobid, ce in c}
+        c.close()
+        return jobs
+
+    def finish_submission(self, submission):
+        """ Closes the journal of submission """
+        with self.transaction():
+            self._execute_and_commit(
+                F"delete from {SUBMISSION_JOB_TABLE} where submission = ?;",
+                (int(submission),))
+            self._execute_and_commit(
+                F"delete from {SUBMISSION_TABLE} where rowid = ?;",
+                (int(submission),))
+
+
+def _open_database(dbname=None):
     from pyHepGrid.src.header import arctable, arcprodtable, diractable,\
         slurmtable, slurmprodtable, dbfields, logger
     if dbname is None:
         from pyHepGrid.src.header import dbname
-    db = database(dbname, tables=[arctable, arcprodtable, diractable,
-                                  slurmtable, slurmprodtable],
-                  fields=dbfields, logger=logger)
-    db.list_disabled = True
-    alldata = db.list_data(arctable, ["iseed", "jobid"])
-    alldata += db.list_data(arcprodtable, ["iseed", "jobid"])
-    alldata += db.list_data(diractable, ["iseed", "jobid"])
-    slurmdata = db.list_data(slurmtable, ["iseed", "no_runs"])
-    slurmdata += db.list_data(slurmprodtable, ["iseed", "no_runs"])
-    ret_seed = 1
-    for run in alldata:
-        try:
-            max_seed = int(run["iseed"])+len(run["jobid"].split())
-        except TypeError:
-            max_seed = ret_seed
-        ret_seed = max(max_seed, ret_seed)
-    for run in slurmdata:
-        try:
-            max_seed = int(run["iseed"])+int(run["no_runs"])
-        except TypeError:
-            max_seed = ret_seed
-        ret_seed = max(max_seed, ret_seed)
-    return ret_seed
+    return database(dbname, tables=[arctable, arcprodtable, diractable,
+                                    slurmtable, slurmprodtable],
+                    fields=dbfields, logger=logger)
+
+
+def reserve_seeds(no_seeds, dbname=None):
+    """ Reserve no_seeds consecutive unused seeds and return the first one.
+    Unlike get_next_seed, two runcards reserving seeds at the same time will
+    never be given overlapping seeds. Only call this when submitting (not
+    from runcard.py, which is also read by ini and man): a reservation no
+    run claims is never released """
+    return _open_database(dbname).reserve_seeds(no_seeds)
+
+
+def get_next_seed(dbname=None):
+    return _open_database(dbname).next_seed()
@@ -0,0 +1,87 @@
+"""
+Shared thread pools used to run grid commands concurrently.
+
+Most of the concurrent work of pyHepGrid is waiting on command line tools
+(arcstat, gfal-copy, dirac-wms-*...), so it runs in threads rather than in
+processes. There is one long-lived pool per family of commands, created the
+first time it is used, so that the number of commands of a family running at
+the same time is bounded for the whole invocation (see
+header.command_threads) no matter how many runs are being managed at once.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextvars
+import threading
+import pyHepGrid.src.header as header
+
+DEFAULT_FAMILY = "default"
+# Size of the pool of the families not given in header.command_threads
+DEFAULT_THREADS = 8
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(family=DEFAULT_FAMILY):
+    """ Returns the shared pool of the family of commands family """
+    with _executors_lock:
+        if family not in _executors:
+            threads = header.command_threads.get(family, DEFAULT_THREADS)
+            _executors[family] = ThreadPoolExecutor(
+                max_workers=max(int(threads), 1),
+                thread_name_prefix="pyHepGrid-{0}".format(family))
+        return _executors[family]
+
+
+class Counter(object):
+    """ Counter which can be incremented from several threads """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        """ Adds one to the counter and returns the new value """
+        with self._lock:
+            self.value += 1
+            return self.value
+
+
+def run_all(function, arguments, family=DEFAULT_FAMILY, limit=None):
+    """ Calls function on every element of the iterable arguments in the
+    pool of family, with at most limit calls running at the same time (and
+    never more than the size of the pool). Returns the results in the order
+    of arguments. arguments is consumed as calls finish, so it can be a
+    generator.
+
+    If any call raises, the calls not started yet are cancelled and the
+    exception is raised once those already running have finished. Functions
+    run in family must not wait on calls in the same family. Each call runs
+    in a copy of the context of the caller (e.g. where its output goes)
+    """
+    executor = get_executor(family)
+    if limit is None:
+        limit = executor._max_workers
+    limit = max(limit, 1)
+
+    results = {}
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            results[pending.pop(future)] = future.result()
+
+    try:
+        for idx, argument in enumerate(arguments):
+            if len(pending) >= limit:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            context = contextvars.copy_context()
+            pending[executor.submit(context.run, function, argument)] = idx
+        done, _ = wait(pending)
+        collect(done)
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        raise
+    return [results[i] for i in range(len(results))]
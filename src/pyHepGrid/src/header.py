@@ -60,9 +60,11 @@ diractable = "diracjobs"
 slurmtable = "slurmjobs"
 slurmprodtable = "slurmjobs"
 dbfields = ['jobid', 'date', 'runcard', 'runfolder', 'pathfolder',
-            'status', 'jobtype', 'iseed', 'sub_status', "queue", "no_runs"]
+            'status', 'jobtype', 'iseed', 'sub_status', "queue", "no_runs",
+            "last_polled"]
 slurm_template = "slurm_template.sh"
 slurm_template_production = "slurm_template_production.sh"
+slurm_template_packed = "slurm_template_packed.sh"
 
 # Dummies overwritten by the template header
 arcbase = None
@@ -269,3 +271,8 @@ _slurmfilename_production = os.path.join(os.path.dirname(
     os.path.realpath(__file__)), slurm_template_production)
 with open(_slurmfilename_production) as template_file:
     SLURMSCRIPTDEFAULT_PRODUCTION = template_file.read()
+
+_slurmfilename_packed = os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), slurm_template_packed)
+with open(_slurmfilename_packed) as template_file:
+    SLURMSCRIPTDEFAULT_PACKED = template_file.read()
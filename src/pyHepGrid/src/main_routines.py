@@ -1,7 +1,65 @@
 import pyHepGrid.src.header
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import io
+import os
+import socket
+import sys
+import time
 """Routines to be used by main.py"""
 
 
+class _ThreadOutput(object):
+    """ Output stream which sends what is written by each thread to its own
+    buffer, if it has been given one, and to stream otherwise. The buffer is
+    a context variable, so it is also used by the commands the thread runs
+    in the shared executors (see executor.run_all) """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = contextvars.ContextVar("buffer", default=None)
+
+    def is_capturing(self):
+        return self.buffer.get() is not None
+
+    def write(self, text):
+        if self.is_capturing():
+            return self.buffer.get().write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        if not self.is_capturing():
+            self.stream.flush()
+
+
+@contextlib.contextmanager
+def _thread_output():
+    """ Installs a _ThreadOutput as stdout (for print and the logger) """
+    output = _ThreadOutput(sys.stdout)
+    handlers = [i for i in pyHepGrid.src.header.logger.handlers
+                if getattr(i, "stream", None) is sys.stdout]
+    sys.stdout = output
+    for handler in handlers:
+        handler.setStream(output)
+    try:
+        yield output
+    finally:
+        sys.stdout = output.stream
+        for handler in handlers:
+            handler.setStream(output.stream)
+
+
+def _can_run_concurrently(args):
+    """ Whether the selected actions can run for several ids at once. Some
+    change the working directory, and nothing can ask for confirmation """
+    if any([args.get_data, args.checkwarmup, args.getmewarmup,
+            args.get_grid_stdout]):
+        return False
+    return args.yes or not any([args.kill_job, args.clean])
+
+
 def management_routine(backend, args):
 
     if args.yes:
@@ -10,6 +68,10 @@ def management_routine(backend, args):
     if args.list_disabled:
         backend.set_list_disabled()
 
+    if args.archive:
+        backend.archive_disabled()
+        exit(0)
+
     if args.get_data and pyHepGrid.src.header.finalisation_script:
         backend.get_data(0, custom_get=pyHepGrid.src.header.finalisation_script)
         exit(0)
@@ -59,107 +121,237 @@ def management_routine(backend, args):
                 "Getting grid output from stdout only a valid mode for Arc "
                 "warmups")
 
-    for idx, db_id in enumerate(id_list):
-        # Setup for printing/function args
-        jdx = idx+1
-        request_fields = ["runcard", "jobtype", "runfolder", "iseed", "no_runs"]
-        alljobinfo = backend.dbase.list_data(
-            backend.table, request_fields, db_id)
-        # raise Exception
-        if len(alljobinfo) == 0:
-            pyHepGrid.src.header.logger.critical(
-                "Job {0} requested, which does not exist in database".format(
-                    db_id))
-        jobinfo = alljobinfo[0]
-        jobname = "{0} ({1})".format(jobinfo["runcard"], jobinfo["jobtype"])
-        jobid = backend.get_id(db_id)  # a list
-        printstr = "{0} for job" + \
-            " {0}: {3:20} [{1}/{2}]".format(db_id, jdx, no_ids, jobname)
-
-        if args.simple_string:
-            backend.set_oneliner_output()
-
-        # Could we make this more generic?
-        # i.e pass function with opt args using a dictionary
-        # rather than just making copies for every possibility
-        # Options that keep the database entry after they are done
-        if args.filter_jobs_by_status is not None:
-            pyHepGrid.src.header.logger.warn(
-                "Applying job status filter. Please ensure you have run stats "
-                "directly before this command to update job statuses.")
+    if args.force_poll:
+        backend.set_force_poll()
+
+    if args.stats or args.since is not None:
+        if backend.use_monitor_snapshot():
             pyHepGrid.src.header.logger.info(
-                "Job status filter: {0}".format(
-                    " ".join(args.filter_jobs_by_status)))
+                "Showing the statuses stored by the monitor, use --force_poll "
+                "to poll the jobs now")
+        else:
+            backend.prepare_stats(id_list)
+
+    workers = args.workers
+    if workers > 1 and not _can_run_concurrently(args):
+        pyHepGrid.src.header.logger.info(
+            "The selected actions can't run concurrently (use -y to skip the "
+            "confirmations), running one id at a time")
+        workers = 1
+
+    # Enabling/disabling entries is deferred and written to the database in a
+    # single transaction, {db_id: True (enable)/False (disable)}
+    new_entry_status = {}
+    try:
+        if workers > 1 and no_ids > 1:
+            _manage_concurrently(backend, args, id_list, workers,
+                                 new_entry_status)
+        else:
+            for idx, db_id in enumerate(id_list):
+                _manage_single_id(backend, args, db_id, idx+1, no_ids,
+                                  new_entry_status)
+    finally:
+        if new_entry_status:
+            backend.set_db_entries_status(new_entry_status)
+
+
+def _manage_concurrently(backend, args, id_list, workers, new_entry_status):
+    """ Run _manage_single_id for every id in id_list with workers threads.
+    The output of each id is collected and printed in the order of id_list
+    as soon as it and all the ids before it are done. The database handles
+    the writes of all threads one at a time
+    """
+    no_ids = len(id_list)
+
+    def manage(jdx, db_id):
+        text = io.StringIO()
+        token = output.buffer.set(text)
+        try:
+            _manage_single_id(backend, args, db_id, jdx, no_ids,
+                              new_entry_status)
+        except (Exception, SystemExit) as e:
+            # logger.critical exits, which is raised again in the main
+            # thread once the output before it has been printed
+            return text.getvalue(), e
+        finally:
+            output.buffer.reset(token)
+        return text.getvalue(), None
+
+    with _thread_output() as output:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(manage, idx+1, db_id)
+                       for idx, db_id in enumerate(id_list)]
             try:
-                status_codes = [getattr(backend, "c"+i.upper())
-                                for i in args.filter_jobs_by_status]
-            except AttributeError as e:
-                pyHepGrid.src.header.logger.critical(
-                    "Invalid job status given: {0}".format(
-                        str(e).split(" ")[-1][2:-1]))
-            statuses = backend._get_old_status(db_id)
-            new_joblist = []
-            for jid, status in zip(jobid, statuses):
-                if status in status_codes:
-                    new_joblist.append(jid)
-            jobid = new_joblist
-
-        if args.stats:
+                for future in futures:
+                    text, error = future.result()
+                    output.write(text)
+                    output.flush()
+                    if error is not None:
+                        raise error
+            except BaseException:
+                # Including Ctrl-C, which only reaches the main thread: the
+                # ids not started yet are dropped
+                for pending in futures:
+                    pending.cancel()
+                raise
+
+
+def _manage_single_id(backend, args, db_id, jdx, no_ids, new_entry_status):
+    """ Run all selected management actions on database entry db_id (the
+    jdx-th of no_ids). Changes to the entry status are recorded in
+    new_entry_status instead of being written to the database directly
+    """
+    # Setup for printing/function args
+    request_fields = ["runcard", "jobtype", "runfolder", "iseed", "no_runs"]
+    alljobinfo = backend.dbase.list_data(
+        backend.table, request_fields, db_id)
+    # raise Exception
+    if len(alljobinfo) == 0:
+        pyHepGrid.src.header.logger.critical(
+            "Job {0} requested, which does not exist in database".format(
+                db_id))
+    jobinfo = alljobinfo[0]
+    jobname = "{0} ({1})".format(jobinfo["runcard"], jobinfo["jobtype"])
+    status_codes = None
+    printstr = "{0} for job" + \
+        " {0}: {3:20} [{1}/{2}]".format(db_id, jdx, no_ids, jobname)
+
+    if args.simple_string:
+        backend.set_oneliner_output()
+
+    # Could we make this more generic?
+    # i.e pass function with opt args using a dictionary
+    # rather than just making copies for every possibility
+    # Options that keep the database entry after they are done
+    if args.filter_jobs_by_status is not None:
+        pyHepGrid.src.header.logger.warn(
+            "Applying job status filter. Please ensure you have run stats "
+            "directly before this command to update job statuses.")
+        pyHepGrid.src.header.logger.info(
+            "Job status filter: {0}".format(
+                " ".join(args.filter_jobs_by_status)))
+        try:
+            status_codes = [getattr(backend, "c"+i.upper())
+                            for i in args.filter_jobs_by_status]
+        except AttributeError as e:
+            pyHepGrid.src.header.logger.critical(
+                "Invalid job status given: {0}".format(
+                    str(e).split(" ")[-1][2:-1]))
+    jobid = backend.get_id(db_id, statuses=status_codes)  # a list
+
+    if args.since is not None:
+        backend.stats_since(db_id, args.since)
+    elif args.stats:
+        if backend.use_monitor_snapshot():
+            backend.stats_snapshot(db_id)
+        else:
             backend.stats_job(db_id)
-        if args.info or args.infoVerbose:
-            pyHepGrid.src.header.logger.info(
-                printstr.format("Retrieving information"))
-            backend.status_job(jobid, args.infoVerbose)
-        if args.renewArc:
-            pyHepGrid.src.header.logger.info(printstr.format("Renewing proxy"))
-            backend.renew_proxy(jobid)
-        if args.printme:
-            pyHepGrid.src.header.logger.info(
-                printstr.format("Printing information"))
-            backend.cat_job(jobid, jobinfo, print_stderr=args.error)
-            # As our % complete sometimes has a carriage return :P
-            pyHepGrid.src.header.logger.info("\n")
-        if args.printmelog:
-            pyHepGrid.src.header.logger.info(
-                printstr.format("Printing information from logfile"))
-            backend.cat_log_job(jobid, jobinfo)
-        if args.checkwarmup:
-            backend.check_warmup_files(
-                db_id, args.runcard, resubmit=args.resubmit)
-        if args.getmewarmup:
-            pyHepGrid.src.header.logger.info(
-                printstr.format("Retrieving warmup"))
-            backend.bring_current_warmup(db_id)
-        if args.get_grid_stdout:
-            backend.get_grid_from_stdout(jobid, jobinfo)
-        if args.completion:
-            backend.get_completion_stats(jobid, jobinfo, args)
-
-        # Options that deactivate the database entry once they're done
-        if args.get_data:
-            pyHepGrid.src.header.logger.info(printstr.format("Retrieving data"))
-            backend.get_data(db_id)
-            # if --done is used we assume there are jobs which are _not_ done
-            if not args.done and not args.runSlurmProduction:
-                backend.disable_db_entry(db_id)
-        if args.kill_job:
-            pyHepGrid.src.header.logger.info(printstr.format("Killing"))
-            backend.kill_job(jobid, jobinfo)
-            backend.disable_db_entry(db_id)
-        if args.clean:
-            pyHepGrid.src.header.logger.info(printstr.format("Cleaning"))
-            backend.clean_job(jobid)
-            backend.disable_db_entry(db_id)
-
-        # Enable back any database entry
-        if args.enableme:
-            backend.enable_db_entry(db_id)
-        if args.disableme:
-            backend.disable_db_entry(db_id)
-
-        if not any([args.stats, args.info, args.infoVerbose, args.renewArc,
-                    args.printme, args.printmelog, args.checkwarmup,
-                    args.getmewarmup, args.get_grid_stdout, args.completion,
-                    args.get_data, args.kill_job, args.clean, args.enableme,
-                    args.disableme]):
-            pyHepGrid.src.header.logger.plain(" ".join(i for i in jobid))
+    if args.state_times:
+        backend.print_state_times(db_id)
+    if args.info or args.infoVerbose:
+        pyHepGrid.src.header.logger.info(
+            printstr.format("Retrieving information"))
+        backend.status_job(jobid, args.infoVerbose)
+    if args.renewArc:
+        pyHepGrid.src.header.logger.info(printstr.format("Renewing proxy"))
+        backend.renew_proxy(jobid)
+    if args.printme:
+        pyHepGrid.src.header.logger.info(
+            printstr.format("Printing information"))
+        backend.cat_job(jobid, jobinfo, print_stderr=args.error)
+        # As our % complete sometimes has a carriage return :P
+        pyHepGrid.src.header.logger.info("\n")
+    if args.printmelog:
+        pyHepGrid.src.header.logger.info(
+            printstr.format("Printing information from logfile"))
+        backend.cat_log_job(jobid, jobinfo)
+    if args.checkwarmup:
+        backend.check_warmup_files(
+            db_id, args.runcard, resubmit=args.resubmit)
+    if args.getmewarmup:
+        pyHepGrid.src.header.logger.info(
+            printstr.format("Retrieving warmup"))
+        backend.bring_current_warmup(db_id)
+    if args.get_grid_stdout:
+        backend.get_grid_from_stdout(jobid, jobinfo)
+    if args.completion:
+        backend.get_completion_stats(jobid, jobinfo, args)
+
+    # Options that deactivate the database entry once they're done
+    if args.get_data:
+        pyHepGrid.src.header.logger.info(printstr.format("Retrieving data"))
+        backend.get_data(db_id)
+        # if --done is used we assume there are jobs which are _not_ done
+        if not args.done and not args.runSlurmProduction:
+            new_entry_status[db_id] = False
+    if args.kill_job:
+        pyHepGrid.src.header.logger.info(printstr.format("Killing"))
+        backend.kill_job(jobid, jobinfo)
+        new_entry_status[db_id] = False
+    if args.clean:
+        pyHepGrid.src.header.logger.info(printstr.format("Cleaning"))
+        backend.clean_job(jobid)
+        new_entry_status[db_id] = False
+
+    # Enable back any database entry
+    if args.enableme:
+        new_entry_status[db_id] = True
+    if args.disableme:
+        new_entry_status[db_id] = False
+
+    if not any([args.stats, args.since, args.state_times, args.info,
+                args.infoVerbose, args.renewArc, args.printme,
+                args.printmelog, args.checkwarmup, args.getmewarmup,
+                args.get_grid_stdout, args.completion, args.get_data,
+                args.kill_job, args.clean, args.enableme, args.disableme]):
+        pyHepGrid.src.header.logger.plain(" ".join(i for i in jobid))
+
+
+def monitor_routine(backends, args):
+    """ Keeps the statuses of the subjobs of the active runs of backends up
+    to date in the database until interrupted (see Backend.monitor_poll).
+    Between rounds of polls it sleeps until the next subjob is due, at most
+    header.monitor_interval seconds. The heartbeat it records tells
+    management commands to show the stored statuses instead of polling
+    """
+    header = pyHepGrid.src.header
+    dbase = backends[0].dbase
+    host, pid = socket.gethostname(), os.getpid()
+    started = datetime.datetime.now()
+    monitor = backends[0].get_live_monitor()
+    if monitor is not None:
+        header.logger.critical(
+            "A monitor is already running on {0} (pid {1}) since {2}".format(
+                monitor["host"], monitor["pid"], monitor["started"]))
+
+    def heartbeat():
+        dbase.monitor_heartbeat(host, pid, started,
+                                [i.table for i in backends])
+
+    header.logger.info("Monitoring {0}".format(
+        ", ".join(i.table for i in backends)))
+    try:
+        while True:
+            # Also beats after every run polled, so that a long round isn't
+            # taken for a dead monitor
+            heartbeat()
+            next_polls = [i.monitor_poll(heartbeat) for i in backends]
+            heartbeat()
+            next_polls = [i for i in next_polls if i is not None]
+            wait = header.monitor_interval
+            if next_polls and min(next_polls):
+                due = datetime.datetime.fromisoformat(min(next_polls))
+                wait = min((due - datetime.datetime.now()).total_seconds(),
+                           wait)
+            elif next_polls:
+                wait = 0
+            # Subjobs due as soon as possible are polled every round, don't
+            # poll them more often than the running ones
+            wait = max(wait, min(header.poll_min_interval*60,
+                                 header.monitor_interval))
+            header.logger.info("Next round of polls in {0:.0f}s".format(wait))
+            time.sleep(wait)
+    except KeyboardInterrupt:
+        header.logger.info("Monitor stopped")
+    finally:
+        dbase.remove_monitor(host, pid)
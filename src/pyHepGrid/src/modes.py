@@ -34,6 +34,33 @@ def do_management(args, rcard):
             mr.management_routine(backend, args)
 
 
+def do_monitor(args, rcard):
+    # Monitor: keep the statuses of the active runs up to date in the database
+    backend_setups = {
+        "runArc": {"backend": bm.Arc,
+                   "kwargs": {"production": False}},
+        "runArcProduction": {"backend": bm.Arc,
+                             "kwargs": {"production": True}},
+        "runDirac": {"backend": bm.Dirac,
+                     "kwargs": {}},
+        "runSlurm": {"backend": bm.Slurm,
+                     "kwargs": {"production": False}},
+        "runSlurmProduction": {"backend": bm.Slurm,
+                               "kwargs": {"production": True}}
+    }
+    selected = [i for i in backend_setups if getattr(args, i)]
+    if not selected:
+        selected = list(backend_setups)
+    # Production and warmup runs of a backend may or may not share a table
+    # (arcprodtable, slurmprodtable), each table is polled once
+    backends = {}
+    for _backend in selected:
+        backend_opt = backend_setups[_backend]
+        backend = backend_opt["backend"](**backend_opt["kwargs"])
+        backends.setdefault(backend.table, backend)
+    mr.monitor_routine(list(backends.values()), args)
+
+
 def do_test(args, rcard):
     # Test an initialised runcard
     pyHepGrid.src.test_nnlojob.run_test(args, rcard)
@@ -71,7 +98,13 @@ def do_run(args, rcard):
     for run_function in runfuncs:
         if getattr(args, run_function):  # If mode is selected
             runWrapper = runfuncs[run_function]
-            runWrapper(rcard, test=args.test)
+            if args.resume:
+                if run_function != "runArcProduction":
+                    logger.critical(
+                        "--resume is only available for ARC productions")
+                runWrapper(rcard, test=args.test, resume=True)
+            else:
+                runWrapper(rcard, test=args.test)
             func_selected = True
 
     if not func_selected:
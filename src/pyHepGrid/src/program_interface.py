@@ -134,25 +134,26 @@ class ProgramInterface(object):
         from pyHepGrid.src.header import grid_output_dir, logger
         logger.debug(F"Checking whether runcard {rname} has output for seeds "
                      "that you are trying to submit...")
+        from pyHepGrid.src.header import baseSeed, producRun
         checkname = r + "-" + rname
-        files = self.gridw.get_dir_contents(grid_output_dir)
-        first = True
-        if checkname in files:
-            from pyHepGrid.src.header import baseSeed, producRun
-            for seed in range(baseSeed, baseSeed + producRun):
-                filename = self.output_name(r, rname, seed)
-                if filename in files:
-                    if first:
-                        self._press_yes_to_continue(
-                            "This runcard already has at least one output file "
-                            "at gfal:output with a seed you are trying to "
-                            F"submit (looked for '{checkname}').\n"
-                            "If you continue, it will be removed now.")
-                        logger.warning(
-                            F"Runcard {r} has at least one file at output")
-                        first = False
-                    self.gridw.delete(filename, grid_output_dir)
-            logger.info("Output check complete")
+        files = self.gridw.get_dir_index(grid_output_dir)
+        existing = [self.output_name(r, rname, seed)
+                    for seed in range(baseSeed, baseSeed + producRun)]
+        existing = [filename for filename in existing if filename in files]
+        if existing:
+            self._press_yes_to_continue(
+                "This runcard already has at least one output file "
+                "at gfal:output with a seed you are trying to "
+                F"submit (looked for '{checkname}').\n"
+                "If you continue, it will be removed now.")
+            logger.warning(
+                F"Runcard {r} has {len(existing)} file(s) at output")
+            failed = self.gridw.delete_many(existing, grid_output_dir)
+            if failed:
+                logger.warning(
+                    F"Could not remove {len(failed)} of the output files "
+                    F"of runcard {r}")
+        logger.info("Output check complete")
 
     # helper functions
     def _file_exists(self, file, logger):
@@ -3,8 +3,13 @@ from datetime import datetime
 import pyHepGrid.src.utilities as util
 import pyHepGrid.src.header as header
 import pyHepGrid.src.socket_api as sapi
+import pyHepGrid.src.ce_scheduler as ce_scheduler
+import os
 import time
 
+# Stands in for the seed when the production arguments are compiled
+SEED_PLACEHOLDER = "@PYHEPGRID_SEED@"
+
 
 class RunArc(Backend):
     """
@@ -56,6 +61,52 @@ class RunArc(Backend):
                 "Type of input arguments: {} not regocnised in ARC "
                 "._format_args".format(type(input_args)))
 
+    def _xrsl_attribute(self, key, value):
+        """ XRSL line setting the attribute key to value """
+        value = value.strip()
+        if value[0] == "\"" and value[-1] == "\"":
+            return "({0} = {1})\n".format(key, value)
+        return "({0} = \"{1}\")\n".format(key, value)
+
+    def _xrsl_description(self, dictData):
+        """ XRSL description of a job, the template followed by the
+        attributes in dictData """
+        description = "".join(i + '\n' for i in self.templ)
+        for key in dictData:
+            description += self._xrsl_attribute(key, dictData[key])
+        return description
+
+    def _compile_prod_XRSL(self, r, dcard, jobName, count, memory):
+        """ Returns a function giving the XRSL description of the production
+        job of a seed. The template and everything shared by the seeds is
+        rendered once, only the seed is filled in for each job """
+        shared = self._xrsl_description({'jobName': jobName,
+                                         'count': str(count),
+                                         'countpernode': str(count),
+                                         'memory': str(memory), })
+
+        def render_slowly(seed):
+            return shared + self._xrsl_attribute(
+                'arguments', self._get_prod_args(r, dcard, seed))
+
+        try:
+            parts = self._xrsl_attribute(
+                'arguments', self._get_prod_args(r, dcard, SEED_PLACEHOLDER)
+            ).split(SEED_PLACEHOLDER)
+        except Exception:
+            parts = []
+
+        def render(seed):
+            return shared + str(seed).join(parts)
+
+        # The program interface may do more with the seed than pass it on
+        if len(parts) < 2 or render(1) != render_slowly(1):
+            header.logger.debug(
+                "Production arguments depend on the seed, rendering them "
+                "for every job")
+            return render_slowly
+        return render
+
     def _write_XRSL(self, dictData, filename=None):
         """ Writes a unique XRSL file
         which instructs the arc job to run
@@ -63,28 +114,36 @@ class RunArc(Backend):
         if not filename:
             filename = util.unique_filename()
         with open(filename, 'w') as f:
-            for i in self.templ:
-                f.write(i)
-                f.write('\n')
-            for key in dictData:
-                f.write("(" + key)
-                argument_value = dictData[key].strip()
-                if argument_value[0] == "\"" and argument_value[-1] == "\"":
-                    f.write(" = {})\n".format(argument_value))
-                else:
-                    f.write(" = \"{}\")\n".format(argument_value))
+            f.write(self._xrsl_description(dictData))
+        return filename
+
+    def _write_XRSL_batch(self, descriptions, filename=None):
+        """ Writes a unique XRSL file with all the job descriptions in
+        descriptions, so that they are all submitted by a single arcsub call
+        """
+        if not filename:
+            filename = util.unique_filename()
+        with open(filename, 'w') as f:
+            if len(descriptions) == 1:
+                f.write(descriptions[0])
+            else:
+                f.write("+\n")
+                f.writelines("(" + i + ")\n" for i in descriptions)
         return filename
 
-    def _run_XRSL(self, filename, test=False, include_retcode=False):
-        """ Sends XRSL to the queue defined in header
+    def _run_XRSL(self, filename, test=False, include_retcode=False,
+                  all_jobids=False, ce=None):
+        """ Sends XRSL to the queue defined in header, or to ce if given
         If test = True, use test queue
+        If all_jobids = True, returns the list of jobids of all the jobs
+        submitted, in the order of the file, instead of the last one
         """
         import random
         from pyHepGrid.src.header import arc_direct
         from pyHepGrid.src.header import split_dur_ce
-        if test:
+        if ce is None and test:
             from pyHepGrid.src.header import ce_test as ce
-        else:
+        elif ce is None:
             from pyHepGrid.src.header import ce_base as ce
             # Randomise ce at submission time to reduce load
             if split_dur_ce and ".dur.scotgrid.ac.uk" in ce:
@@ -104,6 +163,12 @@ class RunArc(Backend):
         # Speeds up submission (according to Stephen)
         if arc_direct and ".dur.scotgrid.ac.uk" in ce:
             cmd += " -S org.nordugrid.gridftpjob --direct "
+        if all_jobids:
+            output, retcode = util.getOutputCall(cmd.split(),
+                                                 include_return_code=True)
+            jobids = [i.split("jobid:")[-1].strip()
+                      for i in output.splitlines() if "jobid:" in i]
+            return jobids, retcode
         if include_retcode:
             output = util.getOutputCall(cmd.split(), include_return_code=True)
             jobid = output[0].split("jobid:")[-1].rstrip().strip()
@@ -122,8 +187,10 @@ class RunArc(Backend):
 
         ExpandedCard is an override for util.expandCard for use in
         auto-resubmission
+
+        The runcards are submitted concurrently, as are the jobs of each
         """
-        from pyHepGrid.src.header import warmupthr, jobName, warmup_base_dir
+        from pyHepGrid.src.header import warmupthr
         # runcard names (of the form foo.run)
         # dCards, dictionary of { 'runcard' : 'name' }, can include extra info
         if expandedCard is None:
@@ -136,8 +203,9 @@ class RunArc(Backend):
             from pyHepGrid.src.header import ce_base as ce
 
         if header.sockets_active > 1:
-            sockets = True
             n_sockets = header.sockets_active
+            # Set once the port of the socket server is known
+            job_type = None
             if ".dur.scotgrid.ac.uk" not in ce:
                 # Can't submit sockets elsewhere than Durham!!!!!!!
                 header.logger.info(
@@ -145,7 +213,6 @@ class RunArc(Backend):
                 header.logger.critical("Can't submit socketed warmups "
                                        "to locations other than Durham")
         else:
-            sockets = False
             n_sockets = 1
             if test:
                 job_type = "Warmup Test"
@@ -167,109 +234,153 @@ class RunArc(Backend):
 
         header.logger.info("Runcards selected: {0}".format(
             " ".join(r for r in rncards)))
-        port = header.port
+        # Anything which may ask for confirmation is done before the
+        # submissions, which then run concurrently
         for r in rncards:
-            if n_sockets > 1:
-                # Automagically activates the socket and finds the best port for
-                # it!
-                port = sapi.fire_up_socket_server(header.server_host,
-                                                  port, n_sockets,
-                                                  header.wait_time,
-                                                  header.socket_exe,
-                                                  tag="{0}-{1}".format(
-                                                      r, dCards[r]))
-                job_type = "Socket={}".format(port)
-
             # Check whether this run has something on the gridStorage
             self.check_for_existing_warmup(r, dCards[r])
-            # Generate the XRSL file
-            arguments = self._get_warmup_args(r, dCards[r], threads=warmupthr,
-                                              sockets=sockets, port=port)
-            dictData = {'arguments': arguments,
-                        'jobName': jobName,
-                        'count': str(warmupthr),
-                        'countpernode': str(warmupthr), }
-            xrslfile = self._write_XRSL(dictData)
-            header.logger.debug(" > Path of xrsl file: {0}".format(xrslfile))
-
-            jobids = []
-            keyquit = None
-            try:
-                for _ in range(n_sockets):
-                    # Run the file
-                    jobid, retcode = (self._run_XRSL(
-                        xrslfile, test=test, include_retcode=True))
-                    if int(retcode) != 0:
-                        jobid = "None"
-                    jobids.append(jobid)
-            except Exception as interrupt:
-                print("\n")
-                header.logger.error(
-                    "Submission error encountered. Inserting all successful "
-                    "submissions to database")
-                keyquit = interrupt
-            # Create daily path
-            finally:
-                if warmup_base_dir is not None:
-                    pathfolder = util.generatePath(warmup=True)
-                else:
-                    pathfolder = "None"
-                # Create database entry
-                dataDict = {'jobid': ' '.join(jobids),
-                            'date': str(datetime.now()),
-                            'pathfolder': pathfolder,
-                            'runcard': r,
-                            'runfolder': dCards[r],
-                            'jobtype': job_type,
-                            'status': "active", }
-                if len(jobids) > 0:
-                    self.dbase.insert_data(self.table, dataDict)
-                else:
-                    header.logger.critical(
-                        "No jobids returned, no database entry inserted for "
-                        "submission: {0} {1}".format(r, dCards[r]))
-                port += 1
-                if keyquit is not None:
-                    raise keyquit
+        arg_sets = [(r, dCards[r], test, n_sockets, job_type)
+                    for r in rncards]
+        self._multirun(self.run_single_warmup, arg_sets,
+                       n_threads=len(arg_sets), family="warmup")
 
-    def run_single_production(self, args):
+    def run_single_warmup(self, args):
         """
         Wrapper for passing to multirun, where args is a tuple of each argument
-        required. Would be easier if multirun used starmap...
+        required. Fires up the socket server of the runcard if needed, submits
+        its n_sockets jobs concurrently and inserts the run in the database
         """
-        r, dcard, seed, jobName, baseSeed, test, jobids, count, memory = args
-        arguments = self._get_prod_args(r, dcard, seed)
+        from pyHepGrid.src.header import warmupthr, jobName, warmup_base_dir
+        r, dcard, test, n_sockets, job_type = args
+        sockets = n_sockets > 1
+        port = header.port
+        if sockets:
+            # Automagically activates the socket and finds the best port for
+            # it!
+            port = sapi.fire_up_socket_server(header.server_host,
+                                              port, n_sockets,
+                                              header.wait_time,
+                                              header.socket_exe,
+                                              tag="{0}-{1}".format(r, dcard))
+            job_type = "Socket={}".format(port)
+
+        # Generate the XRSL file
+        arguments = self._get_warmup_args(r, dcard, threads=warmupthr,
+                                          sockets=sockets, port=port)
         dictData = {'arguments': arguments,
                     'jobName': jobName,
-                    'count': str(count),
-                    'countpernode': str(count),
-                    'memory' :  str(memory),}
-        print(dictData)
-        xrslfile = self._write_XRSL(dictData, filename=None)
-        if(seed == baseSeed):
+                    'count': str(warmupthr),
+                    'countpernode': str(warmupthr), }
+        xrslfile = self._write_XRSL(dictData)
+        header.logger.debug(" > Path of xrsl file: {0}".format(xrslfile))
+
+        jobids = []
+
+        def submit(_):
+            # Run the file
+            jobid, retcode = (self._run_XRSL(
+                xrslfile, test=test, include_retcode=True))
+            if int(retcode) != 0:
+                jobid = "None"
+            jobids.append(jobid)
+
+        keyquit = None
+        try:
+            self._multirun(submit, range(n_sockets), n_threads=n_sockets,
+                           family="arcsub")
+        except Exception as interrupt:
+            print("\n")
+            header.logger.error(
+                "Submission error encountered. Inserting all successful "
+                "submissions to database")
+            keyquit = interrupt
+        # Create daily path
+        finally:
+            if warmup_base_dir is not None:
+                pathfolder = util.generatePath(warmup=True)
+            else:
+                pathfolder = "None"
+            # Create database entry
+            dataDict = {'date': str(datetime.now()),
+                        'pathfolder': pathfolder,
+                        'runcard': r,
+                        'runfolder': dcard,
+                        'jobtype': job_type,
+                        'status': "active", }
+            if len(jobids) > 0:
+                self._insert_run(dataDict, jobids)
+            else:
+                header.logger.critical(
+                    "No jobids returned, no database entry inserted for "
+                    "submission: {0} {1}".format(r, dcard))
+            os.remove(xrslfile)
+            if keyquit is not None:
+                raise keyquit
+
+    def run_batch_production(self, args):
+        """
+        Wrapper for passing to multirun, where args is a tuple of each argument
+        required. Submits the jobs of all the seeds of the batch with a
+        single arcsub call to the CE picked by the scheduler, records them in
+        the journal of the submission and returns their (jobid, ce) in the
+        order of the seeds (jobid "None" for those which could not be
+        submitted)
+        """
+        r, dcard, seeds, render, baseSeed, test, submission, scheduler = args
+        ce = scheduler.choose()
+        xrslfile = self._write_XRSL_batch([render(seed) for seed in seeds])
+        if seeds[0] == baseSeed:
             header.logger.debug(
-                " > Path of xrsl file for seed {1}: {0}".format(xrslfile, seed))
+                " > Path of xrsl file for seeds {1}-{2}: {0}".format(
+                    xrslfile, seeds[0], seeds[-1]))
         # Run the file
-        jobid, retcode = self._run_XRSL(
-            xrslfile, test=test, include_retcode=True)
-        if int(retcode) != 0:
-            jobid = "None"
-        jobids.append(jobid)
-        time.sleep(0.5)
-        return jobid
-
-    def arg_iterator(self, r, dCards, jobName, baseSeed, producRun, test,
-                     jobids, count, memory):
-        for seed in range(baseSeed, baseSeed + producRun):
-        # for seed in [67, 76, 82, 217, 226, 228, 232, 233]: #run 3 resubmits p2
-        # for seed in [81, 206, 208]: #run 1 resubmits
-            yield (r, dCards[r], seed, jobName, baseSeed, test, jobids, count, memory)
-
-    def run_wrap_production(self, test=None):
+        start = time.perf_counter()
+        try:
+            batch_jobids, retcode = self._run_XRSL(xrslfile, test=test,
+                                                   all_jobids=True, ce=ce)
+        finally:
+            os.remove(xrslfile)
+        if len(batch_jobids) != len(seeds):
+            # Without one jobid per job there is no telling which seeds ran,
+            # don't leave jobs behind which are not in the database
+            header.logger.error(
+                "arcsub returned {0} jobids for the {1} seeds {2}-{3} (return "
+                "code {4}), the whole batch is marked as failed".format(
+                    len(batch_jobids), len(seeds), seeds[0], seeds[-1],
+                    retcode))
+            if batch_jobids:
+                util.spCall(["arckill", "-j", self.arcbd] + batch_jobids)
+            batch_jobids = ["None"]*len(seeds)
+        scheduler.record_submission(
+            ce, time.perf_counter() - start, len(seeds),
+            len(seeds) - batch_jobids.count("None"))
+        self.dbase.journal_jobs(
+            submission, [(seed, jobid, ce)
+                         for seed, jobid in zip(seeds, batch_jobids)])
+        return [(jobid, ce) for jobid in batch_jobids]
+
+    def arg_iterator(self, r, dCards, jobName, baseSeed, seeds, test,
+                     submission, count, memory, scheduler):
+        """ Arguments of run_batch_production for every batch of
+        header.arc_submit_batch seeds of the list seeds """
+        render = self._compile_prod_XRSL(r, dCards[r], jobName, count, memory)
+        # seeds = [67, 76, 82, 217, 226, 228, 232, 233] #run 3 resubmits p2
+        # seeds = [81, 206, 208] #run 1 resubmits
+        batch_size = max(header.arc_submit_batch, 1)
+        for i in range(0, len(seeds), batch_size):
+            yield (r, dCards[r], seeds[i:i+batch_size], render, baseSeed,
+                   test, submission, scheduler)
+
+    def run_wrap_production(self, test=None, resume=False):
         """
         Wrapper function. It assumes the initialisation stage has already
         happend Writes XRSL file with the appropiate information and send a
         producrun number of jobs to the arc queue
+
+        The jobs are recorded in a journal as they are submitted and the run
+        is only added to the database once all of them are. If resume, only
+        the seeds missing from the journal of an interrupted submission are
+        submitted
         """
         from pyHepGrid.src.header import baseSeed, producRun, jobName, count, memory
 
@@ -281,66 +392,83 @@ class RunArc(Backend):
 
         header.logger.info("Runcards selected: {0}".format(
             " ".join(r for r in rncards)))
+        scheduler = ce_scheduler.from_database(self, test)
+        if len(scheduler.ces) > 1:
+            header.logger.info("Spreading the jobs over the CEs:")
+            for line in scheduler.summary():
+                header.logger.info("  {0}".format(line))
         for r in rncards:
-            joblist = []
-            # Check whether this run has something on the gridStorage
-            self.check_for_existing_output(r, dCards[r])
-            # use the same unique name for all seeds since
-            # we cannot multiprocess the arc submission
-            keyquit = None
+            submission = self._find_submission(r, dCards[r])
+            if resume:
+                if submission is None:
+                    header.logger.info(
+                        "No interrupted submission of {0} {1} to "
+                        "resume".format(r, dCards[r]))
+                    continue
+                dataDict = submission["run"]
+                submission = submission["rowid"]
+                submitted = self.dbase.journaled_jobs(submission)
+                run_seed = int(dataDict["iseed"])
+                no_runs = int(dataDict["no_runs"])
+                seeds = [seed for seed in range(run_seed, run_seed + no_runs)
+                         if submitted.get(seed, ("None",))[0] == "None"]
+                header.logger.info(
+                    "Resuming the submission of {0} {1}: {2} of its {3} seeds "
+                    "are left".format(r, dCards[r], len(seeds), no_runs))
+            else:
+                if submission is not None:
+                    header.logger.critical(
+                        "The submission of {0} {1} started on {2} was "
+                        "interrupted, use --resume to submit its missing "
+                        "seeds".format(r, dCards[r], submission["started"]))
+                # Check whether this run has something on the gridStorage
+                self.check_for_existing_output(r, dCards[r])
+                run_seed = baseSeed
+                seeds = list(range(baseSeed, baseSeed + producRun))
+                # Create daily path
+                pathfolder = util.generatePath(warmup=False)
+                # Database entry, inserted once every seed is submitted
+                dataDict = {'date': str(datetime.now()),
+                            'pathfolder': pathfolder,
+                            'runcard': r,
+                            'jobtype': job_type,
+                            'runfolder': dCards[r],
+                            'iseed': str(baseSeed),
+                            'no_runs': str(producRun),
+                            'status': "active", }
 
             # Sanity check for test queue
-            if test and producRun > 5:
+            if test and len(seeds) > 5:
                 self._press_yes_to_continue(
                     "  \033[93m WARNING:\033[0m About to submit a large "
-                    "number ({0}) of jobs to the test queue.".format(producRun))
+                    "number ({0}) of jobs to the test queue.".format(
+                        len(seeds)))
+            if not resume:
+                # Seeds are only reserved once nothing can stop the
+                # submission from starting
+                submission = self.dbase.start_submission(self.table, dataDict)
 
             # use iterator for memory reasons :)
-            from multiprocessing import Manager
-            # Use shared memory list in case of submission failure
-            jobids = Manager().list()
             arg_sets = self.arg_iterator(
-                r, dCards, jobName, baseSeed, producRun, test, jobids, count, memory)
+                r, dCards, jobName, run_seed, seeds, test, submission, count,
+                memory, scheduler)
 
             try:
-                joblist = self._multirun(self.run_single_production, arg_sets,
-                                         n_threads=min(
-                                             header.arc_submit_threads,
-                                             producRun))
-            except (Exception, KeyboardInterrupt) as interrupt:
+                self._multirun(self.run_batch_production, arg_sets,
+                               n_threads=min(header.arc_submit_threads,
+                                             max(len(seeds), 1)),
+                               family="arcsub")
+            except (Exception, KeyboardInterrupt):
                 print("\n")
-                joblist = jobids
                 header.logger.error(
-                    "Submission error encountered. "
-                    "Inserting all successful submissions to database")
-                keyquit = interrupt
+                    "Submission error encountered. The jobs submitted so far "
+                    "are kept, use --resume to submit the missing seeds")
+                raise
 
-            # Create daily path
-            pathfolder = util.generatePath(warmup=False)
-            # Create database entry
-            jobStr = ' '.join(joblist)
-            dataDict = {'jobid': jobStr,
-                        'date': str(datetime.now()),
-                        'pathfolder': pathfolder,
-                        'runcard': r,
-                        'jobtype': job_type,
-                        'runfolder': dCards[r],
-                        'iseed': str(baseSeed),
-                        'no_runs': str(producRun),
-                        'status': "active", }
-            if len(joblist) > 0:
-                self.dbase.insert_data(self.table, dataDict)
-                # Set jobs to failed status if no jobid returned
-                dbid = self.get_active_dbids()[-1]
-                statuses = [self.cUNK if i !=
-                            "None" else self.cMISS for i in joblist]
-                self._set_new_status(dbid, statuses)
-            else:
+            if self._finish_submission(submission, dataDict) is None:
                 header.logger.critical(
                     "No jobids returned, no database entry inserted for "
                     "submission: {0} {1}".format(r, dCards[r]))
-            if keyquit is not None:
-                raise keyquit
 
 
 def runWrapper(runcard, test=None, expandedCard=None):
@@ -349,10 +477,10 @@ def runWrapper(runcard, test=None, expandedCard=None):
     arc.run_wrap_warmup(test, expandedCard)
 
 
-def runWrapperProduction(runcard, test=None):
+def runWrapperProduction(runcard, test=None, resume=False):
     header.logger.info("Running arc job for {0}".format(runcard))
     arc = RunArc(prod=True, arcscript=header.ARCSCRIPTDEFAULTPRODUCTION)
-    arc.run_wrap_production(test)
+    arc.run_wrap_production(test, resume=resume)
 
 
 # Testing routines - just a wrapper to get the args for nnlojob
@@ -1,9 +1,16 @@
 from pyHepGrid.src.Backend import Backend
 from datetime import datetime
+import os
+import time
 import pyHepGrid.src.utilities as util
 import pyHepGrid.src.header as header
 
 
+# Seconds waited before each new attempt at submitting a batch, times the
+# number of attempts so far
+DIRAC_RETRY_WAIT = 10
+
+
 class RunDirac(Backend):
     """
     Subclass of Backend for Dirac submission.
@@ -73,6 +80,50 @@ class RunDirac(Backend):
         jobids = jobids.split(", ")
         return jobids
 
+    def run_batch_production(self, args):
+        """ Wrapper for passing to multirun, where args is a tuple
+        (argument string, first seed, number of seeds). Submits the seeds
+        with a single parametric JDL, trying again up to
+        header.dirac_submit_retries times if DIRAC doesn't return one jobid
+        per seed. The jobs DIRAC accepted in a failed attempt are killed
+        before trying again, so that no seed runs twice. Returns the jobids
+        in the order of the seeds, "None" for all of them if the batch could
+        not be submitted
+        """
+        argument_string, start_seed, no_seeds = args
+        max_seed = start_seed + no_seeds - 1
+        for attempt in range(header.dirac_submit_retries + 1):
+            if attempt > 0:
+                time.sleep(DIRAC_RETRY_WAIT*attempt)
+                header.logger.info(
+                    " > Retrying seeds {0}-{1} ({2}/{3})".format(
+                        start_seed, max_seed, attempt,
+                        header.dirac_submit_retries))
+            jdlfile = self._write_JDL(argument_string, start_seed, no_seeds)
+            header.logger.info(
+                " > jdl file path for seeds {0}-{1}: {2}".format(
+                    start_seed, max_seed, jdlfile))
+            try:
+                jobids = self._run_JDL(jdlfile)
+            except Exception as e:
+                # dirac-wms-job-submit could not be run at all
+                header.logger.error(e)
+                jobids = []
+            finally:
+                os.remove(jdlfile)
+            if len(jobids) == no_seeds and all(i.isdigit() for i in jobids):
+                return jobids
+            header.logger.error(
+                "Submission of seeds {0}-{1} to Dirac failed".format(
+                    start_seed, max_seed))
+            accepted = [i for i in jobids if i.isdigit()]
+            if accepted:
+                header.logger.info(
+                    " > Killing the {0} job(s) of the failed attempt".format(
+                        len(accepted)))
+                util.spCall(["dirac-wms-job-kill"] + accepted)
+        return ["None"]*no_seeds
+
     # Run for DIRAC
     def run_wrap_production(self):
         """
@@ -86,7 +137,7 @@ class RunDirac(Backend):
         self.runfolder = header.runcardDir
         from pyHepGrid.src.header import baseSeed, producRun
 
-        increment = 750
+        increment = max(header.dirac_submit_batch, 1)
         for r in rncards:
             header.logger.info(
                 "> Submitting {0} job(s) for {1} to Dirac".format(producRun, r))
@@ -94,27 +145,24 @@ class RunDirac(Backend):
                 "> Beginning at seed {0} in batches of {1}.".format(
                     baseSeed, increment))
             self.check_for_existing_output(r, dCards[r])
-            jdlfile = None
             args = self._get_prod_args(r, dCards[r], "%s")
             print(args)
             print(self.templ)
-            joblist, remaining_seeds, seed_start = [], producRun, baseSeed
-            while remaining_seeds > 0:
-                no_seeds = min(increment, remaining_seeds)
-                jdlfile = self._write_JDL(args, seed_start, no_seeds)
-                max_seed = seed_start+no_seeds-1
-                header.logger.info(
-                    " > jdl file path for seeds {0}-{1}: {2}".format(
-                        seed_start, max_seed, jdlfile))
-                joblist += self._run_JDL(jdlfile)
-                remaining_seeds = remaining_seeds - no_seeds
-                seed_start = seed_start + no_seeds
+            batches = [(args, seed_start, min(increment,
+                                              baseSeed+producRun-seed_start))
+                       for seed_start in range(baseSeed, baseSeed+producRun,
+                                               increment)]
+            # The batches are submitted concurrently, jobids come back in
+            # the order of the batches
+            joblist = []
+            for jobids in self._multirun(
+                    self.run_batch_production, batches,
+                    n_threads=header.dirac_submit_threads, family="dirac"):
+                joblist += jobids
             # Create daily path
             pathfolder = util.generatePath(False)
             # Create database entr
-            jobStr = ' '.join(joblist)
-            dataDict = {'jobid': jobStr,
-                        'date': str(datetime.now()),
+            dataDict = {'date': str(datetime.now()),
                         'pathfolder': pathfolder,
                         'runcard': r,
                         'runfolder': dCards[r],
@@ -122,7 +170,9 @@ class RunDirac(Backend):
                         'no_runs': str(producRun),
                         'jobtype': "Production",
                         'status': "active", }
-            self.dbase.insert_data(self.table, dataDict)
+            # Set jobs to failed status if no jobid returned
+            statuses = [None if i != "None" else self.cMISS for i in joblist]
+            self._insert_run(dataDict, joblist, statuses)
 
 
 def runWrapper(runcard, test=None):
@@ -1,8 +1,14 @@
 from datetime import datetime
+from uuid import uuid4
 from pyHepGrid.src.Backend import Backend
+from pyHepGrid.src.program_interface import ProgramInterface
 import pyHepGrid.src.header as header
 import pyHepGrid.src.socket_api as sapi
 import pyHepGrid.src.utilities as util
+import os
+
+# Production template whose command line the packed template reproduces
+DEFAULT_PRODUCTION_TEMPLATE = "slurm_template_production.sh"
 
 
 class RunSlurm(Backend):
@@ -13,6 +19,8 @@ class RunSlurm(Backend):
         table: name of SLURM jobs table in local jobs database
         templ: list of lines to be written to SLURM submission file
         prodtempl: list of lines to be written to SLURM submission file (production)
+        packtempl: list of lines to be written to SLURM submission file
+            (production of several runcards in one array)
         runfolder: location of runcard (passed from header)
         tarw: initialised instance of tarfile wrapper class
     """
@@ -27,6 +35,7 @@ class RunSlurm(Backend):
         else:
             self.templ = header.SLURMSCRIPTDEFAULT
         self.prodtempl = header.SLURMSCRIPTDEFAULT_PRODUCTION
+        self.packtempl = header.SLURMSCRIPTDEFAULT_PACKED
         self.runfolder = header.runcardDir
         self.tarw = util.TarWrap()
 
@@ -110,6 +119,48 @@ class RunSlurm(Backend):
         args = super().include_arguments(args)
         return args
 
+    def _get_packed_args(self, lookup, no_tasks, threads, queue=None):
+        """
+        Sets and returns arguments to be passed as sbatch commands, which are
+        substituted into the packed production SLURM template file, where the
+        runcard, run directory and seed of each task come from the lookup
+        table lookup (see _write_lookup).
+        """
+        args = {"lookup": lookup, "no_tasks": no_tasks, "threads": threads,
+                "stdoutfile": os.path.join(os.path.dirname(lookup),
+                                           "slurm-%A_%a.out")}
+        args = self.__do_common_args(args, threads, queue)
+        # Add arguments coming from the parent interface
+        args = super().include_arguments(args)
+        return args
+
+    def _write_lookup(self, tasks):
+        """ Writes the lookup table of a packed array, where line n gives the
+        runcard, run directory, stdout directory and seed of task n, from
+        the list of (runcard, run directory, seed) tasks. Returns its path
+        """
+        pack_dir = os.path.join(header.local_run_directory, "slurm_packs")
+        os.makedirs(pack_dir, exist_ok=True)
+        lookup = os.path.join(pack_dir, "{0}.txt".format(uuid4().hex))
+        with open(lookup, 'w') as f:
+            for runcard, run_dir, seed in tasks:
+                f.write("\t".join([runcard, run_dir,
+                                   self.get_stdout_dir_name(run_dir),
+                                   str(seed)]) + "\n")
+        return lookup
+
+    def _can_pack(self):
+        """ Whether the productions of several runcards can be packed in
+        one array. The packed template runs the command line of the default
+        production template, with the same arguments for every task, so a
+        custom production template or a program interface which changes the
+        arguments of each runcard (include_arguments) need one array per
+        runcard """
+        if header.slurm_template_production != DEFAULT_PRODUCTION_TEMPLATE:
+            return False
+        return type(self).include_arguments is \
+            ProgramInterface.include_arguments
+
     def _run_SLURM(self, filename, args, queue, test=False, socket=None,
                    n_sockets=1):
         """ Takes a slurm runfile and submits it to the SLURM batch system.
@@ -201,11 +252,15 @@ class RunSlurm(Backend):
 
             jobid, runqueue = self._run_SLURM(slurmfile, arguments, queue,
                                               test=test, n_sockets=n_sockets)
-            jobids.append(jobid)
+            if array:
+                # One subjob per array task
+                jobids += ["{0}_{1}".format(jobid, task)
+                           for task in range(1, n_sockets+1)]
+            else:
+                jobids.append(jobid)
 
             # Create database entry
-            dataDict = {'jobid': ' '.join(jobids),
-                        'no_runs': str(n_sockets),
+            dataDict = {'no_runs': str(n_sockets),
                         'date': str(datetime.now()),
                         'pathfolder': arguments["runcard_dir"],
                         'runcard': r,
@@ -214,7 +269,7 @@ class RunSlurm(Backend):
                         'queue': str(runqueue),
                         'status': "active", }
             if len(jobids) > 0:
-                self.dbase.insert_data(self.table, dataDict)
+                self._insert_run(dataDict, jobids)
             else:
                 header.logger.critical(
                     "No jobids returned, no database entry inserted for "
@@ -241,6 +296,13 @@ class RunSlurm(Backend):
         # loop over all .run files defined in runcard.py
 
         header.logger.info("Runcards selected: {0}".format(" ".join(rncards)))
+        if header.slurm_pack_runcards and len(rncards) > 1:
+            if self._can_pack():
+                return self.run_wrap_packed_production(rncards, dCards, queue,
+                                                       test=test)
+            header.logger.info(
+                "Not packing the runcards: the production template or the "
+                "arguments of the runmode are specific to each runcard")
         for r in rncards:
             self.check_for_existing_output_local(
                 r, dCards[r], baseSeed, producRun)
@@ -254,10 +316,11 @@ class RunSlurm(Backend):
             jobids = []
             jobid, runqueue = self._run_SLURM(
                 slurmfile, arguments, queue, test=test)
-            jobids.append(jobid)
+            # One subjob per array task
+            jobids += ["{0}_{1}".format(jobid, task)
+                       for task in range(1, producRun+1)]
             # Create database entry
-            dataDict = {'jobid': ' '.join(jobids),
-                        'date': str(datetime.now()),
+            dataDict = {'date': str(datetime.now()),
                         'pathfolder': arguments["runcard_dir"],
                         'runcard': r,
                         'runfolder': dCards[r],
@@ -267,12 +330,69 @@ class RunSlurm(Backend):
                         'no_runs': str(producRun),
                         'status': "active", }
             if len(jobids) > 0:
-                self.dbase.insert_data(self.table, dataDict)
+                self._insert_run(dataDict, jobids)
             else:
                 header.logger.critical(
                     "No jobids returned, no database entry inserted for "
                     F"submission: {r} {dCards[r]}")
 
+    def run_wrap_packed_production(self, rncards, dCards, queue, test=None):
+        """
+        Sends the producrun jobs of every runcard as the tasks of as few
+        arrays as possible (with at most slurm_pack_max_tasks tasks each).
+        Each runcard still gets its own database entry, with the tasks of
+        the array which run its seeds as subjobs
+        """
+        job_type = "Production"
+        from pyHepGrid.src.header import producRun, baseSeed, production_threads
+        max_tasks = max(header.slurm_pack_max_tasks, producRun)
+        packs = []
+        for r in rncards:
+            if packs and (len(packs[-1]) + 1)*producRun <= max_tasks:
+                packs[-1].append(r)
+            else:
+                packs.append([r])
+
+        for pack in packs:
+            tasks = []
+            run_dirs = {}
+            for r in pack:
+                self.check_for_existing_output_local(
+                    r, dCards[r], baseSeed, producRun)
+                run_dirs[r] = self.get_local_dir_name(r, dCards[r])
+                # Same seeds as the array of a single runcard
+                tasks += [(r, run_dirs[r], baseSeed + task)
+                          for task in range(1, producRun+1)]
+            lookup = self._write_lookup(tasks)
+            header.logger.debug("Path of lookup table: {0}".format(lookup))
+
+            # Generate the SLURM file
+            arguments = self._get_packed_args(lookup, len(tasks),
+                                              production_threads, queue=queue)
+            slurmfile = self._write_SLURM(arguments, self.packtempl)
+            header.logger.debug("Path of slurm file: {0}".format(slurmfile))
+            jobid, runqueue = self._run_SLURM(
+                slurmfile, arguments, queue, test=test)
+            header.logger.info(
+                "Submitted {0} runcards as the {1} tasks of array {2}".format(
+                    len(pack), len(tasks), jobid))
+            for idx, r in enumerate(pack):
+                # One subjob per array task running a seed of r
+                first_task = idx*producRun + 1
+                jobids = ["{0}_{1}".format(jobid, task) for task in
+                          range(first_task, first_task+producRun)]
+                # Create database entry
+                dataDict = {'date': str(datetime.now()),
+                            'pathfolder': run_dirs[r],
+                            'runcard': r,
+                            'runfolder': dCards[r],
+                            'jobtype': job_type,
+                            'queue': str(runqueue),
+                            'iseed': str(baseSeed),
+                            'no_runs': str(producRun),
+                            'status': "active", }
+                self._insert_run(dataDict, jobids)
+
 
 def runWrapper(runcard, test=None, expandedCard=None):
     header.logger.info("Running SLURM job for {0}".format(runcard))
@@ -0,0 +1,21 @@
+#!/bin/bash
+#SBATCH -o {stdoutfile}
+#SBATCH --error {stderrfile}
+#SBATCH --array=1-{no_tasks}
+#SBATCH --job-name={jobName}
+{exclude_list}
+{exclusive}
+{partition}
+
+# Line n of the lookup table gives the runcard, run directory, stdout
+# directory and seed of task n
+IFS=$'\t' read -r runcard runcard_dir stdout_dir seed <<< "$(sed -n "${{SLURM_ARRAY_TASK_ID}}p" {lookup})"
+stdoutfile=${{stdout_dir}}slurm-${{SLURM_ARRAY_JOB_ID}}_${{SLURM_ARRAY_TASK_ID}}
+exec > ${{stdoutfile}}.out 2> ${{stdoutfile}}.err
+
+cd ${{runcard_dir}}
+hostname
+export OMP_NUM_THREADS={threads}
+./{exe} -run ${{runcard}} -iseed ${{seed}}
+
+exit 0
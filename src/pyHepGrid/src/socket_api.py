@@ -4,6 +4,11 @@
 # I suggest using ssh-copy-id to make sure you don't have to input your password
 # many times
 import subprocess as sp
+import threading
+
+# Ports given to the socket servers fired up by this process
+_reserved_ports = set()
+_ports_lock = threading.Lock()
 
 
 def send_command(cmd, target_host):
@@ -115,6 +120,20 @@ def check_port_blocked(host, port):
     return blocked
 
 
+def reserve_port(host, port):
+    """
+    Returns the first port from 'port' which is free in 'host' and which
+    hasn't been given to another socket server already, and reserves it.
+    Servers fired up at the same time are thus given different ports even
+    before they start listening
+    """
+    with _ports_lock:
+        while port in _reserved_ports or check_port_blocked(host, port):
+            port += 1
+        _reserved_ports.add(port)
+    return port
+
+
 def fire_up_socket_server(
         host, port, n_sockets, wait_time="18000",
         socket_exe="/mt/home/jmartinez/Gangaless_new/src/socket_server.py",
@@ -127,9 +146,8 @@ def fire_up_socket_server(
 
     On success return the free port
     """
-    # Check whether the port is free in the given host
-    while check_port_blocked(host, port):
-        port += 1
+    # Find a free port in the given host
+    port = reserve_port(host, port)
 
     # Once we have a free port, fire up the tmux session
     tms = "socket-server-{0}-{1}".format(port, tag.replace(".", "-"))
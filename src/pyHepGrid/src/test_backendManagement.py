@@ -0,0 +1,73 @@
+import datetime
+import pyHepGrid.src.backendManagement as bm
+
+ARC_JOB = "gsiftp://ce1.dur.scotgrid.ac.uk:2811/jobs/{0}"
+
+
+def production(iseed, no_runs):
+    return {"date": str(datetime.datetime.now()), "runcard": "a.run",
+            "runfolder": "tag", "iseed": str(iseed), "no_runs": str(no_runs),
+            "status": "active", "jobtype": "Production"}
+
+
+def test_arc_job_key(dbname):
+    arc = bm.Arc(production=True)
+    assert arc._arc_job_key(ARC_JOB.format("abc")) == "abc"
+    assert arc._arc_job_key(" gsiftp://ce1.dur.scotgrid.ac.uk/jobs/abc/ ") \
+        == "abc"
+
+
+def test_parse_arcstat(dbname):
+    arc = bm.Arc(production=True)
+    output = "\n".join([
+        "Job: " + ARC_JOB.format("a"),
+        " Name: Failed_attempt_2",
+        " State: Running",
+        "Job: " + ARC_JOB.format("b"),
+        " State: Finished",
+        "Job: " + ARC_JOB.format("c"),
+        " State: Failed",
+        "Job: " + ARC_JOB.format("d"),
+        " State: Queuing",
+        "Status of 4 jobs was queried, 4 jobs returned information"])
+    assert arc._parse_arcstat(output) == {
+        "a": arc.cRUN, "b": arc.cDONE, "c": arc.cFAIL, "d": arc.cWAIT}
+
+
+def test_split_slurm_id(dbname):
+    slurm = bm.Slurm(production=True)
+    assert slurm._split_slurm_id("12") == ("12", [None])
+    assert slurm._split_slurm_id("12_4") == ("12", [4])
+    assert slurm._split_slurm_id("12_[1-3,7%2]") == ("12", [1, 2, 3, 7])
+
+
+def test_expand_legacy_slurm_array(dbname, fake_grid_state):
+    slurm = bm.Slurm(production=True)
+    # Older versions stored the whole array as one subjob
+    dbid = slurm._insert_run(production(1, 3), ["10"], [slurm.cDONE])
+    slurm.stats_job(dbid, do_print=False)
+    subjobs = slurm.dbase.list_subjobs(slurm.table, dbid)
+    assert [(i["seed"], i["jobid"]) for i in subjobs] == \
+        [(1, "10_1"), (2, "10_2"), (3, "10_3")]
+    # The tasks are unknown to the scheduler, so none of them is done
+    assert slurm.cDONE not in [i["status"] for i in subjobs]
+
+
+def test_dirac_missing_seeds_stay_missing(dbname, fake_grid_state):
+    dirac = bm.Dirac()
+    dbid = dirac._insert_run(production(1, 3), ["None", "1", "None"],
+                             [dirac.cMISS, dirac.cUNK, dirac.cMISS])
+    dirac.prepare_stats([dbid])
+    dirac.stats_job(dbid, do_print=False)
+    # Jobs DIRAC doesn't list are waiting, missing seeds stay missing
+    assert [i["status"] for i in dirac.dbase.list_subjobs(
+        dirac.table, dbid)] == [dirac.cMISS, dirac.cWAIT, dirac.cMISS]
+
+
+def test_monitor_snapshot_only_for_monitored_tables(dbname):
+    arc, dirac = bm.Arc(production=True), bm.Dirac()
+    arc.dbase.monitor_heartbeat("host", 1, "now", [arc.table])
+    assert arc.use_monitor_snapshot()
+    assert not dirac.use_monitor_snapshot()
+    arc.force_poll = True
+    assert not arc.use_monitor_snapshot()
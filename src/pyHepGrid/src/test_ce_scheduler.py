@@ -0,0 +1,58 @@
+import pytest
+import pyHepGrid.src.ce_scheduler as ce_scheduler
+import pyHepGrid.src.header as header
+
+CES = ["ce1", "ce2"]
+
+
+def test_weight_free_cores():
+    scheduler = ce_scheduler.CEScheduler(CES, {"ce1": 99})
+    # CEs missing from the free cores have none free
+    assert scheduler.weight("ce1") == 100*scheduler.weight("ce2")
+    # All CEs count the same without any information
+    scheduler = ce_scheduler.CEScheduler(CES)
+    assert scheduler.weight("ce1") == scheduler.weight("ce2") == 1
+
+
+def test_weight_failures():
+    scheduler = ce_scheduler.CEScheduler(CES, outcomes={"ce1": (3, 3)})
+    assert scheduler.failure_rate("ce1") == pytest.approx(0.75)
+    assert scheduler.weight("ce1") == pytest.approx(0.25)
+    assert scheduler.weight("ce2") == 1
+
+
+def test_record_submission():
+    scheduler = ce_scheduler.CEScheduler(CES, {"ce1": 10, "ce2": 10})
+    # Two seconds per job
+    scheduler.record_submission("ce1", 8.0, 4, 3)
+    assert scheduler.free_cores["ce1"] == 7
+    assert scheduler.outcomes["ce1"] == [1, 4]
+    assert scheduler.weight("ce1") == pytest.approx(
+        8*(1 - 1/5)/(1 + 2.0/ce_scheduler.LATENCY_SCALE))
+    # Later calls only move the running mean of the latency
+    scheduler.record_submission("ce1", 0.0, 4, 4)
+    assert scheduler._latency["ce1"] == pytest.approx(
+        ce_scheduler.LATENCY_MEMORY*2.0)
+    assert scheduler.free_cores["ce1"] == 3
+    assert scheduler.weight("ce2") == 11
+
+
+def test_choose():
+    assert ce_scheduler.CEScheduler(["ce1"]).choose() == "ce1"
+    scheduler = ce_scheduler.CEScheduler(CES, outcomes={"ce1": (1, 0)})
+    # ce1 failed every job
+    assert scheduler.weight("ce1") == 0
+    assert {scheduler.choose() for i in range(20)} == {"ce2"}
+
+
+def test_get_pool(monkeypatch):
+    monkeypatch.setattr(header, "ce_pool", ["b", "a", "b"])
+    assert ce_scheduler.get_pool() == ["b", "a"]
+    assert ce_scheduler.get_pool(test=True) == [header.ce_test]
+    monkeypatch.setattr(header, "ce_pool", None)
+    monkeypatch.setattr(header, "split_dur_ce", True)
+    monkeypatch.setattr(header, "ce_base", "ce2.dur.scotgrid.ac.uk")
+    assert ce_scheduler.get_pool() == ["ce1.dur.scotgrid.ac.uk",
+                                       "ce2.dur.scotgrid.ac.uk"]
+    monkeypatch.setattr(header, "split_dur_ce", False)
+    assert ce_scheduler.get_pool() == ["ce2.dur.scotgrid.ac.uk"]
@@ -0,0 +1,125 @@
+import datetime
+import sqlite3
+import pyHepGrid.src.dbapi as dbapi
+import pyHepGrid.src.header as header
+
+TABLE = "arcjobs"
+
+
+def open_database(dbname, tables=(TABLE,), fields=None):
+    return dbapi.database(dbname, tables=list(tables),
+                          fields=fields or header.dbfields,
+                          logger=header.logger)
+
+
+def insert_run(dbase, iseed, jobids, table=TABLE):
+    with dbase.transaction():
+        rowid = dbase.insert_data(table, {"runcard": "a.run",
+                                          "runfolder": "tag",
+                                          "iseed": str(iseed),
+                                          "no_runs": str(len(jobids)),
+                                          "status": "active"})
+        dbase.insert_subjobs(table, rowid, jobids, first_seed=iseed)
+        dbase.record_seeds(table, rowid, iseed, len(jobids))
+    return rowid
+
+
+def test_migrates_legacy_database(tmp_path):
+    path = str(tmp_path / "jobs.dat")
+    legacy = sqlite3.connect(path)
+    legacy.execute("create table arcjobs (jobid text, date text, "
+                   "runcard text, runfolder text, status text, iseed text, "
+                   "sub_status text, no_runs text);")
+    legacy.execute("insert into arcjobs values ('a b c', '2020', 'r.run', "
+                   "'tag', 'active', '100', '1 0 -1', '3');")
+    legacy.commit()
+    legacy.close()
+
+    dbase = open_database(path)
+    assert dbase._schema_version() == len(dbapi.MIGRATIONS)
+    subjobs = dbase.list_subjobs(TABLE, 1)
+    assert [(i["seed"], i["jobid"], i["status"]) for i in subjobs] == \
+        [(100, "a", 1), (101, "b", 0), (102, "c", -1)]
+    # The ledger knows about the seeds of the legacy run
+    assert dbase.next_seed() == 103
+    # Opening it again doesn't migrate anything
+    open_database(path)
+    assert len(dbase.list_subjobs(TABLE, 1)) == 3
+
+
+def test_check_run_tables_after_migration(dbname):
+    open_database(dbname)
+    dbase = open_database(dbname, tables=[TABLE, "newprodjobs"],
+                          fields=header.dbfields + ["extra"])
+    assert dbase._is_this_table_here("newprodjobs")
+    assert dbase._is_field_in_table("newprodjobs_subjobs", "ce")
+    assert "extra" in dbase._get_fields_in_table(TABLE)
+    rowid = insert_run(dbase, 1, ["x", "y"], table="newprodjobs")
+    assert len(dbase.list_subjobs("newprodjobs", rowid)) == 2
+
+
+def test_reservations_never_overlap(dbname):
+    dbase = open_database(dbname)
+    first = dbase.reserve_seeds(10)
+    second = dbase.reserve_seeds(5)
+    assert second >= first + 10
+    assert dbase.next_seed() == second + 5
+
+
+def test_run_claims_reservation(dbname):
+    dbase = open_database(dbname)
+    first = dbase.reserve_seeds(10)
+    rowid = insert_run(dbase, first, ["x"]*10)
+    # Claimed reservations are kept
+    dbase.release_seeds(first)
+    assert dbase.next_seed() == first + 10
+    assert dbase.list_data(TABLE, ["iseed"], rowid)[0]["iseed"] == str(first)
+
+
+def test_release_unclaimed_reservation(dbname):
+    dbase = open_database(dbname)
+    insert_run(dbase, 1, ["x"]*5)
+    first = dbase.reserve_seeds(100)
+    dbase.release_seeds(first)
+    assert dbase.next_seed() == first
+
+
+def test_submission_journal(dbname):
+    dbase = open_database(dbname)
+    run = {"runcard": "a.run", "runfolder": "tag", "iseed": "50",
+           "no_runs": "4"}
+    submission = dbase.start_submission(TABLE, run)
+    # Its seeds are reserved as soon as it starts
+    assert dbase.next_seed() == 54
+    dbase.journal_jobs(submission, [(50, "j50", "ce1"), (51, "None", None)])
+    # A seed submitted again replaces its old job
+    dbase.journal_jobs(submission, [(51, "j51", "ce2")])
+    assert dbase.journaled_jobs(submission) == {50: ("j50", "ce1"),
+                                                51: ("j51", "ce2")}
+    assert [i["run"] for i in dbase.list_submissions(TABLE)] == [run]
+    dbase.finish_submission(submission)
+    assert dbase.list_submissions(TABLE) == []
+    assert dbase.journaled_jobs(submission) == {}
+
+
+def test_transitions_since_last_poll(dbname):
+    dbase = open_database(dbname)
+    rowid = insert_run(dbase, 1, ["x", "y"])
+    first_poll = datetime.datetime.now()
+    dbase.update_subjobs(TABLE, rowid, {1: 0, 2: 0}, first_poll)
+    second_poll = first_poll + datetime.timedelta(seconds=1)
+    dbase.update_subjobs(TABLE, rowid, {1: 2}, second_poll)
+    # The changes found by a poll are not listed again after it
+    transitions = dbase.list_transitions(TABLE, rowid, since=first_poll)
+    assert [(i["seed"], i["old_status"], i["new_status"])
+            for i in transitions] == [(1, 0, 2)]
+    assert dbase.list_transitions(TABLE, rowid, since=second_poll) == []
+
+
+def test_monitor_tables(dbname):
+    dbase = open_database(dbname)
+    assert dbase.get_monitor() is None
+    dbase.monitor_heartbeat("host", 1, "now", [TABLE])
+    assert dbase.get_monitor()["tables"] == [TABLE]
+    dbase.remove_monitor("host", 1)
+    assert dbase.get_monitor() is None
@@ -0,0 +1,34 @@
+import pytest
+import time
+import pyHepGrid.src.main_routines as main_routines
+
+
+def test_output_in_id_order(capsys, monkeypatch):
+    def manage(backend, args, db_id, jdx, no_ids, new_entry_status):
+        # The first ids finish last
+        time.sleep(0.01*(no_ids - jdx))
+        print("start", db_id)
+        new_entry_status[db_id] = jdx
+        print("end", db_id)
+
+    monkeypatch.setattr(main_routines, "_manage_single_id", manage)
+    new_entry_status = {}
+    main_routines._manage_concurrently(None, None, [5, 3, 8, 1], 4,
+                                       new_entry_status)
+    assert capsys.readouterr().out.split("\n") == [
+        "start 5", "end 5", "start 3", "end 3", "start 8", "end 8",
+        "start 1", "end 1", ""]
+    assert new_entry_status == {5: 1, 3: 2, 8: 3, 1: 4}
+
+
+def test_errors_after_earlier_output(capsys, monkeypatch):
+    def manage(backend, args, db_id, jdx, no_ids, new_entry_status):
+        print(db_id)
+        if db_id == 2:
+            raise SystemExit("job 2 failed")
+
+    monkeypatch.setattr(main_routines, "_manage_single_id", manage)
+    with pytest.raises(SystemExit, match="job 2 failed"):
+        main_routines._manage_concurrently(None, None, [1, 2, 3], 1, {})
+    # The output of the failing id is printed before its error is raised
+    assert capsys.readouterr().out.split("\n")[:2] == ["1", "2"]
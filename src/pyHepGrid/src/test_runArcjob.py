@@ -0,0 +1,82 @@
+import pytest
+import pyHepGrid.src.header as header
+import pyHepGrid.src.runArcjob as runArcjob
+import pyHepGrid.src.utilities as util
+
+
+@pytest.fixture
+def arc(dbname, fake_grid_state, monkeypatch):
+    """ ARC production of seeds 50-69 of a.run, in batches of 3 """
+    monkeypatch.setattr(header, "ce_pool", None)
+    monkeypatch.setattr(header, "arc_submit_batch", 3)
+    monkeypatch.setattr(header, "arc_submit_threads", 2)
+    monkeypatch.setattr(header, "baseSeed", 50)
+    monkeypatch.setattr(header, "producRun", 20)
+    monkeypatch.setattr(util, "expandCard",
+                        lambda: (["a.run"], {"a.run": "tag"}))
+    monkeypatch.setattr(util, "generatePath", lambda warmup: "/tmp/path")
+    arc = runArcjob.RunArc(prod=True,
+                           arcscript=header.ARCSCRIPTDEFAULTPRODUCTION)
+    monkeypatch.setattr(arc, "_get_prod_args", lambda runcard, tag, seed:
+                        arc._format_args({"seed": seed, "runcard": runcard}))
+    monkeypatch.setattr(arc, "check_for_existing_output", lambda *args: None)
+    return arc
+
+
+def test_production(arc):
+    arc.run_wrap_production()
+    rows = arc.dbase.list_data(arc.table, ["rowid", "iseed", "no_runs"])
+    assert [(i["iseed"], i["no_runs"]) for i in rows] == [("50", "20")]
+    subjobs = arc.dbase.list_subjobs(arc.table, rows[0]["rowid"],
+                                     ["seed", "jobid", "ce"])
+    assert [i["seed"] for i in subjobs] == list(range(50, 70))
+    assert len(set(i["jobid"] for i in subjobs)) == 20
+    assert all(i["ce"] and i["ce"] in i["jobid"] for i in subjobs)
+    assert arc.dbase.list_submissions(arc.table) == []
+
+
+def test_resume_interrupted_production(arc, monkeypatch):
+    submit = arc.run_batch_production
+    calls = []
+
+    def interrupted(args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return submit(args)
+
+    monkeypatch.setattr(arc, "run_batch_production", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        arc.run_wrap_production()
+    # Nothing is in the database yet, the journal has the jobs submitted
+    assert arc.dbase.list_data(arc.table, ["rowid"]) == []
+    submission = arc.dbase.list_submissions(arc.table)[0]["rowid"]
+    submitted = arc.dbase.journaled_jobs(submission)
+    assert 0 < len(submitted) < 20
+
+    # Without --resume the interrupted submission is not started again
+    monkeypatch.setattr(arc, "run_batch_production", submit)
+    with pytest.raises(SystemExit):
+        arc.run_wrap_production()
+
+    arc.run_wrap_production(resume=True)
+    rows = arc.dbase.list_data(arc.table, ["rowid"])
+    assert len(rows) == 1
+    subjobs = arc.dbase.list_subjobs(arc.table, rows[0]["rowid"])
+    assert [i["seed"] for i in subjobs] == list(range(50, 70))
+    assert len(set(i["jobid"] for i in subjobs)) == 20
+    # The jobs submitted before the interruption are kept
+    for subjob in subjobs:
+        if subjob["seed"] in submitted:
+            assert subjob["jobid"] == submitted[subjob["seed"]][0]
+    assert arc.dbase.list_submissions(arc.table) == []
+
+
+def test_failed_production_releases_seeds(arc, monkeypatch):
+    next_seed = arc.dbase.next_seed()
+    monkeypatch.setattr(arc, "run_batch_production",
+                        lambda args: [("None", None)]*3)
+    with pytest.raises(SystemExit):
+        arc.run_wrap_production()
+    assert arc.dbase.next_seed() == next_seed
+    assert arc.dbase.list_submissions(arc.table) == []
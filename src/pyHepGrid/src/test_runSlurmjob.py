@@ -0,0 +1,65 @@
+import os
+import pytest
+import pyHepGrid.src.header as header
+import pyHepGrid.src.program_interface as program_interface
+import pyHepGrid.src.runSlurmjob as runSlurmjob
+import pyHepGrid.src.utilities as util
+
+RUNCARDS = ["a.run", "b.run", "c.run"]
+
+
+@pytest.fixture
+def slurm(dbname, fake_grid_state, tmp_path, monkeypatch):
+    """ Packed SLURM production of seeds 11-13 of three runcards, with at
+    most 7 tasks per array """
+    run_dir = str(tmp_path / "run")
+    monkeypatch.setattr(header, "local_run_directory", run_dir)
+    monkeypatch.setattr(program_interface, "local_run_directory", run_dir)
+    monkeypatch.setattr(header, "slurm_pack_runcards", True)
+    monkeypatch.setattr(header, "slurm_pack_max_tasks", 7)
+    monkeypatch.setattr(header, "baseSeed", 10)
+    monkeypatch.setattr(header, "producRun", 3)
+    monkeypatch.setattr(header, "production_queue", None)
+    monkeypatch.setattr(util, "expandCard",
+                        lambda: (RUNCARDS, {r: "tag" for r in RUNCARDS}))
+    slurm = runSlurmjob.RunSlurm(prod=True)
+    monkeypatch.setattr(slurm, "check_for_existing_output_local",
+                        lambda *args: None)
+    return slurm
+
+
+def test_lookup(slurm):
+    lookup = slurm._write_lookup([("a.run", "/runs/a", 11),
+                                  ("b.run", "/runs/b", 12)])
+    assert os.path.dirname(lookup) == os.path.join(
+        header.local_run_directory, "slurm_packs")
+    with open(lookup) as f:
+        lines = [line.rstrip("\n").split("\t") for line in f]
+    assert lines == [["a.run", "/runs/a", "/runs/a/stdout/", "11"],
+                     ["b.run", "/runs/b", "/runs/b/stdout/", "12"]]
+
+
+def test_packed_production(slurm):
+    slurm.run_wrap_production()
+    rows = slurm.dbase.list_data(slurm.table, ["rowid", "runcard", "iseed"])
+    assert [(i["runcard"], i["iseed"]) for i in rows] == \
+        [(r, "10") for r in RUNCARDS]
+    jobids = [[j["jobid"] for j in slurm.dbase.list_subjobs(
+        slurm.table, i["rowid"])] for i in rows]
+    # a.run and b.run share the first array, c.run has its own
+    first, second = jobids[0][0].split("_")[0], jobids[2][0].split("_")[0]
+    assert first != second
+    assert jobids == [[first + "_1", first + "_2", first + "_3"],
+                      [first + "_4", first + "_5", first + "_6"],
+                      [second + "_1", second + "_2", second + "_3"]]
+
+
+def test_custom_template_is_not_packed(slurm, monkeypatch):
+    assert slurm._can_pack()
+    monkeypatch.setattr(header, "slurm_template_production", "custom.sh")
+    assert not slurm._can_pack()
+    monkeypatch.setattr(header, "slurm_template_production",
+                        runSlurmjob.DEFAULT_PRODUCTION_TEMPLATE)
+    monkeypatch.setattr(runSlurmjob.RunSlurm, "include_arguments",
+                        lambda self, args: args)
+    assert not slurm._can_pack()
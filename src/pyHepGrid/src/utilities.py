@@ -12,14 +12,18 @@ import os
 import re
 import shutil
 import subprocess
+import sys
 from sys import version_info
 import tarfile
+import threading
 from uuid import uuid4
 
 import pyHepGrid.src.header as header
 # ------------------------- Misc. Utilities -------------------------
 MAX_COPY_TRIES = 5
 PROTOCOLS = ["xroot", "gsiftp", "dav"]
+# Most files removed by a single gfal-rm call in GridWrap.delete_many
+GFAL_RM_BATCH = 50
 
 
 def pythonVersion():
@@ -42,6 +46,14 @@ def spCall(cmd, suppress_errors=False, shell=False):
         cmd = [" ".join(cmd)]
     try:
         header.logger.debug(cmd)
+        capturing = getattr(sys.stdout, "is_capturing", None)
+        if not suppress_errors and capturing is not None and capturing():
+            # The output of this thread is being collected (concurrent
+            # management), so it has to go through sys.stdout
+            result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, shell=shell)
+            sys.stdout.write(result.stdout.decode("utf-8", "replace"))
+            return result.returncode
         if not suppress_errors:
             return subprocess.call(cmd, shell=shell)
         else:
@@ -279,6 +291,11 @@ class TarWrap:
 
 
 # ------------------------- Grid Utilities -------------------------
+# {grid directory: set of file names}, listed once per invocation
+_dir_index = {}
+_dir_index_lock = threading.Lock()
+
+
 class GridWrap:
     """
     Wrapper class for GFAL file utilities.
@@ -347,6 +364,42 @@ class GridWrap:
         output = getOutputCall(cmd, include_return_code=False)
         return output
 
+    def get_dir_index(self, directory):
+        """ Set of the names of the files in directory. The directory is
+        only listed the first time it is asked for, so the listing is shared
+        by all runcards (and GridWraps) of the invocation. Files removed with
+        delete_many are taken out of it """
+        gridname = os.path.join(header.gfaldir, directory)
+        with _dir_index_lock:
+            if gridname not in _dir_index:
+                _dir_index[gridname] = set(
+                    self.get_dir_contents(directory).split())
+            return _dir_index[gridname]
+
+    def delete_many(self, files, whereFrom):
+        """ Removes files from whereFrom with gfal-rm calls of up to
+        GFAL_RM_BATCH files each, running concurrently. Returns the files of
+        the calls which failed """
+        import pyHepGrid.src.executor as executor
+        files = list(files)
+        batches = [files[i:i + GFAL_RM_BATCH]
+                   for i in range(0, len(files), GFAL_RM_BATCH)]
+
+        def remove(batch):
+            cmd = ["gfal-rm"] + [os.path.join(header.gfaldir, whereFrom, f)
+                                 for f in batch]
+            return spCall(cmd, suppress_errors=True)
+
+        retcodes = executor.run_all(remove, batches, family="gfal")
+        failed = [f for batch, retcode in zip(batches, retcodes)
+                  if retcode != 0 for f in batch]
+        gridname = os.path.join(header.gfaldir, whereFrom)
+        with _dir_index_lock:
+            if gridname in _dir_index:
+                _dir_index[gridname].difference_update(
+                    set(files) - set(failed))
+        return failed
+
 
 def gfal_copy(infile, outfile, maxrange=MAX_COPY_TRIES, force=False):
     header.logger.info("Copying {0} to {1}".format(infile, outfile))